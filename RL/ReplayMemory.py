@@ -27,7 +27,8 @@ class ReplayMemory(object):
         """Creates `Transition` and insert
         Args:
             state (np.ndarray): 1-D tensor of shape (input_dim,)
-            action (int): action index (0 <= action < output_dim)
+            action (int): action index (0 <= action < output_dim), or an array of the questions
+                asked together (top-k acquisition), padded with -1 to a fixed length
             reward (int): reward value
             next_state (np.ndarray): 1-D tensor of shape (input_dim,)
             done (bool): whether this state was last step
@@ -51,3 +52,19 @@ class ReplayMemory(object):
     def __len__(self) -> int:
         """Returns the length """
         return len(self.memory)
+
+    def state_dict(self) -> dict:
+        """Returns the contents packed into arrays (one array per `Transition` field)
+        and the cursor, for saving the training state
+        """
+        packed = {field: np.array([getattr(x, field) for x in self.memory])
+                  for field in Transition._fields}
+        packed['cursor'] = self.cursor
+        return packed
+
+    def load_state_dict(self, packed: dict) -> None:
+        """ Restores the contents saved by `state_dict` """
+        n = len(packed['action'])
+        self.memory = [Transition(*(packed[field][i] for field in Transition._fields))
+                       for i in range(n)]
+        self.cursor = packed['cursor']
@@ -58,13 +58,13 @@ class Agent(object):
             target_param.data.copy_(param.data)
 
     def _to_variable(self, x: np.ndarray) -> torch.Tensor:
-        """torch.Variable syntax helper
+        """Wraps a float32 array as a tensor without copying it (other dtypes are converted once)
         Args:
             x (np.ndarray): 2-D tensor of shape (n, input_dim)
         Returns:
-            torch.Tensor: torch variable
+            torch.Tensor: float32 tensor
         """
-        return torch.autograd.Variable(torch.Tensor(x))
+        return torch.from_numpy(np.ascontiguousarray(x, dtype=np.float32))
 
     def get_action(self, states: np.ndarray, env,
                    eps: float,
@@ -89,6 +89,39 @@ class Agent(object):
             _, argmax = torch.max(scores.data * mask, 1)
             return int(argmax.item())
 
+    def get_actions(self, states: np.ndarray, env,
+                    eps: float,
+                    mask: np.ndarray, mode, k: int) -> list:
+        """Returns up to k questions to ask together, or the guess alone (top-k acquisition)
+        Args:
+            states (np.ndarray): 2-D tensor of shape (n, input_dim)
+            eps (float): 𝜺-greedy for exploration
+            mask (np.ndarray) zeroes out q values for questions that were already asked
+            k (int): most questions per step
+        Returns:
+            list: action indices, the k best unasked questions by Q-value unless the best action is the guess
+        """
+        if k == 1:
+            return [self.get_action(states, env, eps, mask, mode)]
+        guess = self.output_dim - 1
+        k = min(k, int(mask[:guess].sum()))
+        if np.random.rand() < eps and mode == 'training':
+            array_probs = (env.action_probs * mask).cpu().detach().numpy()
+            array_probs = array_probs / array_probs.sum()
+            if k == 0 or np.random.choice(self.output_dim, p=array_probs) == guess:
+                return [guess]
+            question_probs = array_probs[:guess] / array_probs[:guess].sum()
+            return np.random.choice(guess, size=k, replace=False, p=question_probs).tolist()
+
+        else:
+            self.dqn.train(mode=False)
+            scores = self.get_Q(states).data * mask
+            if k == 0 or int(torch.argmax(scores, 1).item()) == guess:
+                return [guess]
+            # asked questions are excluded even when every Q-value is negative
+            questions = scores[0, :guess].masked_fill(mask[:guess] == 0, -np.inf)
+            return torch.topk(questions, k).indices.tolist()
+
     def get_action_not_guess(self, states: np.ndarray, env,
                              eps: float,
                              mask: np.ndarray, mode) -> int:
@@ -0,0 +1,118 @@
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+from RL.checkpoint import snapshot_state_dict
+from RL.shared_arrays import share_array, attach_array
+
+ValResult = namedtuple("ValResult",
+                       field_names=["i_episode",
+                                    "acc",
+                                    "n_patients",
+                                    "snapshot"])
+
+# (main_al, env, agent, shared blocks) of the validation process, set by _init_evaluator
+_EVALUATOR = None
+
+
+def _init_evaluator(x_spec, y_spec, question_names, flags, hidden_dim, threads):
+    global _EVALUATOR
+    import main_al
+    x_block, X = attach_array(x_spec)
+    y_block, y = attach_array(y_spec)
+    vars(main_al.FLAGS).update(vars(flags))
+    torch.set_num_threads(threads)
+    # same data, so the same stored split (read from its cache) and validation patients
+    env = main_al.myEnv(flags=main_al.FLAGS, device=torch.device('cpu'), load_pretrained_guesser=False,
+                        data=(X, y, question_names))
+    input_dim, output_dim = main_al.get_env_dim(env)
+    agent = main_al.Agent(input_dim, output_dim, hidden_dim, flags.lr, flags.weight_decay)
+    _EVALUATOR = (main_al, env, agent, [x_block, y_block])
+
+
+def _evaluate(i_episode, dqn_state, guesser_state, best_val_acc):
+    main_al, env, agent, _ = _EVALUATOR
+    agent.dqn.load_state_dict(dqn_state)
+    env.guesser.load_state_dict(guesser_state)
+    if main_al.FLAGS.val_chunk > 0:
+        acc, _, n = main_al.sequential_val_accuracy(env, agent, best_val_acc,
+                                                    main_al.FLAGS.val_chunk, main_al.FLAGS.val_z)
+    else:
+        acc, n = main_al.val_accuracy(env, agent), len(env.y_val)
+    return i_episode, float(acc), n
+
+
+class AsyncValidator(object):
+    def __init__(self, env, agent, flags, threads: int = 1) -> None:
+        """Validates frozen snapshots of the dqn and guesser in a separate process
+        `submit` clones the weights and returns at once, training goes on while the validation
+        process plays the validation patients; `poll` hands back the finished results in
+        submission order. One snapshot is validated at a time and at most one waits for it: a
+        newer snapshot replaces the waiting one, so a slow validation never queues up (or pauses)
+        training. The waiting snapshot is kept here, not in the process pool, whose call queue
+        holds work that can no longer be cancelled.
+        Snapshots still in flight when training stops are not part of the --resume state: their
+        results are lost if the run is killed before `close`.
+        The dataset is put in shared memory once, the validation process maps it.
+        Args:
+            env (myEnv): training environment (its dataset and split are used)
+            agent (Agent): training agent (its dqn dimensions are used)
+            flags: main_al FLAGS (episode_length, val_chunk, val_z, ...)
+            threads (int): torch threads of the validation process
+        """
+        X, y = np.ascontiguousarray(env.guesser.X), np.ascontiguousarray(env.guesser.y)
+        self.x_block, x_spec = share_array(X)
+        self.y_block, y_spec = share_array(y)
+        # spawn: forking a process that already runs torch threads can deadlock
+        self.pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_init_evaluator,
+                                        initargs=(x_spec, y_spec, env.guesser.question_names, flags,
+                                                  agent.dqn.hidden_dim, threads))
+        self.running = None
+        self.waiting = None
+        self.dropped = 0
+
+    def submit(self, i_episode: int, env, agent, best_val_acc: float) -> None:
+        """Queues the validation of the current networks
+        Args:
+            i_episode (int): episode of the snapshot
+            best_val_acc (float): best accuracy so far, the bound of sequential validation
+        """
+        snapshot = {'guesser': snapshot_state_dict(env.guesser), 'dqn': snapshot_state_dict(agent.dqn)}
+        if self.waiting is not None:
+            self.dropped += 1
+        self.waiting = (i_episode, snapshot, best_val_acc)
+        if self.running is None:
+            self._start_waiting()
+
+    def _start_waiting(self) -> None:
+        i_episode, snapshot, best_val_acc = self.waiting
+        self.waiting = None
+        future = self.pool.submit(_evaluate, i_episode,
+                                  {k: v.cpu() for k, v in snapshot['dqn'].items()},
+                                  {k: v.cpu() for k, v in snapshot['guesser'].items()},
+                                  best_val_acc)
+        self.running = (future, snapshot)
+
+    def poll(self, wait: bool = False) -> list:
+        """ Returns the finished results (ValResult) in submission order, all of them if `wait` """
+        results = []
+        while self.running is not None and (wait or self.running[0].done()):
+            future, snapshot = self.running
+            self.running = None
+            i_episode, acc, n = future.result()
+            results.append(ValResult(i_episode, acc, n, snapshot))
+            if self.waiting is not None:
+                self._start_waiting()
+        return results
+
+    def close(self) -> list:
+        """ Waits for the queued validations, stops the process and returns the remaining results """
+        try:
+            return self.poll(wait=True)
+        finally:
+            self.pool.shutdown()
+            for block in (self.x_block, self.y_block):
+                block.close()
+                block.unlink()
@@ -0,0 +1,14 @@
+"""Benchmarks of the RL hot paths on synthetic data
+
+    python -m RL.benchmarks.micro --out bench_micro.json
+    python -m RL.benchmarks.e2e --baseline bench_e2e_baseline.json
+    python -m RL.benchmarks.imports --budget_ms 300
+    python -m RL.benchmarks.smoke
+"""
+import os
+import sys
+
+# agent.py / main_al.py import their siblings by bare name (from dqn import DQN), as when run from RL/
+RL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RL_DIR not in sys.path:
+    sys.path.insert(0, RL_DIR)
@@ -0,0 +1,153 @@
+"""End-to-end throughput benchmark of the main_al training loop, with a regression gate
+
+Runs main_al.train for a fixed number of episodes with a fixed seed on a synthetic dataset,
+then one test pass, and reports episodes/sec, learner updates/sec, time to N episodes,
+test pass time and peak RSS. The numbers are compared with a stored baseline and the process
+exits with status 1 if any of them is worse by more than the tolerance:
+
+    python -m RL.benchmarks.e2e --baseline bench_e2e_baseline.json --tolerance 0.15
+    python -m RL.benchmarks.e2e --baseline bench_e2e_baseline.json --update_baseline 1
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+
+import RL.benchmarks  # noqa: F401 (puts RL/ on sys.path)
+from RL.benchmarks.synthetic import DATASETS, make_dataset
+import main_al
+from main_al import myEnv, Agent, get_env_dim
+
+# metric: True if higher is better
+METRICS = {
+    'episodes_per_sec': True,
+    'updates_per_sec': True,
+    'time_to_n_episodes_s': False,
+    'test_pass_s': False,
+    'peak_rss_mb': False,
+}
+
+
+def peak_rss_mb():
+    """ Peak resident set size of this process in MB, None where it can not be measured """
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / 1024. ** 2 if sys.platform == 'darwin' else rss / 1024.
+    except ImportError:
+        try:
+            import psutil
+            info = psutil.Process().memory_info()
+            return getattr(info, 'peak_wset', info.rss) / 1024. ** 2
+        except ImportError:
+            return None
+
+
+def run(dataset: str, n_episodes: int, n_samples: int, seed: int) -> dict:
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+    # fixed episode count: no early stopping, resume snapshots or profiling
+    main_al.FLAGS.val_trials_wo_im = sys.maxsize
+    main_al.FLAGS.resume = 0
+    main_al.FLAGS.resume_interval = sys.maxsize
+    main_al.FLAGS.profile = 0
+
+    env = myEnv(flags=main_al.FLAGS, device=main_al.device, load_pretrained_guesser=False,
+                data=make_dataset(DATASETS[dataset], n_samples=n_samples, seed=seed))
+    input_dim, output_dim = get_env_dim(env)
+    agent = Agent(input_dim, output_dim, main_al.FLAGS.hidden_dim, main_al.FLAGS.lr, main_al.FLAGS.weight_decay)
+    agent.dqn.to(device=main_al.device)
+    env.guesser.to(device=main_al.device)
+
+    start = time.perf_counter()
+    stats = main_al.train(env, agent, checkpoints=None, n_episodes=n_episodes)
+    train_s = time.perf_counter() - start
+    updates = agent.scheduler.last_epoch  # the lr scheduler steps once per learner update
+
+    start = time.perf_counter()
+    test_acc = main_al.test(env, agent, input_dim, output_dim, load_best=False)
+    test_s = time.perf_counter() - start
+
+    return {'dataset': dataset,
+            'n_episodes': stats['episodes'],
+            'seed': seed,
+            'episodes_per_sec': stats['episodes'] / train_s,
+            'updates_per_sec': updates / train_s,
+            'time_to_n_episodes_s': train_s,
+            'test_pass_s': test_s,
+            'peak_rss_mb': peak_rss_mb(),
+            'best_val_acc': float(stats['best_val_acc']),
+            'test_acc': float(test_acc)}
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Returns a list of regression messages, one per metric worse than the baseline by more than `tolerance`
+    (relative, e.g. 0.1 = 10%)
+    """
+    regressions = []
+    for metric, higher_is_better in METRICS.items():
+        new, old = result.get(metric), baseline.get(metric)
+        if new is None or not old:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        status = 'REGRESSION' if worse > tolerance else 'ok'
+        print('{:<22}{:>12.3f}{:>12.3f}{:>+9.1%}  {}'.format(metric, old, new, change, status))
+        if worse > tolerance:
+            regressions.append('{} {:.3f} -> {:.3f} ({:+.1%})'.format(metric, old, new, change))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--dataset", type=str, default='diabetes',
+                        help="Synthetic dataset size: " + ', '.join(DATASETS))
+    parser.add_argument("--n_episodes", type=int, default=1000, help="Number of training episodes")
+    parser.add_argument("--n_samples", type=int, default=5000, help="Synthetic patients")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--baseline", type=str, default='bench_e2e_baseline.json', help="Baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative slowdown")
+    parser.add_argument("--update_baseline", type=int, default=0, help="Whether to store this run as the baseline")
+    parser.add_argument("--out", type=str, default='bench_e2e.json', help="Output JSON file of this run")
+    flags = parser.parse_args(args)
+
+    baseline_path, out = os.path.abspath(flags.baseline), os.path.abspath(flags.out)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)  # checkpoints and caches of the synthetic run are discarded
+        try:
+            result = run(flags.dataset, flags.n_episodes, flags.n_samples, flags.seed)
+        finally:
+            os.chdir(cwd)
+
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=1)
+    print(json.dumps(result, indent=1))
+
+    if flags.update_baseline or not os.path.exists(baseline_path):
+        with open(baseline_path, 'w') as f:
+            json.dump(result, f, indent=1)
+        print('Stored baseline in {}'.format(baseline_path))
+        return 0
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if (baseline.get('dataset'), baseline.get('n_episodes')) != (result['dataset'], result['n_episodes']):
+        print('Baseline was run with a different dataset / episode count, not comparable')
+        return 2
+    regressions = compare(result, baseline, flags.tolerance)
+    if regressions:
+        print('Performance regressions beyond {:.0%}:\n  '.format(flags.tolerance) + '\n  '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
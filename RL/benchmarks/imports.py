@@ -0,0 +1,72 @@
+"""Import-time budget of the RL modules
+
+Imports each module in a fresh interpreter and checks that
+  * the import takes less than the budget, not counting numpy / torch (which every module needs)
+  * no plotting / dataframe / sklearn module is pulled in by the import alone
+and exits with status 1 otherwise:
+
+    python -m RL.benchmarks.imports --budget_ms 300
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+from RL.benchmarks import RL_DIR
+
+MODULES = ['RL.guesser', 'RL.env', 'RL.model_artifact', 'RL.metrics', 'RL.profiling', 'main_al']
+
+# only the functions that need these import them
+HEAVY = ['matplotlib', 'sklearn', 'pandas', 'fastai', 'shap', 'nltk', 'PIL']
+
+_CHILD = """
+import importlib, json, sys, time
+sys.path.insert(0, {rl_dir!r})
+import numpy, torch
+start = time.perf_counter()
+importlib.import_module({module!r})
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'heavy': sorted(m for m in {heavy!r} if m in sys.modules)}}))
+"""
+
+
+def measure(module: str, repeats: int = 3) -> dict:
+    """Imports `module` in `repeats` fresh interpreters (numpy / torch already imported)
+    Returns:
+        dict: module, best import time in ms, heavy modules loaded by the import
+    """
+    code = _CHILD.format(rl_dir=RL_DIR, module=module, heavy=HEAVY)
+    times, heavy = [], []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        times.append(r['seconds'])
+        heavy = r['heavy']
+    return {'module': module, 'import_ms': 1e3 * min(times), 'heavy': heavy}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--modules", type=str, default=','.join(MODULES), help="Comma separated modules to import")
+    parser.add_argument("--budget_ms", type=float, default=300., help="Import time budget per module")
+    parser.add_argument("--repeats", type=int, default=3, help="Fresh interpreters per module (the best is kept)")
+    flags = parser.parse_args(args)
+
+    failures = []
+    for module in flags.modules.split(','):
+        r = measure(module, flags.repeats)
+        over = r['import_ms'] > flags.budget_ms
+        print('{:<22}{:>10.1f} ms  {}{}'.format(module, r['import_ms'], 'OVER BUDGET' if over else 'ok',
+                                               '  loads ' + ', '.join(r['heavy']) if r['heavy'] else ''))
+        if over:
+            failures.append('{} imports in {:.1f} ms (budget {:.0f} ms)'.format(module, r['import_ms'], flags.budget_ms))
+        if r['heavy']:
+            failures.append('{} imports {} at import time'.format(module, ', '.join(r['heavy'])))
+    if failures:
+        print('Import-time budget exceeded:\n  ' + '\n  '.join(failures))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""Microbenchmarks of the RL hot paths
+
+Times myEnv.reset / step, Agent.get_action, ReplayMemory.push / pop, train_helper and the
+guesser forward pass in isolation, for synthetic datasets as wide as the real ones, and writes
+the results to JSON:
+
+    {"schema": "rladaptive-micro", "schema_version": 1, "created": ..., "environment": {...},
+     "results": [{"benchmark", "dataset", "n_features", "calls", "mean_us", "median_us", "min_us"}]}
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import numpy as np
+import torch
+
+import RL.benchmarks  # noqa: F401 (puts RL/ on sys.path)
+from RL.benchmarks.synthetic import DATASETS, make_dataset
+import main_al
+from main_al import myEnv, Agent, ReplayMemory, train_helper, get_env_dim
+
+SCHEMA_VERSION = 1
+
+
+def time_calls(fn, n_calls: int, repeats: int = 5) -> dict:
+    """Times `n_calls` calls of `fn`, `repeats` times
+    Returns:
+        dict: calls, mean / median / min time per call in microseconds (over the repeats)
+    """
+    fn()  # warm up
+    per_call = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(n_calls):
+            fn()
+        per_call.append(1e6 * (time.perf_counter() - start) / n_calls)
+    return {'calls': n_calls * repeats,
+            'mean_us': float(np.mean(per_call)),
+            'median_us': float(np.median(per_call)),
+            'min_us': float(np.min(per_call))}
+
+
+def build(n_features: int, n_samples: int, capacity: int, seed: int = 0):
+    """ Builds an env, an agent and a full replay memory on synthetic data (guesser not trained online, as in main_al) """
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    env = myEnv(flags=main_al.FLAGS, device=main_al.device, load_pretrained_guesser=False,
+                data=make_dataset(n_features, n_samples=n_samples, seed=seed))
+    input_dim, output_dim = get_env_dim(env)
+    agent = Agent(input_dim, output_dim, main_al.FLAGS.hidden_dim, main_al.FLAGS.lr, main_al.FLAGS.weight_decay)
+    agent.dqn.to(device=main_al.device)
+    env.guesser.to(device=main_al.device)
+
+    replay_memory = ReplayMemory(capacity)
+    while len(replay_memory) < capacity:
+        s = env.reset(train_guesser=False)
+        mask = env.reset_mask()
+        for t in range(main_al.FLAGS.episode_length):
+            a = agent.get_action(s, env, 1., mask, 'training')
+            s2, r, done, _ = env.step(a, mask)
+            mask[a] = 0
+            replay_memory.push(s, a, r, s2, done)
+            s = s2
+            if done:
+                break
+    return env, agent, replay_memory
+
+
+def run_dataset(name: str, n_features: int, n_calls: int, n_samples: int, capacity: int, batch_size: int):
+    env, agent, replay_memory = build(n_features, n_samples, capacity)
+    question = 0
+    guess = env.guesser.features_size
+
+    def reset():
+        return env.reset(train_guesser=False)
+
+    def step_question():
+        reset()
+        env.step(question, env.reset_mask())
+
+    def step_guess():
+        reset()
+        env.step(guess, env.reset_mask())
+
+    state = reset()
+    mask = env.reset_mask()
+    transition = replay_memory.memory[0]
+    guesser_input = torch.from_numpy(state[:env.guesser.features_size]).to(device=main_al.device)
+    minibatch = replay_memory.pop(batch_size)
+
+    def guesser_forward():
+        with torch.no_grad():
+            env.guesser(guesser_input)
+
+    benchmarks = {
+        'env.reset': reset,
+        # reset is included, so that the patient state does not run out of questions
+        'env.step(question)+reset': step_question,
+        'env.step(guess)+reset': step_guess,
+        'agent.get_action(greedy)': lambda: agent.get_action(state, env, 0., mask, 'training'),
+        'agent.get_action(explore)': lambda: agent.get_action(state, env, 1., mask, 'training'),
+        'replay.push': lambda: replay_memory.push(*transition),
+        'replay.pop({})'.format(batch_size): lambda: replay_memory.pop(batch_size),
+        'train_helper({})'.format(batch_size): lambda: train_helper(agent, minibatch, main_al.FLAGS.gamma),
+        'guesser.forward': guesser_forward,
+    }
+    results = []
+    for bench, fn in benchmarks.items():
+        calls = n_calls // 10 if bench.startswith('train_helper') else n_calls
+        r = time_calls(fn, max(calls, 1))
+        r.update(benchmark=bench, dataset=name, n_features=n_features)
+        results.append(r)
+        print('{:<12}{:<28}{:>10.1f} us'.format(name, bench, r['median_us']))
+    return results
+
+
+def environment_info() -> dict:
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'torch': torch.__version__,
+            'device': str(main_al.device),
+            'threads': torch.get_num_threads()}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--datasets", type=str, default=','.join(DATASETS),
+                        help="Comma separated dataset sizes to run: " + ', '.join(DATASETS))
+    parser.add_argument("--n_calls", type=int, default=1000, help="Calls per timing repeat")
+    parser.add_argument("--n_samples", type=int, default=2000, help="Synthetic patients per dataset")
+    parser.add_argument("--capacity", type=int, default=2000, help="Replay memory capacity")
+    parser.add_argument("--batch_size", type=int, default=main_al.FLAGS.batch_size, help="Mini-batch size")
+    parser.add_argument("--out", type=str, default='bench_micro.json', help="Output JSON file")
+    flags = parser.parse_args(args)
+
+    out = os.path.abspath(flags.out)
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)  # split / score caches of the synthetic data stay out of the working directory
+        try:
+            for name in flags.datasets.split(','):
+                results += run_dataset(name, DATASETS[name], flags.n_calls, flags.n_samples,
+                                       flags.capacity, flags.batch_size)
+        finally:
+            os.chdir(cwd)
+
+    report = {'schema': 'rladaptive-micro',
+              'schema_version': SCHEMA_VERSION,
+              'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'environment': environment_info(),
+              'results': results}
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=1)
+    print('Saved results to {}'.format(out))
+    return report
+
+
+if __name__ == '__main__':
+    main()
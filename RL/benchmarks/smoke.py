@@ -0,0 +1,79 @@
+"""Smoke run of main_al training and evaluation under combinations of the acquisition flags
+
+Trains a few episodes on a small synthetic dataset, then validates and tests, once per flag
+combination, and exits with status 1 if any combination raises:
+
+    python -m RL.benchmarks.smoke --n_episodes 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import traceback
+import numpy as np
+import torch
+
+import RL.benchmarks  # noqa: F401 (puts RL/ on sys.path)
+from RL.benchmarks.synthetic import make_dataset
+import main_al
+from main_al import myEnv, Agent, get_env_dim
+
+# flag overrides per run, every pair of the acquisition modes included
+COMBINATIONS = [
+    {},
+    {'acquire_k': 2},
+    {'stop_confidence': .6},
+    {'acquire_k': 2, 'stop_confidence': .6},
+    {'acquire_k': 3, 'stop_confidence': .6, 'val_chunk': 20},
+]
+
+
+def run(overrides: dict, n_episodes: int, n_samples: int, seed: int = 0) -> None:
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    defaults = main_al.parser.parse_args(args=[])
+    vars(main_al.FLAGS).update(vars(defaults))
+    vars(main_al.FLAGS).update(overrides)
+    main_al.FLAGS.resume = 0
+    main_al.FLAGS.eval_cache = ''
+    main_al.FLAGS.val_interval = max(n_episodes // 2, 1)
+    main_al.EVAL_CACHE.configure(None)
+    main_al.REPORT.configure(os.getcwd())
+
+    env = myEnv(flags=main_al.FLAGS, device=main_al.device, load_pretrained_guesser=False,
+                data=make_dataset(8, n_samples=n_samples, seed=seed))
+    input_dim, output_dim = get_env_dim(env)
+    agent = Agent(input_dim, output_dim, main_al.FLAGS.hidden_dim, main_al.FLAGS.lr, main_al.FLAGS.weight_decay)
+    main_al.train(env, agent, checkpoints=None, n_episodes=n_episodes)
+    main_al.test(env, agent, input_dim, output_dim, load_best=False)
+    main_al.confidence_tradeoff(env, agent, [.6, .9])
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--n_episodes", type=int, default=200, help="Training episodes per combination")
+    parser.add_argument("--n_samples", type=int, default=500, help="Synthetic patients")
+    flags = parser.parse_args(args)
+
+    failures = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)  # checkpoints, splits and reports of the runs are discarded
+        try:
+            for overrides in COMBINATIONS:
+                print('=== {}'.format(overrides or 'defaults'))
+                try:
+                    run(overrides, flags.n_episodes, flags.n_samples)
+                except Exception:
+                    traceback.print_exc()
+                    failures.append(overrides)
+            main_al.REPORT.wait()
+        finally:
+            os.chdir(cwd)
+    for overrides in failures:
+        print('FAILED: {}'.format(overrides))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
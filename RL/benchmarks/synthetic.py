@@ -0,0 +1,32 @@
+import numpy as np
+
+# feature counts of the real datasets, the synthetic data mimics their width
+DATASETS = {
+    'diabetes': 8,
+    'covid': 15,
+    'questionnaire50': 50,
+    'questionnaire100': 100,
+    'mnist': 784,
+}
+
+
+def make_dataset(n_features: int, n_samples: int = 2000, n_classes: int = 2, seed: int = 0):
+    """Synthetic classification data with the shape and dtype of the loaders' output
+    Args:
+        n_features (int): number of features
+        n_samples (int): number of patients
+        n_classes (int): number of classes
+        seed (int): random seed
+    Returns:
+        np.ndarray: float32 features of shape (n_samples, n_features)
+        np.ndarray: int labels, depending on a few features
+        np.ndarray: feature names
+    """
+    rng = np.random.RandomState(seed)
+    X = rng.randn(n_samples, n_features).astype(np.float32)
+    w = np.zeros((n_features, n_classes), dtype=np.float32)
+    informative = rng.choice(n_features, min(5, n_features), replace=False)
+    w[informative] = rng.randn(len(informative), n_classes)
+    y = np.argmax(X @ w + .5 * rng.randn(n_samples, n_classes), axis=1).astype(int)
+    question_names = np.array(['f{}'.format(i) for i in range(n_features)])
+    return X, y, question_names
@@ -0,0 +1,102 @@
+import os
+import queue
+import shutil
+import threading
+from collections import deque
+import torch
+
+
+def snapshot_state_dict(module: torch.nn.Module) -> dict:
+    """ Detached clones of the module tensors (on their current device), safe to write while training goes on """
+    return {k: v.detach().clone() for k, v in module.state_dict().items()}
+
+
+def publish_alias(src: str, alias: str) -> None:
+    """ Points `alias` at the file `src` by a hard link, or by a copy where links are not supported """
+    try:
+        if os.path.exists(alias + '~'):
+            os.remove(alias + '~')
+        os.link(src, alias + '~')
+    except OSError:
+        shutil.copyfile(src, alias + '~')
+    os.replace(alias + '~', alias)
+
+
+class CheckpointWriter(object):
+    def __init__(self, save_dir: str, keep: int = 5) -> None:
+        """Writes network checkpoints on a background thread
+        `save` only clones the state_dicts, the cpu copy and `torch.save` happen on the writer thread.
+        Files are written to `<path>~` and renamed, so a reader never sees a partial checkpoint.
+        At most `keep` episode checkpoints are kept, and 'best_<name>.pth' is an alias of the
+        newest best checkpoint instead of a second write.
+        Args:
+            save_dir (str): directory of the checkpoints
+            keep (int): number of episode checkpoints to keep, older ones are deleted
+        """
+        self.save_dir = save_dir
+        self.keep = keep
+        self.history = deque()
+        self.error = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def save(self, i_episode: int, networks: dict, val_acc: float, best: bool = False) -> None:
+        """Queues a checkpoint of the networks
+        Args:
+            i_episode (int): episode number, part of the file names
+            networks (dict): {name: torch.nn.Module or a snapshot state_dict}, e.g. {'guesser': ..., 'dqn': ...}
+            val_acc (float): validation accuracy, part of the file names
+            best (bool): whether to publish this checkpoint as 'best_<name>.pth'
+        """
+        self._raise_error()
+        snapshot = {name: net if isinstance(net, dict) else snapshot_state_dict(net) for name, net in networks.items()}
+        self.queue.put((i_episode, snapshot, val_acc, best))
+
+    def wait(self) -> None:
+        """ Blocks until every queued checkpoint is on disk """
+        self.queue.join()
+        self._raise_error()
+
+    def close(self) -> None:
+        self.wait()
+        self.queue.put(None)
+        self.thread.join()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            try:
+                self._write(*item)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _write(self, i_episode, snapshot, val_acc, best):
+        if not os.path.exists(self.save_dir):
+            os.makedirs(self.save_dir)
+
+        paths = []
+        for name, state_dict in snapshot.items():
+            path = os.path.join(self.save_dir, '{}_{}_{:1.3f}.pth'.format(i_episode, name, val_acc))
+            torch.save({k: v.cpu() for k, v in state_dict.items()}, path + '~')
+            os.replace(path + '~', path)
+            paths.append(path)
+            if best:
+                publish_alias(path, os.path.join(self.save_dir, 'best_{}.pth'.format(name)))
+
+        # retention: best_* are separate links, so they survive the removal of their source
+        self.history.append(paths)
+        while len(self.history) > self.keep:
+            for path in self.history.popleft():
+                if os.path.exists(path):
+                    os.remove(path)
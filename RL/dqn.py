@@ -16,6 +16,9 @@ class DQN(torch.nn.Module):
             hidden_dim (int): Hidden dimension in fc layer
         """
         super(DQN, self).__init__()
+        self.input_dim = input_dim
+        self.output_dim = output_dim
+        self.hidden_dim = hidden_dim
 
         self.layer1 = torch.nn.Sequential(
             torch.nn.Linear(input_dim, hidden_dim),
@@ -1,37 +1,12 @@
 import numpy as np
 import os
-from sklearn.model_selection import train_test_split
 import gymnasium
 import torch
-import RL.utils as utils
+import RL.feature_scores as feature_scores
 from RL.guesser import Guesser
-
-
-def balance_class(X, y):
-    unique_classes, class_counts = np.unique(y, return_counts=True)
-    minority_class = unique_classes[np.argmin(class_counts)]
-    majority_class = unique_classes[np.argmax(class_counts)]
-
-    # Get indices of samples belonging to each class
-    minority_indices = np.where(y == minority_class)[0]
-    majority_indices = np.where(y == majority_class)[0]
-
-    # Calculate the difference in sample counts
-    minority_count = len(minority_indices)
-    majority_count = len(majority_indices)
-    count_diff = majority_count - minority_count
-
-    # Duplicate samples from the minority class to balance the dataset
-    if count_diff > 0:
-        # Randomly sample indices from the minority class to duplicate
-        duplicated_indices = np.random.choice(minority_indices, count_diff, replace=True)
-        # Concatenate the duplicated samples to the original arrays
-        X_balanced = np.concatenate([X, X[duplicated_indices]], axis=0)
-        y_balanced = np.concatenate([y, y[duplicated_indices]], axis=0)
-    else:
-        X_balanced = X.copy()  # No need for balancing, as classes are already balanced
-        y_balanced = y.copy()
-    return X_balanced, y_balanced
+from RL.splits import Splits
+from RL.sampler import ClassWeightedSampler
+from RL.profiling import PROFILER
 
 
 class myEnv(gymnasium.Env):
@@ -39,20 +14,37 @@ class myEnv(gymnasium.Env):
     def __init__(self,
                  flags,
                  device,
-                 oversample=True,
-                 load_pretrained_guesser=True):
-        self.guesser = Guesser()
+                 oversample=None,
+                 load_pretrained_guesser=True,
+                 data=None):
+        """data: optional (X, y, question_names) to use instead of the guesser's dataset (e.g. synthetic data)
+        oversample: class balanced sampling of the training patients, None follows flags.oversample (default uniform)
+        """
+        if data is None:
+            self.guesser = Guesser()
+        else:
+            X, y, question_names = data
+            self.guesser = Guesser(features_size=X.shape[1], num_classes=len(np.unique(y)))
+            self.guesser.X, self.guesser.y, self.guesser.question_names = X, y, question_names
         episode_length = flags.episode_length
         self.device = device
-        X, y = balance_class(self.guesser.X, self.guesser.y)
-        self.X_train, self.X_test, self.y_train, self.y_test = train_test_split(self.guesser.X, self.guesser.y,
-                                                                                test_size=0.3)
-        self.X_train, self.X_val, self.y_train, self.y_val = train_test_split(self.X_train,
-                                                                              self.y_train,
-                                                                              test_size=0.05)
+        # stored, stratified split shared with guesser pretraining; X_* index into guesser.X without copying it
+        self.splits = Splits(self.guesser.X, self.guesser.y)
+        self.X_train, self.X_val, self.X_test = (self.splits.view(part) for part in ('train', 'val', 'test'))
+        self.y_train, self.y_val, self.y_test = (self.splits.labels(part) for part in ('train', 'val', 'test'))
+        # training patients are drawn class balanced (oversample) or uniformly, without duplicating rows
+        if oversample is None:
+            oversample = bool(getattr(flags, 'oversample', 0))
+        self.sampler = ClassWeightedSampler(self.y_train, class_weights='balanced' if oversample else None)
 
         self.episode_length = episode_length
-        self.action_probs = utils.diabetes_prob_actions()
+        # exploration probabilities: uniform, or proportional to cached feature scores ('mi' / 'importance')
+        action_scores = getattr(flags, 'action_scores', 'uniform')
+        if action_scores == 'uniform':
+            self.action_probs = torch.ones(self.guesser.features_size + 1)
+        else:
+            scores = feature_scores.feature_scores(np.asarray(self.X_train), self.y_train, method=action_scores)
+            self.action_probs = feature_scores.action_probs(scores, guess_score=.1, min_score=.01)
         # Load pre-trained guesser network, if needed
         if load_pretrained_guesser:
             save_dir = os.path.join(os.getcwd(), 'model_guesser')
@@ -67,16 +59,19 @@ class myEnv(gymnasium.Env):
               mode='training',
               patient=0,
               train_guesser=True):
-        self.state = np.concatenate([np.zeros(self.guesser.features_size), np.zeros(self.guesser.features_size)])
+        self.state = np.zeros(2 * self.guesser.features_size, dtype=np.float32)
 
         if mode == 'training':
-            self.patient = np.random.randint(self.X_train.shape[0])
+            self.patient = self.sampler.sample()
         else:
             self.patient = patient
 
         self.done = False
         self.s = np.array(self.state)
         self.time = 0
+        # guesser first layer output, brought up to date with the revealed questions by `confidence`
+        self.hidden = None
+        self.revealed = []
         if mode == 'training':
             self.train_guesser = train_guesser
         else:
@@ -100,15 +95,17 @@ class myEnv(gymnasium.Env):
         """ State update mechanism """
 
         # update state
+        # update_state returns a new array, so the state can be shared with the caller without copying
         next_state = self.update_state(action, mode, mask)
-        self.state = np.array(next_state)
-        self.s = np.array(self.state)
+        self.state = next_state
+        self.s = next_state
 
         # compute reward
         self.reward = self.compute_reward(mode)
 
-        self.time += 1
-        if self.time == self.episode_length:
+        # a batch of questions uses as much of the question budget as asking them one by one
+        self.time += np.size(action) if self.guess == -1 else 1
+        if self.time >= self.episode_length:
             self.terminate_episode()
 
         return self.s, self.reward, self.done, self.guess
@@ -118,32 +115,42 @@ class myEnv(gymnasium.Env):
         self.done = True
 
     def update_state(self, action, mode, mask):
+        """ action: a question, the guess, or a list of questions revealed together (top-k acquisition) """
         next_state = np.array(self.state)
+        questions = np.atleast_1d(action)
 
-        if action < self.guesser.features_size:  # Not making a guess
+        if questions[0] < self.guesser.features_size:  # Not making a guess
             if mode == 'training':
-                next_state[action] = self.X_train[self.patient, action]
+                next_state[questions] = self.X_train[self.patient, questions]
             elif mode == 'val':
-                next_state[action] = self.X_val[self.patient, action]
+                next_state[questions] = self.X_val[self.patient, questions]
             elif mode == 'test':
-                next_state[action] = self.X_test[self.patient, action]
-            next_state[action + self.guesser.features_size] += 1.
+                next_state[questions] = self.X_test[self.patient, questions]
+            next_state[questions + self.guesser.features_size] += 1.
+            self.revealed.extend(questions.tolist())
             self.guess = -1
             self.done = False
 
         else:  # Making a guess
-            guesser_input = torch.Tensor(
-                self.state[:self.guesser.features_size])
+            guesser_input = torch.from_numpy(self.state[:self.guesser.features_size])
             if torch.cuda.is_available():
                 guesser_input = guesser_input.cuda()
             self.guesser.train(mode=False)
-            self.probs = self.guesser(guesser_input)
+            with PROFILER.phase('guesser_forward'):
+                self.probs = self.guesser(guesser_input)
             self.guess = torch.argmax(self.probs).item()
             self.correct_prob = self.probs[self.y_train[self.patient]].item()
             self.terminate_episode()
 
         return next_state
 
+    def confidence(self) -> float:
+        """ Guesser probability of its most likely class on the current state, from the incremental forward """
+        if self.hidden is None or self.revealed:
+            self.hidden = self.guesser.add_features(self.hidden, self.revealed, self.state[self.revealed])
+            self.revealed = []
+        return self.guesser.probs_from_hidden(self.hidden).max().item()
+
     def compute_reward(self, mode):
         """ Compute the reward """
 
@@ -159,20 +166,21 @@ class myEnv(gymnasium.Env):
             y_true = self.y_train[self.patient]
 
         if self.train_guesser:
-            # y_pred=[]
-            # y = torch.Tensor(y_true).long()
-            # y_pred.append(y)
-            # labels = torch.Tensor(np.array(y_pred)).long()
-            # train guesser
-            self.guesser.optimizer.zero_grad()
-            # y = torch.Tensor(np.array(y_true))
-            # y = y.to(device=self.device)
-            self.guesser.train(mode=True)
-            y_true_tensor = torch.tensor([y_true]).float().long()
-            self.guesser.loss = self.guesser.criterion(self.probs, y_true_tensor)
-            self.guesser.loss.backward()
-            self.guesser.optimizer.step()
-            # update learning rate
-            self.guesser.update_learning_rate()
+            with PROFILER.phase('guesser_update'):
+                # y_pred=[]
+                # y = torch.Tensor(y_true).long()
+                # y_pred.append(y)
+                # labels = torch.Tensor(np.array(y_pred)).long()
+                # train guesser
+                self.guesser.optimizer.zero_grad()
+                # y = torch.Tensor(np.array(y_true))
+                # y = y.to(device=self.device)
+                self.guesser.train(mode=True)
+                y_true_tensor = torch.tensor([y_true]).float().long()
+                self.guesser.loss = self.guesser.criterion(self.probs, y_true_tensor)
+                self.guesser.loss.backward()
+                self.guesser.optimizer.step()
+                # update learning rate
+                self.guesser.update_learning_rate()
 
         return reward
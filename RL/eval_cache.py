@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+# part of every key: bump when the evaluation episode itself changes
+EVAL_VERSION = 3
+
+
+def weights_hash(networks: dict) -> str:
+    """ sha1 of the names, dtypes, shapes and values of the tensors of {name: torch.nn.Module} """
+    h = hashlib.sha1()
+    for name in sorted(networks):
+        for k, v in networks[name].state_dict().items():
+            t = v.detach().cpu().contiguous()
+            h.update('{}.{}:{}:{}'.format(name, k, t.dtype, tuple(t.shape)).encode())
+            h.update(t.numpy().tobytes())
+    return h.hexdigest()
+
+
+def eval_key(networks: dict, split_key: str, part: str, settings: dict) -> str:
+    """Key of an evaluation: the weights, the split (dataset hash and split parameters), the part
+    ('val' / 'test') and the episode settings (e.g. episode_length)
+    """
+    blob = json.dumps({'weights': weights_hash(networks), 'split': split_key, 'part': part,
+                       'settings': settings, 'version': EVAL_VERSION}, sort_keys=True)
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+
+def pack_rows(rows: list) -> dict:
+    """Turns per-patient dicts into columns: one array per scalar field, and the variable length
+    'actions' as one flat array plus 'offsets' (patient i took actions[offsets[i]:offsets[i + 1]])
+    """
+    columns = {k: np.array([r[k] for r in rows]) for k in rows[0] if k != 'actions'}
+    lengths = [len(r['actions']) for r in rows]
+    columns['offsets'] = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    columns['actions'] = np.fromiter((a for r in rows for a in r['actions']), dtype=np.int32,
+                                     count=int(columns['offsets'][-1]))
+    return columns
+
+
+def trajectory(columns: dict, i: int) -> np.ndarray:
+    """ Actions of patient i """
+    return columns['actions'][columns['offsets'][i]:columns['offsets'][i + 1]]
+
+
+class EvalCache(object):
+    def __init__(self, cache_dir: str = 'eval_cache') -> None:
+        """Stores evaluation results (predictions, step counts, trajectories) by `eval_key`
+        Each entry is an uncompressed .npz of columns, so a hit is a few array reads.
+        Args:
+            cache_dir (str): directory of the entries, None disables the cache
+        """
+        self.configure(cache_dir)
+
+    def configure(self, cache_dir: str = 'eval_cache') -> None:
+        self.cache_dir = cache_dir
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, 'eval_{}.npz'.format(key))
+
+    def get(self, key: str):
+        """ Returns the columns stored under `key`, or None """
+        if not self.cache_dir or not os.path.exists(self._path(key)):
+            return None
+        with np.load(self._path(key)) as stored:
+            return {k: stored[k] for k in stored.files}
+
+    def put(self, key: str, columns: dict) -> None:
+        if not self.cache_dir:
+            return
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        path = self._path(key)
+        with open(path + '~', 'wb') as f:
+            np.savez(f, **columns)
+        os.replace(path + '~', path)
+
+
+# shared cache of test() / show_sample_paths(), main() sets the directory with --eval_cache
+EVAL_CACHE = EvalCache()
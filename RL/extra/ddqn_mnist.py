@@ -769,6 +769,7 @@ def view_images(env, agent, input_dim, output_dim, nun_images=10, save=True):
                                fig_num=i,
                                save_dir=FLAGS.masked_images_dir,
                                actions=actions)
+    utils.REPORT.close()
 
 
 if __name__ == '__main__':
@@ -2,8 +2,6 @@
 import numpy as np
 import os
 from sklearn.model_selection import train_test_split
-from sklearn.feature_selection import mutual_info_classif
-from sklearn.tree import DecisionTreeClassifier
 
 import gym
 import torch
@@ -11,6 +9,7 @@ import torch.nn as nn
 from torch.optim import lr_scheduler
 import torch.nn.functional as F
 import utils
+import feature_scores
 
 
 class Guesser(nn.Module):
@@ -98,16 +97,12 @@ class Mnist_env(gym.Env):
 
         self.X_train, self.X_val, self.y_train, self.y_val = train_test_split(self.X_train,
                                                                               self.y_train,
-                                                                              test_size=0.017)
+                                                                              test_size=0.017,
+                                                                              random_state=24)
 
         # Load / compute mutual information of each pixel with target
-        # mi = utils.load_mi_scores()
-        # if mi is None:
-        #     print('Computing mutual information of each pixel with target')
-        #     mi = mutual_info_classif(self.X_train, self.y_train)
-        #     np.save('mnist_check/mi.npy', mi)
-        # scores = np.append(mi, .1)
-        # self.action_probs = scores / np.sum(scores)
+        mi = feature_scores.feature_scores(self.X_train, self.y_train, method='mi')
+        self.action_probs = feature_scores.action_probs(mi, guess_score=.1)
 
         self.guesser = Guesser(state_dim=self.n_questions,
                                hidden_dim=flags.g_hidden_dim,
@@ -0,0 +1,123 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+
+SCORES_DIR = 'feature_scores'
+
+
+def dataset_hash(X: np.ndarray, y: np.ndarray) -> str:
+    """Returns a content hash of a dataset
+    Args:
+        X (np.ndarray): 2-D array of shape (n, n_features)
+        y (np.ndarray): 1-D array of labels
+    Returns:
+        str: hex digest, identical for identical data regardless of memory layout
+    """
+    h = hashlib.sha1()
+    for a in (X, y):
+        a = np.ascontiguousarray(a)
+        h.update('{}{}'.format(a.dtype.str, a.shape).encode())
+        h.update(memoryview(a.reshape(-1)).cast('B'))
+    return h.hexdigest()
+
+
+def _mi_chunk(X_chunk: np.ndarray, y: np.ndarray, random_state: int) -> np.ndarray:
+    """ Mutual information of each column in the chunk with the target (runs in a worker process) """
+    from sklearn.feature_selection import mutual_info_classif
+    return mutual_info_classif(X_chunk, y, random_state=random_state)
+
+
+def mutual_information(X: np.ndarray,
+                       y: np.ndarray,
+                       n_workers=None,
+                       chunk_size: int = 64,
+                       random_state: int = 0) -> np.ndarray:
+    """Mutual information of every feature with the target
+    Features are scored independently, so the columns are split into chunks
+    that are scored in a process pool.
+    Args:
+        X (np.ndarray): 2-D array of shape (n, n_features)
+        y (np.ndarray): 1-D array of labels
+        n_workers (int): number of processes, defaults to the cpu count
+        chunk_size (int): number of features per task
+        random_state (int): seed of the estimator noise, fixed so the scores are reproducible
+    Returns:
+        np.ndarray: 1-D array of shape (n_features,)
+    """
+    starts = range(0, X.shape[1], chunk_size)
+    if len(starts) == 1:
+        return _mi_chunk(X, y, random_state)
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = [pool.submit(_mi_chunk, np.ascontiguousarray(X[:, s:s + chunk_size]), y, random_state)
+                   for s in starts]
+        return np.concatenate([f.result() for f in futures])
+
+
+def tree_importance(X: np.ndarray,
+                    y: np.ndarray,
+                    max_depth: int = 5,
+                    random_state: int = 0) -> np.ndarray:
+    """Feature importances of a decision tree fitted on the whole feature set
+    (a tree can not be split across feature chunks, so this runs in a single process)
+    """
+    from sklearn.tree import DecisionTreeClassifier
+    clf = DecisionTreeClassifier(max_depth=max_depth, random_state=random_state)
+    clf = clf.fit(X, y)
+    return clf.feature_importances_
+
+
+def feature_scores(X: np.ndarray,
+                   y: np.ndarray,
+                   method: str = 'mi',
+                   cache_dir: str = SCORES_DIR,
+                   **kwargs) -> np.ndarray:
+    """Returns per-feature scores, computing them only once per dataset
+    Scores are stored in `cache_dir` under the method name and the hash of (X, y).
+    Args:
+        X (np.ndarray): 2-D array of shape (n, n_features)
+        y (np.ndarray): 1-D array of labels
+        method (str): 'mi' (mutual information) / 'importance' (decision tree importance)
+        cache_dir (str): directory of stored scores, None disables the cache
+        kwargs: passed to `mutual_information` / `tree_importance`
+    Returns:
+        np.ndarray: 1-D array of shape (n_features,)
+    """
+    if method == 'mi':
+        compute = mutual_information
+    elif method == 'importance':
+        compute = tree_importance
+    else:
+        raise ValueError('unknown scoring method: {}'.format(method))
+
+    if cache_dir is None:
+        return compute(X, y, **kwargs)
+
+    params = ''.join('_{}{}'.format(k, kwargs[k]) for k in sorted(kwargs)
+                     if k not in ('n_workers', 'chunk_size'))
+    path = os.path.join(cache_dir, '{}{}_{}.npy'.format(method, params, dataset_hash(X, y)[:16]))
+    if os.path.exists(path):
+        return np.load(path)
+
+    print('Computing {} scores of {} features'.format(method, X.shape[1]))
+    scores = compute(X, y, **kwargs)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    with open(path + '~', 'wb') as f:
+        np.save(f, scores)
+    os.replace(path + '~', path)
+    return scores
+
+
+def action_probs(scores: np.ndarray, guess_score: float = .1, min_score: float = 0.) -> torch.Tensor:
+    """Turns feature scores into exploration probabilities over the actions
+    Args:
+        scores (np.ndarray): 1-D array of shape (n_features,)
+        guess_score (float): score of the guess action (the last action)
+        min_score (float): floor added to every feature, so no feature is never explored
+    Returns:
+        torch.Tensor: 1-D tensor of shape (n_features + 1,) that sums to 1
+    """
+    scores = np.append(np.asarray(scores, dtype=np.float64) + min_score, guess_score)
+    return torch.from_numpy(scores / np.sum(scores))
@@ -0,0 +1,176 @@
+"""Asynchronous feature sources and speculative prefetching of the next answers
+
+In production the answer to a question is a lab / EHR lookup, not X_train[patient, action].
+A FeatureSource fetches one answer asynchronously; PrefetchCache keeps the fetches of each
+patient, so that while the answer to the current question is pending, the answers to the
+top-k next candidates (ranked by the current Q-values) are already on their way:
+
+    python -m RL.feature_source --model ddqn_models/best_model.rlm --input patients.csv --latency_ms 50 --top_k 2
+"""
+import abc
+import argparse
+import asyncio
+import time
+import numpy as np
+import torch
+
+from RL.model_artifact import load_model_artifact, DEFAULT_PATH
+
+
+class FeatureSource(abc.ABC):
+    """ Interface of a feature store: `fetch` returns the value of one feature of one patient """
+
+    @abc.abstractmethod
+    async def fetch(self, patient, feature: int) -> float:
+        pass
+
+
+class LatencyFeatureSource(FeatureSource):
+    def __init__(self, X: np.ndarray, latency_ms: float = 50., jitter_ms: float = 10., seed: int = 0) -> None:
+        """Local stand-in of a slow feature store: answers from the rows of X after a random delay
+        Args:
+            X (np.ndarray): features, one row per patient
+            latency_ms (float): mean delay of a fetch
+            jitter_ms (float): standard deviation of the delay
+        """
+        self.X = X
+        self.latency = latency_ms / 1e3
+        self.jitter = jitter_ms / 1e3
+        self.rng = np.random.default_rng(seed)
+        self.fetches = 0
+
+    async def fetch(self, patient, feature: int) -> float:
+        self.fetches += 1
+        await asyncio.sleep(max(0., self.rng.normal(self.latency, self.jitter)))
+        return float(self.X[patient, feature])
+
+
+class PrefetchCache(object):
+    def __init__(self, source: FeatureSource) -> None:
+        """Per patient fetches of a FeatureSource, issued at most once each
+        `prefetch` starts fetches without waiting for them, `get` waits for one (starting it if
+        needed), `forget` drops a patient and cancels the fetches that are still pending.
+        """
+        self.source = source
+        self.fetches = {}
+        self.issued = 0
+        self.hits = 0
+        self.wasted = 0
+
+    def _fetch(self, patient, feature: int) -> asyncio.Future:
+        fetches = self.fetches.setdefault(patient, {})
+        if feature not in fetches:
+            fetches[feature] = asyncio.ensure_future(self.source.fetch(patient, feature))
+            self.issued += 1
+        return fetches[feature]
+
+    def prefetch(self, patient, features) -> None:
+        for feature in features:
+            self._fetch(patient, int(feature))
+
+    async def get(self, patient, feature: int) -> float:
+        if feature in self.fetches.get(patient, ()):
+            self.hits += 1
+        future = self._fetch(patient, feature)
+        if not isinstance(future, asyncio.Future):
+            return future
+        value = await future
+        self.fetches[patient][feature] = value
+        return value
+
+    def forget(self, patient) -> None:
+        for value in self.fetches.pop(patient, {}).values():
+            if isinstance(value, asyncio.Future):
+                value.cancel()
+                self.wasted += 1
+
+
+@torch.no_grad()
+def _q_values(dqn, state: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    return (dqn(torch.from_numpy(state)[None]) * torch.from_numpy(mask)).numpy()[0]
+
+
+@torch.no_grad()
+def _guess(guesser, x: np.ndarray):
+    prob, guess = torch.max(guesser(torch.from_numpy(x)[None]), dim=1)
+    return guess.item(), prob.item()
+
+
+async def play_patient(guesser, dqn, cache: PrefetchCache, patient, episode_length: int, top_k: int = 2) -> dict:
+    """Greedy episode of a patient (as score.score_batch) whose answers come from `cache`
+    With each question, the next `top_k` unasked questions by Q-value are prefetched, so their
+    answers are usually in the cache by the time they are asked.
+    Returns:
+        dict: patient, actions, prediction, probability, steps, seconds
+    """
+    start = time.perf_counter()
+    n = guesser.features_size
+    state = np.zeros(2 * n, dtype=np.float32)
+    mask = np.ones(n + 1, dtype=np.float32)
+    actions = []
+    try:
+        for _ in range(episode_length):
+            q = _q_values(dqn, state, mask)
+            action = int(np.argmax(q))
+            actions.append(action)
+            if action == n:
+                break
+            candidates = [int(a) for a in np.argsort(-q) if a < n and mask[a] and a != action]
+            cache.prefetch(patient, candidates[:top_k])
+            state[action] = await cache.get(patient, action)
+            state[action + n] += 1.
+            mask[action] = 0
+        else:  # no guess within the episode: forced guess
+            actions.append(n)
+    finally:
+        cache.forget(patient)
+    guess, prob = _guess(guesser, state[:n])
+    return {'patient': patient, 'actions': actions, 'prediction': guess, 'probability': prob,
+            'steps': len(actions), 'seconds': time.perf_counter() - start}
+
+
+async def play_patients(guesser, dqn, source: FeatureSource, patients, episode_length: int,
+                        top_k: int = 2, concurrency: int = 32) -> list:
+    """ Plays the episodes of `patients`, at most `concurrency` at once """
+    cache = PrefetchCache(source)
+    limit = asyncio.Semaphore(concurrency)
+
+    async def play(patient):
+        async with limit:
+            return await play_patient(guesser, dqn, cache, patient, episode_length, top_k)
+
+    results = await asyncio.gather(*(play(p) for p in patients))
+    print('top_k={}: {} fetches, {} cache hits, {} wasted prefetches'.format(
+        top_k, cache.issued, cache.hits, cache.wasted))
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--model", type=str, default=DEFAULT_PATH, help="Model artifact (see model_artifact.py)")
+    parser.add_argument("--input", type=str, required=True, help="Patient file, .csv or .parquet")
+    parser.add_argument("--n_patients", type=int, default=1000, help="Patients to play (the first rows of --input)")
+    parser.add_argument("--episode_length", type=int, default=5, help="Episode length (as main_al --episode_length)")
+    parser.add_argument("--latency_ms", type=float, default=50., help="Mean latency of a fetch")
+    parser.add_argument("--jitter_ms", type=float, default=10., help="Standard deviation of the fetch latency")
+    parser.add_argument("--top_k", type=int, default=2, help="Next candidate questions prefetched with each question")
+    parser.add_argument("--concurrency", type=int, default=32, help="Patients played at once")
+    flags = parser.parse_args(args)
+
+    from RL.score import read_chunks
+    guesser, dqn, header = load_model_artifact(flags.model, device='cpu')
+    feature_names = header['feature_names'][:guesser.features_size]
+    _, X = next(read_chunks(flags.input, feature_names, flags.n_patients))
+
+    # the same answers with and without prefetching, so only the latencies differ
+    for top_k in (0, flags.top_k):
+        source = LatencyFeatureSource(X, flags.latency_ms, flags.jitter_ms)
+        results = asyncio.run(play_patients(guesser, dqn, source, range(len(X)), flags.episode_length,
+                                            top_k, flags.concurrency))
+        seconds = np.array([r['seconds'] for r in results])
+        print('top_k={}: {:.1f} ms mean, {:.1f} ms p90 per questionnaire'.format(
+            top_k, 1e3 * seconds.mean(), 1e3 * np.percentile(seconds, 90)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,15 @@
 import argparse
 from itertools import count
 import numpy as np
-from fastai.data.load import DataLoader
-from matplotlib import pyplot as plt
-from sklearn.model_selection import train_test_split
-from torch.utils.data import TensorDataset
+from torch.utils.data import DataLoader, TensorDataset, Subset
 import os
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import RL.utils as utils
-from sklearn.metrics import confusion_matrix
+from RL.splits import Splits
+from RL.sampler import ClassWeightedSampler
+from RL.report import REPORT
 
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument("--directory",
@@ -54,34 +53,12 @@ parser.add_argument("--episode_length",
                     default=5,
                     help="Episode length")
 
-FLAGS = parser.parse_args(args=[])
-
-
-def balance_class(X, y):
-    unique_classes, class_counts = np.unique(y, return_counts=True)
-    minority_class = unique_classes[np.argmin(class_counts)]
-    majority_class = unique_classes[np.argmax(class_counts)]
-
-    # Get indices of samples belonging to each class
-    minority_indices = np.where(y == minority_class)[0]
-    majority_indices = np.where(y == majority_class)[0]
-
-    # Calculate the difference in sample counts
-    minority_count = len(minority_indices)
-    majority_count = len(majority_indices)
-    count_diff = majority_count - minority_count
+parser.add_argument("--storage_dtype",
+                    type=str,
+                    default='float32',
+                    help="dtype of the stored features: float32 | float16 (states and networks are float32)")
 
-    # Duplicate samples from the minority class to balance the dataset
-    if count_diff > 0:
-        # Randomly sample indices from the minority class to duplicate
-        duplicated_indices = np.random.choice(minority_indices, count_diff, replace=True)
-        # Concatenate the duplicated samples to the original arrays
-        X_balanced = np.concatenate([X, X[duplicated_indices]], axis=0)
-        y_balanced = np.concatenate([y, y[duplicated_indices]], axis=0)
-    else:
-        X_balanced = X.copy()  # No need for balancing, as classes are already balanced
-        y_balanced = y.copy()
-    return X_balanced, y_balanced
+FLAGS = parser.parse_args(args=[])
 
 
 class Guesser(nn.Module):
@@ -91,11 +68,18 @@ class Guesser(nn.Module):
 
     def __init__(self,
                  hidden_dim1=FLAGS.hidden_dim1, hidden_dim2=FLAGS.hidden_dim2,
-                 num_classes=2):
+                 num_classes=2, features_size=None):
+        """ features_size given: build the network only, without loading the dataset """
 
         super(Guesser, self).__init__()
-        self.X, self.y, self.question_names, self.features_size = utils.load_diabetes()
-        # self.X, self.y = balance_class(self.X, self.y)
+        if features_size is None:
+            self.X, self.y, self.question_names, self.features_size = utils.load_diabetes(
+                dtype=np.dtype(FLAGS.storage_dtype))
+        else:
+            self.features_size = features_size
+        self.hidden_dim1 = hidden_dim1
+        self.hidden_dim2 = hidden_dim2
+        self.num_classes = num_classes
         self.layer1 = torch.nn.Sequential(
             torch.nn.Linear(self.features_size, hidden_dim1),
             torch.nn.PReLU(),
@@ -132,14 +116,38 @@ class Guesser(nn.Module):
 
         return probs
 
+    @torch.no_grad()
+    def add_features(self, hidden, questions, values) -> torch.Tensor:
+        """Incremental forward of the first linear layer along an episode: its output for the
+        empty state is the bias, and each revealed question adds its column of weights times the answer
+        Args:
+            hidden (torch.Tensor): first layer output so far, None for the empty state
+            questions: the questions just revealed (asked once each)
+            values: their answers
+        Returns:
+            torch.Tensor: first layer output of the state with the new answers
+        """
+        linear = self.layer1[0]
+        if hidden is None:
+            hidden = linear.bias.detach().clone()
+        values = torch.as_tensor(np.asarray(values, dtype=np.float32), device=hidden.device)
+        return hidden + linear.weight[:, list(questions)] @ values
+
+    @torch.no_grad()
+    def probs_from_hidden(self, hidden) -> torch.Tensor:
+        """ Class probabilities from the first layer output of `add_features` (the rest of `forward`) """
+        x = self.layer1[1](hidden)
+        x = self.layer3(self.layer2(x))
+        return F.softmax(self.logits(x), dim=-1)
+
     def _to_variable(self, x: np.ndarray) -> torch.Tensor:
-        """torch.Variable syntax helper
+        """Wraps a float32 array as a tensor without copying it (other dtypes are converted once)
         Args:
             x (np.ndarray): 2-D tensor of shape (n, input_dim)
         Returns:
-            torch.Tensor: torch variable
+            torch.Tensor: float32 tensor
         """
-        return torch.autograd.Variable(torch.Tensor(x))
+        return torch.from_numpy(np.ascontiguousarray(x, dtype=np.float32))
 
 
 def mask(input: np.array) -> np.array:
@@ -198,6 +206,7 @@ def val(model, val_loader, best_val_auc=0):
 
 
 def test(test_loader, path_to_save):
+    from sklearn.metrics import confusion_matrix
     guesser_filename = 'best_guesser.pth'
     guesser_load_path = os.path.join(path_to_save, guesser_filename)
     model = Guesser()  # Assuming Guesser is your model class
@@ -285,29 +294,12 @@ def train_model(model,
 
 
 def save_plot_acuuracy_epoch(val_accuracy_list, training_loss_list):
-    epochs_val = range(1, len(val_accuracy_list) + 1)
-
-    plt.figure(figsize=(10, 5))
-
-    # Plot Validation Accuracy
-    plt.subplot(1, 2, 1)
-    plt.plot(epochs_val, val_accuracy_list, marker='o', linestyle='-', color='b')
-    plt.title('Validation Accuracy over Epochs')
-    plt.xlabel('Epochs')
-    plt.ylabel('Accuracy')
-    plt.grid(True)
-    epochs_train = range(1, len(training_loss_list) + 1)
-    # Plot Training Loss
-    plt.subplot(1, 2, 2)
-    plt.plot(epochs_train, training_loss_list, marker='o', linestyle='-', color='r')
-    plt.title('Training Loss over Epochs')
-    plt.xlabel('Epochs')
-    plt.ylabel('Loss')
-    plt.grid(True)
-
-    plt.tight_layout()
-    plt.savefig('accuracy_loss_plot.png')
-    plt.show()
+    """ Queues the validation accuracy / training loss figure on the report writer (rendered off-thread) """
+    REPORT.lines('accuracy_loss_plot.png', [
+        {'y': val_accuracy_list, 'title': 'Validation Accuracy over Epochs', 'xlabel': 'Epochs',
+         'ylabel': 'Accuracy', 'color': 'b', 'marker': 'o', 'grid': True},
+        {'y': training_loss_list, 'title': 'Training Loss over Epochs', 'xlabel': 'Epochs',
+         'ylabel': 'Loss', 'color': 'r', 'marker': 'o', 'grid': True}])
 
 
 def save_model(model):
@@ -335,35 +327,20 @@ def main():
     :return:
     '''
     model = Guesser()
-    X_train, X_test, y_train, y_test = train_test_split(model.X,
-                                                        model.y,
-                                                        test_size=0.33,
-                                                        random_state=42)
-    X_train, X_val, y_train, y_val = train_test_split(X_train,
-                                                      y_train,
-                                                      test_size=0.05,
-                                                      random_state=24)
-    # Convert data to PyTorch tensors
-    X_tensor_train = torch.from_numpy(X_train)
-
-    y_tensor_train = torch.from_numpy(y_train)  # Assuming y_data contains integers
-    # Create a TensorDataset
-    dataset_train = TensorDataset(X_tensor_train, y_tensor_train)
-
-    # Create a DataLoader
-    data_loader_train = DataLoader(dataset_train, batch_size=FLAGS.batch_size, shuffle=True)
-    # Convert data to PyTorch tensors
-    X_tensor_val = torch.Tensor(X_val)
-    y_tensor_val = torch.Tensor(y_val)  # Assuming y_data contains integers
-    dataset_val = TensorDataset(X_tensor_val, y_tensor_val)
-    data_loader_val = DataLoader(dataset_val, batch_size=FLAGS.batch_size, shuffle=True)
+    # same stored split as the RL environment, so no RL val / test patient is seen in pretraining
+    splits = Splits(model.X, model.y)
+    dataset = TensorDataset(torch.from_numpy(model.X), torch.from_numpy(model.y))
+
+    # Create DataLoaders over index subsets of the full dataset, training batches are drawn class balanced
+    train_sampler = ClassWeightedSampler(splits.labels('train'), class_weights='balanced')
+    data_loader_train = DataLoader(Subset(dataset, splits.indices['train']), batch_size=FLAGS.batch_size,
+                                   sampler=train_sampler.torch_sampler())
+    data_loader_val = DataLoader(Subset(dataset, splits.indices['val']), batch_size=FLAGS.batch_size, shuffle=True)
     train_model(model, FLAGS.num_epochs,
                 data_loader_train, data_loader_val)
-    X_tensor_test = torch.Tensor(X_test)
-    y_tensor_test = torch.Tensor(y_test)  # Assuming y_data contains integers
-    dataset_test = TensorDataset(X_tensor_test, y_tensor_test)
-    data_loader_test = DataLoader(dataset_test, batch_size=FLAGS.batch_size, shuffle=True)
+    data_loader_test = DataLoader(Subset(dataset, splits.indices['test']), batch_size=FLAGS.batch_size, shuffle=True)
     test(data_loader_test, model.path_to_save)
+    REPORT.close()
 
 
 if __name__ == "__main__":
@@ -1,11 +1,18 @@
 import torch.nn
 from collections import deque
 from typing import List, Tuple
-from matplotlib import pyplot as plt
-from sklearn.metrics import confusion_matrix
 from env import *
 from agent import *
 from ReplayMemory import *
+from RL.checkpoint import CheckpointWriter
+from RL.training_state import save_training_state, load_training_state
+from RL.model_artifact import save_model_artifact, DEFAULT_PATH as DEFAULT_MODEL_ARTIFACT
+from RL.profiling import PROFILER
+from RL.metrics import METRICS
+from RL.report import REPORT
+from RL.async_val import AsyncValidator
+import RL.eval_cache as eval_cache
+from RL.eval_cache import EVAL_CACHE
 from itertools import count
 
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -17,6 +24,46 @@ parser.add_argument("--save_guesser_dir",
                     type=str,
                     default='model_guesser',
                     help="Directory for saved guesser model")
+parser.add_argument("--model_artifact",
+                    type=str,
+                    default=DEFAULT_MODEL_ARTIFACT,
+                    help="Bundled artifact of the best networks, written after training")
+parser.add_argument("--profile",
+                    type=int,
+                    default=0,
+                    help="Whether to time the phases of the training loop")
+parser.add_argument("--profile_interval",
+                    type=int,
+                    default=500,
+                    help="Number of episodes between profiling summaries")
+parser.add_argument("--profile_file",
+                    type=str,
+                    default='profile.json',
+                    help="JSON file of the profiling results")
+parser.add_argument("--trace_episodes",
+                    type=str,
+                    default='',
+                    help="Episode range 'start:end' to record with torch.profiler, empty for none")
+parser.add_argument("--trace_file",
+                    type=str,
+                    default='trace.json',
+                    help="Chrome trace file of the torch.profiler window")
+parser.add_argument("--metrics_file",
+                    type=str,
+                    default='',
+                    help="Interval metrics file (.csv, otherwise JSON lines), empty to disable")
+parser.add_argument("--metrics_interval",
+                    type=int,
+                    default=100,
+                    help="Number of episodes aggregated into one metrics row")
+parser.add_argument("--metrics_flush",
+                    type=int,
+                    default=20,
+                    help="Number of metrics rows buffered before writing")
+parser.add_argument("--report_dir",
+                    type=str,
+                    default='.',
+                    help="Directory of the plots and of report.html (rendered in the background)")
 parser.add_argument("--directory",
                     type=str,
                     default="C:\\Users\\kashann\\PycharmProjects\\choiceMira\\RL",
@@ -29,6 +76,22 @@ parser.add_argument("--n_update_target_dqn",
                     type=int,
                     default=10,
                     help="Number of episodes between updates of target dqn")
+parser.add_argument("--keep_checkpoints",
+                    type=int,
+                    default=5,
+                    help="Number of episode checkpoints to keep (the best one is always kept)")
+parser.add_argument("--resume",
+                    type=int,
+                    default=0,
+                    help="Whether to continue training from the saved training state")
+parser.add_argument("--resume_interval",
+                    type=int,
+                    default=500,
+                    help="Number of episodes between saves of the resumable training state")
+parser.add_argument("--resume_path",
+                    type=str,
+                    default=os.path.join('ddqn_models', 'training_state.pth'),
+                    help="File of the resumable training state")
 parser.add_argument("--val_trials_wo_im",
                     type=int,
                     default=30,
@@ -53,6 +116,10 @@ parser.add_argument("--max-episode",
                     type=int,
                     default=2000,
                     help="e-Greedy target episode (eps will be the lowest at this episode)")
+parser.add_argument("--n_episodes",
+                    type=int,
+                    default=0,
+                    help="Stop training after this number of episodes, 0 for early stopping only")
 parser.add_argument("--min-eps",
                     type=float,
                     default=0.01,
@@ -73,14 +140,52 @@ parser.add_argument("--val_interval",
                     type=int,
                     default=50,
                     help="Interval for calculating validation reward and saving model")
+parser.add_argument("--val_chunk",
+                    type=int,
+                    default=0,
+                    help="Validation patients per sequential check, stops once the confidence interval rules out "
+                         "beating the best checkpoint (0: always the full validation set)")
+parser.add_argument("--val_z",
+                    type=float,
+                    default=2.58,
+                    help="Normal quantile of the sequential validation confidence interval (2.58: 99%%)")
+parser.add_argument("--eval_cache",
+                    type=str,
+                    default='eval_cache',
+                    help="Directory of cached test episodes, keyed by weights, split and episode length ('' disables)")
+parser.add_argument("--async_val",
+                    type=int,
+                    default=0,
+                    help="Whether to validate weight snapshots in a separate process while training goes on "
+                         "(validations in flight are not part of the --resume state)")
 parser.add_argument("--episode_length",
                     type=int,
                     default=5,
                     help="Episode length")
+parser.add_argument("--acquire_k",
+                    type=int,
+                    default=1,
+                    help="Questions asked together per step (top-k acquisition), within the --episode_length budget")
+parser.add_argument("--stop_confidence",
+                    type=float,
+                    default=0.,
+                    help="Guess as soon as the guesser's top class probability reaches this (0 disables early termination)")
+parser.add_argument("--stop_thresholds",
+                    type=str,
+                    default='',
+                    help="Comma separated --stop_confidence values whose average steps / accuracy on X_val are reported")
 parser.add_argument("--case",
                     type=int,
                     default=2,
                     help="Which data to use")
+parser.add_argument("--oversample",
+                    type=int,
+                    default=0,
+                    help="Whether to draw training patients class balanced instead of uniformly")
+parser.add_argument("--action_scores",
+                    type=str,
+                    default='uniform',
+                    help="Exploration probabilities of the features: uniform | mi | importance")
 parser.add_argument("--env",
                     type=str,
                     default="Questionnaire",
@@ -118,13 +223,25 @@ def train_helper(agent: Agent,
     next_states = np.vstack([x.next_state for x in minibatch])
     done = np.array([x.done for x in minibatch])
 
-    Q_predict = agent.get_Q(states)
-    Q_target = Q_predict.clone().cpu().data.numpy()
-    max_actions = np.argmax(agent.get_Q(next_states).cpu().data.numpy(), axis=1)
-    Q_target[np.arange(len(Q_target)), actions] = rewards + gamma * agent.get_target_Q(next_states)[
-        np.arange(len(Q_target)), max_actions].data.numpy() * ~done
-    Q_target = agent._to_variable(Q_target).to(device=device)
-    return agent.train(Q_predict, Q_target)
+    with PROFILER.phase('learner_forward'):
+        Q_predict = agent.get_Q(states)
+        Q_target = Q_predict.clone().cpu().data.numpy()
+        max_actions = np.argmax(agent.get_Q(next_states).cpu().data.numpy(), axis=1)
+        targets = rewards + gamma * agent.get_target_Q(next_states)[
+            np.arange(len(Q_target)), max_actions].data.numpy() * ~done
+        # a step that asked several questions (padded with -1) sets the target of each of them
+        actions = actions.reshape(len(actions), -1)
+        rows, cols = np.nonzero(actions >= 0)
+        Q_target[rows, actions[rows, cols]] = targets[rows]
+        Q_target = agent._to_variable(Q_target).to(device=device)
+    with PROFILER.phase('learner_backward'):
+        return agent.train(Q_predict, Q_target)
+
+
+def stop_early(env, mask, stop_confidence: float = None) -> bool:
+    """ Whether to guess now, because no guess was made yet and the guesser is confident enough """
+    stop_confidence = FLAGS.stop_confidence if stop_confidence is None else stop_confidence
+    return stop_confidence > 0 and mask[-1] > 0 and env.confidence() >= stop_confidence
 
 
 def play_episode(env,
@@ -150,22 +267,37 @@ def play_episode(env,
     mask = env.reset_mask()
     t = 0
     while not done:
-        a = agent.get_action(s, env, eps, mask, mode)
+        with PROFILER.phase('action_selection'):
+            if stop_early(env, mask):
+                a = [agent.output_dim - 1] if FLAGS.acquire_k > 1 else agent.output_dim - 1
+            elif FLAGS.acquire_k > 1:
+                a = agent.get_actions(s, env, eps, mask, mode, min(FLAGS.acquire_k, FLAGS.episode_length - t))
+            else:
+                a = agent.get_action(s, env, eps, mask, mode)
         # a = agent.get_action_not_guess(s, env, eps, mask, mode)
-        s2, r, done, info = env.step(a, mask)
+        with PROFILER.phase('env_step'):
+            s2, r, done, info = env.step(a, mask)
         mask[a] = 0
         total_reward += r
-        replay_memory.push(s, a, r, s2, done)
+        with PROFILER.phase('replay_push'):
+            if FLAGS.acquire_k > 1:
+                # fixed length, so that the replay memory packs into arrays
+                replay_memory.push(s, np.pad(a, (0, FLAGS.acquire_k - len(a)), constant_values=-1), r, s2, done)
+            else:
+                replay_memory.push(s, a, r, s2, done)
         if len(replay_memory) > batch_size:
             if train_dqn:
-                minibatch = replay_memory.pop(batch_size)
-                train_helper(agent, minibatch, FLAGS.gamma)
+                with PROFILER.phase('replay_sample'):
+                    minibatch = replay_memory.pop(batch_size)
+                loss = train_helper(agent, minibatch, FLAGS.gamma)
+                if METRICS.enabled:
+                    METRICS.add(loss=loss.item())
                 agent.update_learning_rate()
 
         s = s2
-        t += 1
+        t += np.size(a)
         # check
-        if t == FLAGS.episode_length:
+        if t >= FLAGS.episode_length:
             # a = agent.output_dim - 1
             # s2, r, done, info = env.step(a, mask)
             # mask[a] = 0
@@ -266,8 +398,9 @@ def load_networks(i_episode: int, env, input_dim=26, output_dim=14,
     guesser_load_path = os.path.join(FLAGS.save_guesser_dir, guesser_filename)
     dqn_load_path = os.path.join(FLAGS.save_dir, dqn_filename)
 
-    # load guesser
-    guesser = Guesser()
+    # load guesser (the dataset is already loaded by env, only the network is built)
+    guesser = Guesser(features_size=env.guesser.features_size)
+    guesser.question_names = env.guesser.question_names
     guesser_state_dict = torch.load(guesser_load_path)
     guesser.load_state_dict(guesser_state_dict)
     guesser.to(device=device)
@@ -285,27 +418,27 @@ def save_plot_acuuracy_epoch(accuracy_list):
     Save plot of accuracy per epoch
     :param accuracy_list: list of accuracies per epoch
     '''
-    plt.plot(accuracy_list)
-    plt.title('Accuracy per validation epoch')
-    plt.ylabel('Accuracy')
-    plt.xlabel('validation epoch')
-    plt.savefig('accuracy_per_validation_epoch.png')
-    plt.show()
+    REPORT.lines('accuracy_per_validation_epoch.png', [
+        {'y': accuracy_list, 'x': range(len(accuracy_list)), 'title': 'Accuracy per validation epoch',
+         'xlabel': 'validation epoch', 'ylabel': 'Accuracy'}])
 
 
-def main():
-    # define environment and agent (needed for main and test)
-    env = myEnv(flags=FLAGS,
-                device=device)
-    clear_threshold = 1.
-    input_dim, output_dim = get_env_dim(env)
-    agent = Agent(input_dim,
-                  output_dim,
-                  FLAGS.hidden_dim, FLAGS.lr, FLAGS.weight_decay)
+# CSV columns of --metrics_file; loss and the validation metrics are missing from the first rows
+METRIC_FIELDS = ['episode', 'lr', 'reward', 'episode_length', 'epsilon', 'loss',
+                 'val_acc', 'val_patients', 'best_val_acc', 'interval_s']
 
-    agent.dqn.to(device=device)
-    env.guesser.to(device=device)
 
+def train(env, agent, checkpoints=None, n_episodes=0) -> dict:
+    """Training loop: plays episodes, validates every `val_interval` episodes and stops
+    after `val_trials_wo_im` validations without improvement (or after `n_episodes`, if > 0)
+    Args:
+        env (myEnv): environment
+        agent (Agent): agent
+        checkpoints (CheckpointWriter): writer of the best networks, None saves synchronously
+        n_episodes (int): fixed number of episodes, 0 for no limit
+    Returns:
+        dict: episodes played (last episode number), best_val_acc, val_list
+    """
     # store best result
     best_val_acc = 0
     val_list = []
@@ -317,8 +450,39 @@ def main():
     replay_memory = ReplayMemory(FLAGS.capacity)
     train_dqn = True
     train_guesser = False
+    PROFILER.enabled = bool(FLAGS.profile)
+    PROFILER.set_trace_window(FLAGS.trace_episodes, FLAGS.trace_file)
+    METRICS.configure(FLAGS.metrics_file or None, flush_every=FLAGS.metrics_flush, fields=METRIC_FIELDS)
+
+    start_episode = 1
+    if FLAGS.resume and os.path.exists(FLAGS.resume_path):
+        counters = load_training_state(FLAGS.resume_path, env, agent, replay_memory)
+        start_episode = counters['episode'] + 1
+        best_val_acc = counters['best_val_acc']
+        val_trials_without_improvement = counters['val_trials_without_improvement']
+        val_list = counters['val_list']
+        print('Resuming training from episode {}'.format(start_episode))
+
+    validator = None
+    own_checkpoints = None
+    if FLAGS.async_val:
+        validator = AsyncValidator(env, agent, FLAGS)
+        if checkpoints is None:  # snapshots are saved from memory, so through a writer
+            checkpoints = own_checkpoints = CheckpointWriter(FLAGS.save_dir, keep=FLAGS.keep_checkpoints)
+
+    def on_val_result(new_best_val_acc):
+        nonlocal best_val_acc, val_trials_without_improvement
+        val_list.append(new_best_val_acc)
+        METRICS.add(best_val_acc=new_best_val_acc)
+
+        # update best result on validation set and counter
+        if new_best_val_acc > best_val_acc:
+            best_val_acc = new_best_val_acc
+            val_trials_without_improvement = 0
+        else:
+            val_trials_without_improvement += 1
 
-    for i in count(1):
+    for i in count(start_episode):
         # if i % (2 * FLAGS.ep_per_trainee) == FLAGS.ep_per_trainee:
         #     train_dqn = False
         #     train_guesser = True
@@ -327,6 +491,8 @@ def main():
         #     train_guesser = False
 
 
+        PROFILER.on_episode(i)
+
         # set exploration epsilon
         eps = epsilon_annealing(i, FLAGS.max_episode, FLAGS.min_eps)
 
@@ -339,77 +505,221 @@ def main():
                             train_dqn=train_dqn,
                             train_guesser=train_guesser, mode='training')
 
-        # rewards.append(r)
-        # steps.append(t)
+        METRICS.add(reward=r, episode_length=t, epsilon=eps)
         if i % FLAGS.val_interval == 0:
-            # compute performance on validation set
-            new_best_val_acc = val(i_episode=i,
-                                   best_val_acc=best_val_acc, env=env, agent=agent)
-            val_list.append(new_best_val_acc)
-
-            # update best result on validation set and counter
-            if new_best_val_acc > best_val_acc:
-                best_val_acc = new_best_val_acc
-                val_trials_without_improvement = 0
+            if validator is not None:
+                validator.submit(i, env, agent, best_val_acc)
             else:
-                val_trials_without_improvement += 1
+                # compute performance on validation set
+                on_val_result(val(i_episode=i,
+                                  best_val_acc=best_val_acc, env=env, agent=agent,
+                                  checkpoints=checkpoints))
+        if validator is not None:
+            # results of earlier snapshots, early stopping acts on them as they arrive
+            for result in validator.poll():
+                on_val_result(val_snapshot(result, best_val_acc, checkpoints))
 
         if val_trials_without_improvement >= int(FLAGS.val_trials_wo_im):
             break
 
         if i % FLAGS.n_update_target_dqn == 0:
-            agent.update_target_dqn()
+            with PROFILER.phase('target_sync'):
+                agent.update_target_dqn()
+
+        if i % FLAGS.metrics_interval == 0:
+            METRICS.emit(episode=i, lr=agent.optim.param_groups[0]['lr'])
+
+        if PROFILER.enabled and i % FLAGS.profile_interval == 0:
+            print(PROFILER.summary('(episodes 1-{})'.format(i)))
+            PROFILER.dump(FLAGS.profile_file, episode=i)
+
+        if i % FLAGS.resume_interval == 0:
+            save_training_state(FLAGS.resume_path, env, agent, replay_memory,
+                                counters={'episode': i,
+                                          'best_val_acc': best_val_acc,
+                                          'val_trials_without_improvement': val_trials_without_improvement,
+                                          'val_list': val_list})
+
+        if i == n_episodes:
+            break
+
+    if validator is not None:
+        for result in validator.close():
+            on_val_result(val_snapshot(result, best_val_acc, checkpoints))
+        if validator.dropped:
+            print('{} snapshots were replaced by newer ones before validation'.format(validator.dropped))
+    if own_checkpoints is not None:
+        own_checkpoints.close()
+    # a trace window that training did not reach the end of (early stop, n_episodes) is exported here
+    PROFILER.close(i + 1)
+    if PROFILER.enabled:
+        PROFILER.dump(FLAGS.profile_file, episode=i)
+    METRICS.close()
+
+    return {'episodes': i, 'best_val_acc': best_val_acc, 'val_list': val_list}
+
+
+def main():
+    REPORT.configure(FLAGS.report_dir, title='RL training report')
+    EVAL_CACHE.configure(FLAGS.eval_cache or None)
+    # define environment and agent (needed for main and test)
+    env = myEnv(flags=FLAGS,
+                device=device)
+    input_dim, output_dim = get_env_dim(env)
+    agent = Agent(input_dim,
+                  output_dim,
+                  FLAGS.hidden_dim, FLAGS.lr, FLAGS.weight_decay)
+
+    agent.dqn.to(device=device)
+    env.guesser.to(device=device)
 
+    checkpoints = CheckpointWriter(FLAGS.save_dir, keep=FLAGS.keep_checkpoints)
+    val_list = train(env, agent, checkpoints, n_episodes=FLAGS.n_episodes)['val_list']
+
+    # the best checkpoint must be on disk before test() loads it
+    checkpoints.close()
     test(env, agent, input_dim, output_dim)
+    save_model_artifact(FLAGS.model_artifact, env.guesser, agent.dqn, env.guesser.question_names)
     save_plot_acuuracy_epoch(val_list)
 
     show_sample_paths(6, env, agent)
+    if FLAGS.stop_thresholds:
+        confidence_tradeoff(env, agent, [float(t) for t in FLAGS.stop_thresholds.split(',')])
+    print('Saved report to {}'.format(REPORT.close()))
 
 
 
 
-def val(i_episode: int,
-        best_val_acc: float, env, agent) -> float:
-    """ Compute performance on validation set and save current models """
+def play_val_patient(env, agent, patient: int, stop_confidence: float = None) -> int:
+    """ Plays a greedy episode on a validation patient and returns the guess (env.time - 1 questions were asked) """
+    state = env.reset(mode='val',
+                      patient=patient,
+                      train_guesser=False)
+    mask = env.reset_mask()
 
-    print('Running validation')
-    y_hat_val = np.zeros(len(env.y_val))
+    # run episode
+    t = 0
+    while t < FLAGS.episode_length:
+
+        # select action from policy
+        if stop_early(env, mask, stop_confidence):
+            action = agent.output_dim - 1
+        elif FLAGS.acquire_k > 1:
+            action = agent.get_actions(state, env, eps=0, mask=mask, mode='val',
+                                       k=min(FLAGS.acquire_k, FLAGS.episode_length - t))
+        else:
+            action = agent.get_action(state, env, eps=0, mask=mask, mode='val')
+        mask[action] = 0
+        t += np.size(action)
 
-    for i in range(len(env.X_val)):  # count(1)
-        state = env.reset(mode='val',
-                          patient=i,
-                          train_guesser=False)
-        mask = env.reset_mask()
+        # take the action
+        state, reward, done, guess = env.step(action, mask, mode='val')
 
-        # run episode
-        for t in range(FLAGS.episode_length):
+        if guess != -1:
+            return guess
 
-            # select action from policy
-            action = agent.get_action(state, env, eps=0, mask=mask, mode='val')
-            mask[action] = 0
+        if done:
+            break
 
-            # take the action
-            state, reward, done, guess = env.step(action, mask, mode='val')
+    a = agent.output_dim - 1
+    s2, r, done, info = env.step(a, mask)
+    return env.guess
 
-            if guess != -1:
-                y_hat_val[i] = guess
 
-            if done:
-                break
+def val_accuracy(env, agent) -> float:
+    """ Plays one greedy episode per validation patient and returns the accuracy of the guesses """
+    y_hat_val = np.array([play_val_patient(env, agent, i) for i in range(len(env.X_val))])
+    return np.mean(y_hat_val == env.y_val)
 
-        if guess == -1:
-            a = agent.output_dim - 1
-            s2, r, done, info = env.step(a, mask)
-            y_hat_val[i] = env.guess
 
-    confmat = confusion_matrix(env.y_val, y_hat_val)
-    acc = np.sum(np.diag(confmat)) / len(env.y_val)
-    print('Validation accuracy: {:1.3f}'.format(acc))
+def stratified_order(y: np.ndarray, seed: int = 0) -> np.ndarray:
+    """A permutation of the patients in which every prefix has about the class proportions of y
+    (each class is shuffled and spread evenly over the order)
+    """
+    rng = np.random.RandomState(seed)
+    position = np.zeros(len(y))
+    for c in np.unique(y):
+        idx = rng.permutation(np.where(y == c)[0])
+        position[idx] = (np.arange(len(idx)) + .5) / len(idx)
+    return np.argsort(position, kind='stable')
+
+
+def sequential_val_accuracy(env, agent, best_val_acc: float, chunk_size: int, z: float = 2.58):
+    """Validation accuracy on stratified chunks of patients, stopped as soon as the confidence
+    interval of the running accuracy is entirely below `best_val_acc` (can not beat it)
+    A checkpoint that may beat the best is evaluated on every patient, so a new best is never the
+    (upward biased) accuracy of a lucky prefix.
+    The interval is the Agresti-Coull normal interval with the finite population correction of the
+    validation set, so it shrinks to 0 when every patient is evaluated.
+    Args:
+        best_val_acc (float): accuracy of the best checkpoint so far
+        chunk_size (int): patients evaluated between two checks
+        z (float): normal quantile of the interval, 2.58 for 99%
+    Returns:
+        float: running accuracy
+        float: half width of its interval
+        int: number of patients evaluated
+    """
+    order = stratified_order(env.y_val)
+    N = len(order)
+    correct = 0
+    n = 0
+    while n < N:
+        for i in order[n:n + chunk_size]:
+            correct += play_val_patient(env, agent, i) == env.y_val[i]
+        n = min(n + chunk_size, N)
+        acc = correct / n
+        p = (correct + 2.) / (n + 4.)
+        half = z * np.sqrt(p * (1 - p) / n * (N - n) / max(N - 1, 1))
+        if acc + half < best_val_acc:
+            break
+    return acc, half, n
+
+
+def confidence_tradeoff(env, agent, thresholds) -> list:
+    """Average questions asked and accuracy on the validation patients, without early termination
+    and for every confidence threshold of early termination
+    Returns:
+        list: dicts with threshold, mean_questions, accuracy
+    """
+    rows = []
+    for threshold in [0.] + list(thresholds):
+        correct = questions = 0
+        for i in range(len(env.X_val)):
+            correct += play_val_patient(env, agent, i, stop_confidence=threshold) == env.y_val[i]
+            questions += env.time - 1
+        rows.append({'threshold': threshold, 'mean_questions': questions / len(env.X_val),
+                     'accuracy': correct / len(env.X_val)})
+        print('Stop confidence {:1.3f}: {:1.3f} questions on average, validation accuracy {:1.3f}'.format(
+            threshold, rows[-1]['mean_questions'], rows[-1]['accuracy']))
+    REPORT.lines('confidence_tradeoff.png', [
+        {'y': [r['accuracy'] for r in rows], 'x': [r['mean_questions'] for r in rows],
+         'title': 'Early termination: accuracy vs questions (validation)', 'xlabel': 'average questions asked',
+         'ylabel': 'Accuracy', 'marker': 'o', 'grid': True}])
+    return rows
+
+
+def val(i_episode: int,
+        best_val_acc: float, env, agent, checkpoints=None) -> float:
+    """ Compute performance on validation set and save current models
+    (in the background through `checkpoints` (CheckpointWriter) if given) """
+
+    print('Running validation')
+    if FLAGS.val_chunk > 0:
+        acc, half, n = sequential_val_accuracy(env, agent, best_val_acc, FLAGS.val_chunk, FLAGS.val_z)
+        print('Validation accuracy: {:1.3f} +- {:1.3f} on {} of {} patients'.format(acc, half, n, len(env.y_val)))
+    else:
+        acc, n = val_accuracy(env, agent), len(env.y_val)
+        print('Validation accuracy: {:1.3f}'.format(acc))
+    METRICS.add(val_acc=acc, val_patients=n)
 
     if acc >= best_val_acc:
         print('New best acc acheievd, saving best model')
-        save_networks(i_episode, env, agent, acc)
-        save_networks(i_episode='best', env=env, agent=agent)
+        if checkpoints is not None:
+            checkpoints.save(i_episode, {'guesser': env.guesser, 'dqn': agent.dqn}, acc, best=True)
+        else:
+            save_networks(i_episode, env, agent, acc)
+            save_networks(i_episode='best', env=env, agent=agent)
 
         return acc
 
@@ -417,45 +727,104 @@ def val(i_episode: int,
         return best_val_acc
 
 
-def test(env, agent, input_dim, output_dim):
-    total_steps = 0
-    """ Computes performance nad test data """
+def val_snapshot(result, best_val_acc: float, checkpoints) -> float:
+    """ val() for a result of the AsyncValidator: the evaluated snapshot (not the current networks) is saved if best """
+    print('Validation accuracy of episode {}: {:1.3f} on {} patients'.format(result.i_episode, result.acc,
+                                                                           result.n_patients))
+    METRICS.add(val_acc=result.acc, val_patients=result.n_patients)
+    if result.acc >= best_val_acc:
+        print('New best acc acheievd, saving best model')
+        checkpoints.save(result.i_episode, result.snapshot, result.acc, best=True)
+        return result.acc
+    return best_val_acc
 
-    print('Loading best networks')
-    env.guesser, agent.dqn = load_networks(i_episode='best', env=env, input_dim=input_dim, output_dim=output_dim)
-    # predict outcome on test data
-    y_hat_test = np.zeros(len(env.y_test))
-    # y_hat_test_prob = np.zeros(len(env.y_test))
 
+def play_test_patient(env, agent, patient: int) -> dict:
+    """Plays the test episode of a test patient: all `episode_length` steps, the prediction is the
+    last guess, or a forced guess if the episode ended on a question
+    Returns:
+        dict: y_hat, first_guess, first_prob (guesser probability of the first guess), steps (up to
+            and including the first guess), forced (no guess in the episode), ended_on_question (the
+            last step asked a question, so a forced guess made the prediction), actions
+    """
+    state = env.reset(mode='test',
+                      patient=patient,
+                      train_guesser=False)
+    mask = env.reset_mask()
+    actions = []
+    y_hat = first_guess = -1
+    first_prob = 0.
+    steps = FLAGS.episode_length
+
+    # run episode
+    t = 0
+    while t < FLAGS.episode_length:
+        # select action from policy
+        if stop_early(env, mask):
+            action = agent.output_dim - 1
+        elif FLAGS.acquire_k > 1:
+            action = agent.get_actions(state, env, eps=0, mask=mask, mode='test',
+                                       k=min(FLAGS.acquire_k, FLAGS.episode_length - t))
+        else:
+            action = agent.get_action(state, env, eps=0, mask=mask, mode='test')
+        mask[action] = 0
+        actions.extend(int(a) for a in np.atleast_1d(action))
+        t += np.size(action)
+        # take the action
+        state, reward, done, guess = env.step(action, mask, mode='test')
+
+        if guess != -1:
+            y_hat = env.guess
+            if first_guess == -1:
+                first_guess, first_prob, steps = guess, float(env.probs[guess]), len(actions)
+
+    # an episode ending on a question gets a forced guess (the prediction, as before); the first
+    # guess columns describe it only if the episode made no guess of its own
+    forced = first_guess == -1
+    ended_on_question = guess == -1
+    if ended_on_question:
+        a = agent.output_dim - 1
+        actions.append(a)
+        state, reward, done, guess = env.step(a, mask, mode='test')
+        y_hat = env.guess
+        if forced:
+            first_guess = env.guess
+            first_prob = float(env.probs[guess])
+            steps = len(actions)
+    return {'y_hat': y_hat, 'first_guess': first_guess, 'first_prob': first_prob, 'steps': steps,
+            'forced': forced, 'ended_on_question': ended_on_question, 'actions': actions}
+
+
+def test_episodes(env, agent) -> dict:
+    """Columns (see eval_cache.pack_rows) of `play_test_patient` for every test patient, read from the
+    evaluation cache when the networks, the split and the episode length are unchanged
+    """
+    key = eval_cache.eval_key({'guesser': env.guesser, 'dqn': agent.dqn}, env.splits.key, 'test',
+                              {'episode_length': FLAGS.episode_length, 'stop_confidence': FLAGS.stop_confidence,
+                               'acquire_k': FLAGS.acquire_k})
+    columns = EVAL_CACHE.get(key)
+    if columns is None:
+        columns = eval_cache.pack_rows([play_test_patient(env, agent, i) for i in range(len(env.X_test))])
+        EVAL_CACHE.put(key, columns)
+    else:
+        print('Using cached test episodes')
+    return columns
+
+
+def test(env, agent, input_dim, output_dim, load_best=True):
+    """ Computes performance nad test data (of the best saved networks, or of the current ones if not load_best) """
+    from sklearn.metrics import confusion_matrix
+
+    if load_best:
+        print('Loading best networks')
+        env.guesser, agent.dqn = load_networks(i_episode='best', env=env, input_dim=input_dim, output_dim=output_dim)
+    # predict outcome on test data
     print('Computing predictions of test data')
     n_test = len(env.X_test)
-    for i in range(n_test):
-        number_of_steps = 0
-        state = env.reset(mode='test',
-                          patient=i,
-                          train_guesser=False)
-        mask = env.reset_mask()
-
-        # run episode
-        for t in range(FLAGS.episode_length):
-            number_of_steps += 1
-            # select action from policy
-            action = agent.get_action(state, env, eps=0, mask=mask, mode='test')
-            mask[action] = 0
-            # take the action
-            state, reward, done, guess = env.step(action, mask, mode='test')
-
-            if guess != -1:
-                y_hat_test[i] = env.guess
-
-            # if done:
-            #     total_steps += number_of_steps
-            #     break
-        if guess == -1:
-            a = agent.output_dim - 1
-            s2, r, done, info = env.step(a, mask)
-            y_hat_test[i] = env.guess
-            total_steps += number_of_steps
+    columns = test_episodes(env, agent)
+    y_hat_test = columns['y_hat']
+    # as before: only the episodes ending on a question count, with `episode_length` steps each
+    total_steps = FLAGS.episode_length * np.sum(columns['ended_on_question'])
 
     C = confusion_matrix(env.y_test, y_hat_test)
     print('confusion matrix: ')
@@ -463,16 +832,19 @@ def test(env, agent, input_dim, output_dim):
     acc = np.sum(np.diag(C)) / len(env.y_test)
     print('Test accuracy: ', np.round(acc, 3))
     print('Average number of steps: ', np.round(total_steps / n_test, 3))
+    return acc
 
 
 #
 def show_sample_paths(n_patients, env, agent):
-    """A method to run episodes on randomly chosen positive and negative test patients, and print trajectories to console  """
+    """A method to print the trajectories of randomly chosen positive and negative test patients to console
+    (from the cached test episodes of the best networks, if test() already played them)"""
 
     # load best performing networks
     print('Loading best networks')
     input_dim, output_dim = get_env_dim(env)
     env.guesser, agent.dqn = load_networks(i_episode='best', env=env, input_dim=input_dim, output_dim=output_dim)
+    columns = test_episodes(env, agent)
 
     for i in range(n_patients):
         print('Starting new episode with a new test patient')
@@ -480,47 +852,16 @@ def show_sample_paths(n_patients, env, agent):
             idx = np.random.choice(np.where(env.y_test == 1)[0])
         else:
             idx = np.random.choice(np.where(env.y_test == 0)[0])
-        state = env.reset(mode='test',
-                          patient=idx,
-                          train_guesser=False)
-
-        mask = env.reset_mask()
-
-        # run episode
-        for t in range(FLAGS.episode_length):
-
-            # select action from policy
-            action = agent.get_action(state, env, eps=0, mask=mask, mode='test')
-            mask[action] = 0
 
+        steps = columns['steps'][idx]
+        for t, action in enumerate(eval_cache.trajectory(columns, idx)[:steps]):
             if action != env.guesser.features_size:
                 print('Step: {}, Question: '.format(t + 1), env.guesser.question_names[action], ', Answer: ',
                       env.X_test[idx, action])
 
-            # take the action
-            state, reward, done, guess = env.step(action, mask, mode='test')
-
-            if guess != -1:
-                print('Step: {}, Ready to make a guess: Prob({})={:1.3f}, Guess: y={}, Ground truth: {}'.format(t + 1,
-                                                                                                                guess,
-                                                                                                                env.probs[
-                                                                                                                    guess],
-                                                                                                                guess,
-                                                                                                                env.y_test[
-                                                                                                                    idx]))
-
-                break
-
-        if guess == -1:
-            state, reward, done, guess = env.step(agent.output_dim - 1, mask, mode='test')
-
-            print('Step: {}, Ready to make a guess: Prob({})={:1.3f}, Guess: y={}, Ground truth: {}'.format(t + 1,
-                                                                                                            guess,
-                                                                                                            env.probs[
-                                                                                                                guess],
-                                                                                                            guess,
-                                                                                                            env.y_test[
-                                                                                                                idx]))
+        guess = columns['first_guess'][idx]
+        print('Step: {}, Ready to make a guess: Prob({})={:1.3f}, Guess: y={}, Ground truth: {}'.format(
+            min(steps, FLAGS.episode_length), guess, columns['first_prob'][idx], guess, env.y_test[idx]))
         print('Episode terminated\n')
 
 
@@ -0,0 +1,106 @@
+import csv
+import json
+import os
+import time
+from collections import defaultdict
+
+
+class MetricsSink(object):
+    def __init__(self, path: str = None, flush_every: int = 20, fields=None) -> None:
+        """Buffered writer of interval metrics, instead of printing every step
+        Values passed to `add` are averaged until `emit`, which turns them into one row
+        (plus the interval wall time). Rows are written `flush_every` rows at a time.
+        The format follows the file extension: .csv or JSON lines (anything else).
+        With path=None the sink is a no-op.
+        Args:
+            path (str): output file, None disables the sink
+            flush_every (int): number of rows buffered before writing
+            fields (list): CSV columns, defaults to the keys of the rows so far (the file is
+                rewritten with a wider header when a row brings a new key)
+        """
+        self.enabled = False
+        self.rows = []
+        self.sums = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.configure(path, flush_every, fields)
+
+    def configure(self, path: str = None, flush_every: int = 20, fields=None) -> None:
+        """ (Re)directs the sink, see __init__ """
+        self.flush()
+        self.path = path
+        self.enabled = path is not None
+        self.flush_every = flush_every
+        self.fields = fields
+        self.interval_start = time.perf_counter()
+
+    def add(self, **values) -> None:
+        """ Accumulates values (e.g. reward, loss) into the current interval """
+        if not self.enabled:
+            return
+        for k, v in values.items():
+            self.sums[k] += v
+            self.counts[k] += 1
+
+    def emit(self, **values) -> None:
+        """Closes the current interval: one row of the interval means, `values` (e.g. episode, lr)
+        and the interval wall time `interval_s`
+        """
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        row = dict(values)
+        for k in self.sums:
+            row[k] = self.sums[k] / self.counts[k]
+        row['interval_s'] = now - self.interval_start
+        self.rows.append(row)
+        self.sums.clear()
+        self.counts.clear()
+        self.interval_start = now
+        if len(self.rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.enabled or not self.rows:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        if self.path.endswith('.csv'):
+            self._write_csv()
+        else:
+            with open(self.path, 'a') as f:
+                f.write(''.join(json.dumps(row) + '\n' for row in self.rows))
+        self.rows = []
+
+    def _write_csv(self) -> None:
+        # metrics that start late (loss once the replay fills, val_acc every val_interval) widen the header
+        header = []
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:  # e.g. from a resumed run
+            with open(self.path, newline='') as f:
+                header = next(csv.reader(f), [])
+        fields = list(header)
+        fields += [k for k in self.fields or [] if k not in fields]
+        fields += list(dict.fromkeys(k for row in self.rows for k in row if k not in fields))
+        if header and fields != header:
+            with open(self.path, newline='') as f:
+                previous = list(csv.DictReader(f))
+            with open(self.path + '~', 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=fields, restval='')
+                writer.writeheader()
+                writer.writerows(previous)
+                writer.writerows(self.rows)
+            os.replace(self.path + '~', self.path)
+        else:
+            with open(self.path, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=fields, restval='')
+                if not header:
+                    writer.writeheader()
+                writer.writerows(self.rows)
+        self.fields = fields
+
+    def close(self) -> None:
+        self.flush()
+
+
+# shared sink of the training loop, enabled by main() with --metrics_file
+METRICS = MetricsSink(path=None)
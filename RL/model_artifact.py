@@ -0,0 +1,108 @@
+import json
+import os
+import struct
+import numpy as np
+import torch
+from RL.dqn import DQN
+from RL.guesser import Guesser
+
+MAGIC = b'RLMODEL1'
+ALIGN = 64
+# written by main_al after training (--model_artifact), read by score / serve / feature_source (--model)
+DEFAULT_PATH = os.path.join('ddqn_models', 'best_model.rlm')
+
+
+def _flat_tensors(prefix: str, module: torch.nn.Module) -> dict:
+    return {prefix + '.' + k: v.detach().cpu().contiguous().numpy() for k, v in module.state_dict().items()}
+
+
+def save_model_artifact(path: str, guesser, dqn, feature_names) -> None:
+    """Saves both networks, their dimensions and the feature names as one artifact
+    Layout: MAGIC, 8 byte little-endian header length, JSON header, then the raw tensor
+    bytes (each aligned to 64 bytes). The header holds the network configs, the feature
+    names and the dtype / shape / offset of every tensor, so the file can be memory-mapped
+    and read without unpickling anything.
+    Args:
+        path (str): artifact file
+        guesser (Guesser): trained guesser
+        dqn (DQN): trained dqn
+        feature_names: names of the features (the questions)
+    """
+    arrays = _flat_tensors('guesser', guesser)
+    arrays.update(_flat_tensors('dqn', dqn))
+
+    tensors = {}
+    offset = 0
+    for name, a in arrays.items():
+        offset = -(-offset // ALIGN) * ALIGN
+        tensors[name] = {'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': offset}
+        offset += a.nbytes
+
+    header = {
+        'guesser': {'features_size': int(guesser.features_size),
+                    'hidden_dim1': guesser.hidden_dim1,
+                    'hidden_dim2': guesser.hidden_dim2,
+                    'num_classes': guesser.num_classes},
+        'dqn': {'input_dim': dqn.input_dim, 'output_dim': dqn.output_dim, 'hidden_dim': dqn.hidden_dim},
+        'feature_names': [str(name) for name in feature_names],
+        'tensors': tensors,
+    }
+    header_bytes = json.dumps(header).encode()
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGN) * ALIGN
+    header_bytes += b' ' * (data_start - len(MAGIC) - 8 - len(header_bytes))
+
+    with open(path + '~', 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for name, a in arrays.items():
+            f.seek(data_start + tensors[name]['offset'])
+            f.write(a.tobytes())
+    os.replace(path + '~', path)
+
+
+def read_header(path: str) -> dict:
+    """ Returns the JSON header of an artifact """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a model artifact'.format(path))
+        n = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(n))
+    header['data_start'] = len(MAGIC) + 8 + n
+    return header
+
+
+def _load_into(module: torch.nn.Module, tensors: dict) -> None:
+    try:
+        module.load_state_dict(tensors, assign=True)  # parameters use the mapped memory directly
+    except TypeError:  # torch without `assign`
+        module.load_state_dict(tensors)
+
+
+def load_model_artifact(path: str, device='cpu'):
+    """Loads the networks of an artifact saved by `save_model_artifact`
+    The tensor data is memory-mapped copy-on-write, nothing is unpickled and no dataset is read.
+    Returns:
+        Guesser: guesser in eval mode
+        DQN: dqn in eval mode
+        dict: the header (configs and 'feature_names')
+    """
+    header = read_header(path)
+    buf = np.memmap(path, dtype=np.uint8, mode='c')
+    tensors = {'guesser': {}, 'dqn': {}}
+    for name, t in header['tensors'].items():
+        net, key = name.split('.', 1)
+        dtype = np.dtype(t['dtype'])
+        count = int(np.prod(t['shape'], dtype=np.int64))
+        a = np.frombuffer(buf, dtype=dtype, count=count,
+                          offset=header['data_start'] + t['offset']).reshape(t['shape'])
+        tensors[net][key] = torch.from_numpy(a)
+
+    guesser = Guesser(**header['guesser'])
+    dqn = DQN(**header['dqn'])
+    _load_into(guesser, tensors['guesser'])
+    _load_into(dqn, tensors['dqn'])
+    guesser.question_names = np.array(header['feature_names'])
+    guesser.to(device=device).eval()
+    dqn.to(device=device).eval()
+    return guesser, dqn, header
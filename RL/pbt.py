@@ -0,0 +1,223 @@
+"""Population-based training of the main_al agent
+
+N members train at the same time, one per worker process, on one shared-memory copy of the
+dataset (see sweep.py). Every `ready_interval` episodes a member measures its validation
+accuracy, publishes its networks, optimizer state and hyperparameters to a local file and its
+score to a shared array. A member in the bottom `quantile` of the population then copies a
+member of the top `quantile` (exploit) and perturbs its lr, gamma and epsilon schedule (explore):
+
+    python -m RL.pbt --population 8 --n_episodes 20000 --ready_interval 1000 --dataset diabetes
+
+The members run asynchronously, each acting on the latest published scores. Every ready point
+of every member is a row of pbt/pbt_results.csv.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+
+import RL.sweep as sweep
+import main_al
+from main_al import myEnv, Agent, ReplayMemory, get_env_dim, play_episode, epsilon_annealing
+from RL.splits import Splits
+from RL.shared_arrays import share_array
+
+# perturbed hyperparameters, as FLAGS names
+HYPERPARAMS = ('lr', 'gamma', 'max_episode', 'min_eps')
+
+# validation accuracy of each member (nan until its first ready point), set by _init_member
+_SCORES = None
+
+
+def _init_member(x_spec, y_spec, question_names, threads, scores):
+    global _SCORES
+    sweep._init_worker(x_spec, y_spec, question_names, threads)
+    _SCORES = scores
+
+
+def _member_file(out_dir: str, member: int) -> str:
+    return os.path.join(out_dir, 'member_{}.pth'.format(member))
+
+
+def publish(path: str, env, agent, hyperparams: dict, episode: int, acc: float) -> None:
+    """Writes the networks (the guesser too: the dqn was trained against it), optimizer / scheduler
+    state and hyperparameters of a member for the others to copy
+    """
+    state = {'guesser': env.guesser.state_dict(),
+             'dqn': agent.dqn.state_dict(),
+             'target_dqn': agent.target_dqn.state_dict(),
+             'optim': agent.optim.state_dict(),
+             'scheduler': agent.scheduler.state_dict(),
+             'hyperparams': hyperparams,
+             'episode': episode,
+             'val_acc': acc}
+    torch.save(state, path + '~')
+    os.replace(path + '~', path)
+
+
+def explore(hyperparams: dict, rng: random.Random, factors=(0.8, 1.2)) -> dict:
+    """Perturbs each hyperparameter by one of `factors`: lr and the epsilon schedule directly,
+    gamma through 1 - gamma (its horizon), so it stays below 1
+    """
+    h = dict(hyperparams)
+    h['lr'] = h['lr'] * rng.choice(factors)
+    h['gamma'] = min(1. - (1. - h['gamma']) * rng.choice(factors), 0.999)
+    h['max_episode'] = max(int(h['max_episode'] * rng.choice(factors)), 1)
+    h['min_eps'] = min(h['min_eps'] * rng.choice(factors), 1.)
+    return h
+
+
+def exploit(env, agent, state: dict, hyperparams: dict) -> None:
+    """ Loads a published member `state` into `env` / `agent`, with `hyperparams` in place of the member's """
+    env.guesser.load_state_dict(state['guesser'])
+    agent.dqn.load_state_dict(state['dqn'])
+    agent.target_dqn.load_state_dict(state['target_dqn'])
+    agent.optim.load_state_dict(state['optim'])
+    agent.scheduler.load_state_dict(state['scheduler'])
+    # the scheduler derives the lr from base_lrs, so both move by the perturbation factor
+    factor = hyperparams['lr'] / state['hyperparams']['lr']
+    agent.scheduler.base_lrs = [lr * factor for lr in agent.scheduler.base_lrs]
+    for group in agent.optim.param_groups:
+        group['lr'] *= factor
+    for k in ('gamma', 'max_episode', 'min_eps'):
+        setattr(main_al.FLAGS, k, hyperparams[k])
+
+
+def select_donor(member: int, scores, quantile: float, rng: random.Random):
+    """Returns a member of the top `quantile` to copy if `member` is in the bottom `quantile`
+    of the members with a score, else None
+    """
+    ranked = sorted((k for k in range(len(scores)) if not math.isnan(scores[k])), key=lambda k: scores[k])
+    n = max(int(len(ranked) * quantile), 1)
+    if len(ranked) < 2 or member not in ranked[:n]:
+        return None
+    return rng.choice([k for k in ranked[-n:] if k != member])
+
+
+def run_member(member: int, overrides: dict, n_episodes: int, ready_interval: int, out_dir: str,
+               quantile: float = .25, seed: int = 0, load_pretrained_guesser: bool = True) -> list:
+    """Trains one member of the population, exploiting / exploring at every ready point
+    Returns:
+        list: one row per ready point (member, episode, val_acc, hyperparameters, copied_from),
+            the last one with the test accuracy of the final networks
+    """
+    config = sweep.make_config(overrides)
+    sweep.apply_config(config, os.path.join(out_dir, 'member_{}'.format(member)))
+    rng = random.Random(seed + member)
+    random.seed(seed + member)
+    np.random.seed(seed + member)
+    torch.manual_seed(seed + member)
+
+    env = myEnv(flags=main_al.FLAGS, device=torch.device('cpu'),
+                load_pretrained_guesser=load_pretrained_guesser, data=sweep._DATA)
+    input_dim, output_dim = get_env_dim(env)
+    agent = Agent(input_dim, output_dim, config.hidden_dim, config.lr, config.weight_decay)
+    replay_memory = ReplayMemory(config.capacity)
+    hyperparams = {k: getattr(config, k) for k in HYPERPARAMS}
+
+    rows = []
+    best_val_acc = 0
+    start = time.perf_counter()
+    for i in range(1, n_episodes + 1):
+        eps = epsilon_annealing(i, main_al.FLAGS.max_episode, main_al.FLAGS.min_eps)
+        play_episode(env, agent, replay_memory, eps, main_al.FLAGS.batch_size,
+                     train_dqn=True, train_guesser=False, mode='training')
+        if i % main_al.FLAGS.n_update_target_dqn == 0:
+            agent.update_target_dqn()
+        if i % ready_interval:
+            continue
+
+        acc = main_al.val_accuracy(env, agent)
+        if acc >= best_val_acc:
+            best_val_acc = acc
+            main_al.save_networks(i_episode='best', env=env, agent=agent)
+        row = dict(member=member, episode=i, val_acc=float(acc), **hyperparams, copied_from=None,
+                   elapsed_s=time.perf_counter() - start)
+        # the file is complete before the score points others at it
+        publish(_member_file(out_dir, member), env, agent, hyperparams, i, acc)
+        _SCORES[member] = acc
+
+        donor = select_donor(member, _SCORES, quantile, rng)
+        if donor is not None:
+            state = torch.load(_member_file(out_dir, donor), weights_only=False)
+            hyperparams = explore(state['hyperparams'], rng)
+            exploit(env, agent, state, hyperparams)
+            _SCORES[member] = state['val_acc']
+            row['copied_from'] = donor
+            print('Member {} (val acc {:1.3f}) copies member {} (val acc {:1.3f}) at episode {}'.format(
+                member, acc, donor, state['val_acc'], i))
+        rows.append(row)
+
+    test_acc = main_al.test(env, agent, input_dim, output_dim, load_best=False)
+    if rows:
+        rows[-1]['test_acc'] = float(test_acc)
+    return rows
+
+
+def run_population(population: int, data, n_episodes: int, ready_interval: int, out_dir: str = 'pbt',
+                   overrides: dict = None, quantile: float = .25, seed: int = 0,
+                   threads_per_worker: int = 1, load_pretrained_guesser: bool = True) -> list:
+    """Trains `population` members concurrently on one shared copy of `data` ((X, y, question_names))
+    Returns:
+        list: the rows of every member, also written to out_dir/pbt_results.csv
+    """
+    X, y, question_names = data
+    Splits(X, y)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    x_block, x_spec = share_array(np.ascontiguousarray(X))
+    y_block, y_spec = share_array(np.ascontiguousarray(y))
+    scores = multiprocessing.Array('d', [float('nan')] * population)
+    try:
+        with ProcessPoolExecutor(max_workers=population, initializer=_init_member,
+                                 initargs=(x_spec, y_spec, question_names, threads_per_worker, scores)) as pool:
+            futures = [pool.submit(run_member, k, overrides or {}, n_episodes, ready_interval, out_dir,
+                                   quantile, seed, load_pretrained_guesser)
+                       for k in range(population)]
+            rows = [row for f in futures for row in f.result()]
+    finally:
+        for block in (x_block, y_block):
+            block.close()
+            block.unlink()
+
+    rows.sort(key=lambda r: (r['episode'], r['member']))
+    sweep.write_table(rows, os.path.join(out_dir, 'pbt_results.csv'))
+    return rows
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--population", type=int, default=8, help="Number of members (worker processes)")
+    parser.add_argument("--n_episodes", type=int, default=20000, help="Episodes per member")
+    parser.add_argument("--ready_interval", type=int, default=1000, help="Episodes between exploit / explore steps")
+    parser.add_argument("--quantile", type=float, default=.25, help="Fraction of members replaced / copied")
+    parser.add_argument("--config", type=str, default='{}', help="JSON of main_al flags shared by all members")
+    parser.add_argument("--dataset", type=str, default='diabetes', help="diabetes | covid | synthetic:<size>")
+    parser.add_argument("--n_samples", type=int, default=5000, help="Patients of a synthetic dataset")
+    parser.add_argument("--pretrained_guesser", type=int, default=1, help="Whether to load model_guesser/best_guesser.pth")
+    parser.add_argument("--threads_per_worker", type=int, default=1, help="torch threads of each member")
+    parser.add_argument("--out_dir", type=str, default='pbt', help="Directory of the members and of the table")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    flags = parser.parse_args(args)
+
+    overrides = json.loads(flags.config)
+    sweep.make_config(overrides)  # fail on unknown flags before starting the pool
+    rows = run_population(flags.population, sweep.load_dataset(flags.dataset, flags.n_samples),
+                          flags.n_episodes, flags.ready_interval, flags.out_dir, overrides,
+                          flags.quantile, flags.seed, flags.threads_per_worker, bool(flags.pretrained_guesser))
+    final = [r for r in rows if 'test_acc' in r]
+    for r in sorted(final, key=lambda r: r['val_acc'], reverse=True):
+        print('member {member}: val acc {val_acc:1.3f}, test acc {test_acc:1.3f}, lr {lr:.2e}, gamma {gamma:.3f}, '
+              'max_episode {max_episode}, min_eps {min_eps:.3f}'.format(**r))
+    print('Saved results to {}'.format(os.path.join(flags.out_dir, 'pbt_results.csv')))
+    return rows
+
+
+if __name__ == '__main__':
+    main()
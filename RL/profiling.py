@@ -0,0 +1,106 @@
+import contextlib
+import json
+import time
+from collections import defaultdict
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+class _Phase(object):
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.timer.times[self.name] += time.perf_counter() - self.start
+        self.timer.counts[self.name] += 1
+
+
+class PhaseTimer(object):
+    def __init__(self, enabled: bool = False) -> None:
+        """Accumulates wall time and call counts per named phase of the training loop
+        Usage: `with PROFILER.phase('env_step'): ...`. When disabled, `phase` returns a shared
+        no-op context, so instrumented code costs one attribute lookup.
+        Phases may nest (e.g. guesser_forward is part of env_step), the times are inclusive.
+        """
+        self.enabled = enabled
+        self.times = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.trace_window = None
+        self.trace_file = 'trace.json'
+        self._trace = None
+
+    def phase(self, name: str):
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return _Phase(self, name)
+
+    def reset(self) -> None:
+        self.times.clear()
+        self.counts.clear()
+
+    def results(self) -> dict:
+        """ {phase: {'calls', 'total_s', 'mean_us'}} """
+        return {name: {'calls': self.counts[name],
+                       'total_s': self.times[name],
+                       'mean_us': 1e6 * self.times[name] / max(self.counts[name], 1)}
+                for name in sorted(self.times, key=self.times.get, reverse=True)}
+
+    def summary(self, title: str = '') -> str:
+        """ Returns the results as a text table """
+        lines = ['{:<20}{:>12}{:>12}{:>12}'.format('phase' + (' ' + title if title else ''),
+                                                    'calls', 'total s', 'mean us')]
+        for name, r in self.results().items():
+            lines.append('{:<20}{:>12d}{:>12.3f}{:>12.1f}'.format(name, r['calls'], r['total_s'], r['mean_us']))
+        return '\n'.join(lines)
+
+    def dump(self, path: str, **extra) -> None:
+        """ Writes the results (and any extra fields, e.g. the episode) to a JSON file """
+        with open(path, 'w') as f:
+            json.dump(dict(extra, phases=self.results()), f, indent=1)
+
+    def set_trace_window(self, window: str, trace_file: str = 'trace.json') -> None:
+        """Records a torch.profiler trace of the episodes in `window` ('start:end', end excluded)
+        Args:
+            window (str): episode range, '' disables tracing
+            trace_file (str): chrome trace output file
+        """
+        if window:
+            start, end = window.split(':')
+            self.trace_window = (int(start), int(end))
+        self.trace_file = trace_file
+
+    def on_episode(self, i_episode: int) -> None:
+        """ Starts / stops the torch.profiler trace at the edges of the trace window """
+        if self.trace_window is None:
+            return
+        start, end = self.trace_window
+        if i_episode == start and self._trace is None:
+            import torch.profiler
+            self._trace = torch.profiler.profile(record_shapes=False)
+            self._trace.__enter__()
+        elif i_episode == end:
+            self.close(i_episode)
+
+    def close(self, i_episode: int = None) -> None:
+        """Stops an open trace and exports it, e.g. when training stops before the end of the window
+        Args:
+            i_episode (int): first episode not in the trace
+        """
+        if self._trace is None:
+            return
+        self._trace.__exit__(None, None, None)
+        self._trace.export_chrome_trace(self.trace_file)
+        end = self.trace_window[1] if i_episode is None else i_episode
+        print('Saved torch.profiler trace of episodes {}-{} to {}'.format(self.trace_window[0], end - 1,
+                                                                          self.trace_file))
+        self._trace = None
+
+
+# shared timer of the training loop, enabled by main() with --profile
+PROFILER = PhaseTimer(enabled=False)
@@ -0,0 +1,155 @@
+import html
+import os
+import queue
+import threading
+import numpy as np
+
+
+def _new_figure(figsize):
+    """ A figure on the Agg canvas, without pyplot: nothing is shown and no global backend is touched """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def _render_lines(path, panels, figsize):
+    fig = _new_figure(figsize)
+    for k, panel in enumerate(panels):
+        ax = fig.add_subplot(1, len(panels), k + 1)
+        y = panel['y']
+        x = panel.get('x', range(1, len(y) + 1))
+        ax.plot(x, y, marker=panel.get('marker'), linestyle='-', color=panel.get('color', 'b'))
+        ax.set_title(panel.get('title', ''))
+        ax.set_xlabel(panel.get('xlabel', ''))
+        ax.set_ylabel(panel.get('ylabel', ''))
+        ax.grid(panel.get('grid', False))
+    fig.tight_layout()
+    fig.savefig(path)
+
+
+def _render_image(path, image, title, labels, figsize):
+    fig = _new_figure(figsize)
+    ax = fig.add_subplot(1, 1, 1)
+    ax.set_title(title, fontsize=18)
+    ax.get_yaxis().set_visible(False)
+    ax.get_xaxis().set_visible(False)
+    ax.imshow(image, cmap='gray')
+    for x, y, text in labels:
+        ax.text(x, y, text, ha="center", va="center", color="b", size=15)
+    fig.savefig(path)
+
+
+class ReportWriter(object):
+    def __init__(self, out_dir: str = '.', title: str = 'Training report') -> None:
+        """Renders the plots of a run on a background thread and collects them in one HTML report
+        `lines` and `image` copy their data and return at once. The figures are drawn on the
+        non-interactive Agg canvas by a single worker thread, so the training loop never blocks on
+        matplotlib and nothing hangs on a headless node. `close` waits for the queued figures and
+        writes `report.html`, a grid of every PNG rendered during the run.
+        Args:
+            out_dir (str): directory of the PNGs (relative file names) and of report.html
+            title (str): title of the HTML report
+        """
+        self.error = None
+        self.queue = queue.Queue()
+        self.thread = None
+        self.figures = []
+        self.configure(out_dir, title)
+
+    def configure(self, out_dir: str = '.', title: str = 'Training report') -> None:
+        self.out_dir = out_dir
+        self.title = title
+
+    def lines(self, filename: str, panels: list, figsize=(10, 5)) -> str:
+        """Queues a figure of line plots, one panel per series
+        Args:
+            filename (str): PNG file, relative to out_dir
+            panels (list): dicts with 'y' and optionally 'x', 'title', 'xlabel', 'ylabel', 'color', 'marker', 'grid'
+        Returns:
+            str: path of the PNG (written once the worker gets to it)
+        """
+        panels = [dict(p, y=np.array(p['y'], copy=True)) for p in panels]
+        return self._submit(filename, panels[0].get('title', filename), _render_lines, panels, figsize)
+
+    def image(self, filename: str, image: np.ndarray, title: str = '', labels=(), figsize=(6.4, 4.8)) -> str:
+        """Queues a grayscale image with text labels
+        Args:
+            filename (str): PNG file, relative to out_dir (or absolute)
+            image (np.ndarray): 2-D array, copied so the caller may reuse it
+            title (str): figure title
+            labels: (x, y, text) annotations
+        Returns:
+            str: path of the PNG
+        """
+        return self._submit(filename, title, _render_image, np.array(image, copy=True), title, list(labels), figsize)
+
+    def wait(self) -> None:
+        """ Blocks until every queued figure is on disk """
+        self.queue.join()
+        self._raise_error()
+
+    def close(self) -> str:
+        """ Renders the queued figures, stops the worker and writes the HTML report, returns its path """
+        if self.thread is not None:
+            self.wait()
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if not self.figures:
+            return None
+        return self.write_html()
+
+    def write_html(self) -> str:
+        path = os.path.join(self.out_dir, 'report.html')
+        cells = []
+        for png, caption in self.figures:
+            src = html.escape(os.path.relpath(png, self.out_dir))
+            cells.append('<figure><img src="{}"><figcaption>{}</figcaption></figure>'.format(src, html.escape(caption)))
+        page = ('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{0}</title>\n'
+                '<style>body{{font-family:sans-serif}} .grid{{display:grid;'
+                'grid-template-columns:repeat(auto-fill,minmax(420px,1fr));gap:12px}}'
+                ' img{{width:100%}}</style></head>\n'
+                '<body><h1>{0}</h1>\n<div class="grid">\n{1}\n</div></body></html>\n').format(
+            html.escape(self.title), '\n'.join(cells))
+        with open(path + '~', 'w') as f:
+            f.write(page)
+        os.replace(path + '~', path)
+        return path
+
+    def _submit(self, filename, caption, render, *args) -> str:
+        self._raise_error()
+        path = os.path.join(self.out_dir, filename)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        self.figures.append((path, caption))
+        self.queue.put((render, path) + args)
+        return path
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            try:
+                render, path = item[:2]
+                directory = os.path.dirname(path)
+                if directory and not os.path.exists(directory):
+                    os.makedirs(directory)
+                render(path, *item[2:])
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+
+# shared report of a run, main() sets the directory with --report_dir and closes it at the end
+REPORT = ReportWriter()
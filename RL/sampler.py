@@ -0,0 +1,51 @@
+import numpy as np
+import torch
+from torch.utils.data import WeightedRandomSampler
+
+
+class ClassWeightedSampler(object):
+    def __init__(self, y: np.ndarray, class_weights='balanced') -> None:
+        """Draws sample indices with per-class weights instead of duplicating rows
+        Args:
+            y (np.ndarray): 1-D array of labels
+            class_weights: 'balanced' (every class equally likely), None (every sample
+                equally likely) or a dict {label: weight} of per-sample weights
+        """
+        self.classes, y_inds = np.unique(y, return_inverse=True)
+        self.class_inds = [np.flatnonzero(y_inds == c) for c in range(len(self.classes))]
+        counts = np.array([len(inds) for inds in self.class_inds], dtype=np.float64)
+
+        if class_weights is None:
+            weights = np.ones(len(self.classes))
+        elif class_weights == 'balanced':
+            weights = 1. / counts
+        else:
+            weights = np.array([class_weights.get(c, 1.) for c in self.classes], dtype=np.float64)
+
+        self.class_probs = weights * counts / np.sum(weights * counts)
+        self.sample_weights = weights[y_inds]
+
+    def sample(self) -> int:
+        """ Draws one index: a class by its probability, then a sample of that class uniformly """
+        c = np.random.choice(len(self.classes), p=self.class_probs)
+        inds = self.class_inds[c]
+        return int(inds[np.random.randint(len(inds))])
+
+    def oversample_indices(self, shuffle: bool = True) -> np.ndarray:
+        """Indices of a class balanced epoch: every sample once, plus minority samples
+        drawn with replacement until each class has as many indices as the largest one
+        """
+        n_max = max(len(inds) for inds in self.class_inds)
+        extra = [np.random.choice(inds, n_max - len(inds), replace=True) for inds in self.class_inds]
+        indices = np.concatenate(self.class_inds + extra)
+        if shuffle:
+            np.random.shuffle(indices)
+        return indices
+
+    def torch_sampler(self, num_samples=None) -> WeightedRandomSampler:
+        """ DataLoader sampler drawing `num_samples` (default: dataset size) indices with these weights """
+        if num_samples is None:
+            num_samples = len(self.sample_weights)
+        return WeightedRandomSampler(torch.from_numpy(self.sample_weights),
+                                     num_samples=num_samples,
+                                     replacement=True)
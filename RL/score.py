@@ -0,0 +1,137 @@
+"""Streaming batch scoring of a patient file with a trained model artifact
+
+Reads a CSV or Parquet file chunk by chunk, plays the greedy acquisition episode of every
+patient of a chunk at once (one dqn / guesser forward per step for the whole chunk) and appends
+the questions asked, the predicted class, its probability and the number of steps to the output,
+so memory depends on --chunk_size only, not on the file size:
+
+    python -m RL.score --model ddqn_models/best_model.rlm --input patients.parquet --out scores.csv --id_column patient_id
+"""
+import argparse
+import csv
+import os
+import time
+import numpy as np
+import torch
+
+from RL.model_artifact import load_model_artifact, DEFAULT_PATH
+
+
+def read_chunks(path: str, columns: list, chunk_size: int = 65536, id_column: str = None):
+    """Yields (ids, X) per chunk of a CSV or Parquet file
+    Args:
+        path (str): .csv or .parquet file
+        columns (list): feature columns, in the order of the model
+        chunk_size (int): rows per chunk
+        id_column (str): column of the patient ids, None numbers the rows
+    Yields:
+        np.ndarray: ids of the chunk
+        np.ndarray: float32 features of shape (rows, len(columns))
+    """
+    from RL.utils import encode_categoricals
+    usecols = list(columns) + ([id_column] if id_column else [])
+    start = 0
+    if path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        batches = (batch.to_pandas() for batch in
+                   pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=usecols))
+    else:
+        import pandas as pd
+        batches = pd.read_csv(path, usecols=usecols, chunksize=chunk_size)
+    for df in batches:
+        ids = df[id_column].to_numpy() if id_column else np.arange(start, start + len(df))
+        start += len(df)
+        # raw files hold the categorical answers as text (e.g. gender 'Female'), encoded as in training
+        yield ids, encode_categoricals(df[list(columns)].copy()).to_numpy(dtype=np.float32)
+
+
+@torch.no_grad()
+def score_batch(guesser, dqn, X: np.ndarray, episode_length: int, device='cpu'):
+    """Plays the greedy episode (as show_sample_paths / play_test_patient up to the first guess) of every
+    row of X at once: each step asks the best unasked question, or guesses, per row
+    Returns:
+        np.ndarray: actions of shape (rows, episode_length + 1), -1 after the guess
+        np.ndarray: predicted class per row
+        np.ndarray: probability of the predicted class
+        np.ndarray: steps per row, including the guess
+    """
+    n_rows, n = X.shape
+    X = torch.from_numpy(X).to(device)
+    rows = torch.arange(n_rows, device=device)
+    state = torch.zeros(n_rows, 2 * n, device=device)
+    mask = torch.ones(n_rows, n + 1, device=device)
+    actions = torch.full((n_rows, episode_length + 1), -1, dtype=torch.long, device=device)
+    guess = torch.full((n_rows,), -1, dtype=torch.long, device=device)
+    prob = torch.zeros(n_rows, device=device)
+    steps = torch.zeros(n_rows, dtype=torch.long, device=device)
+    active = torch.ones(n_rows, dtype=torch.bool, device=device)
+
+    for t in range(episode_length + 1):
+        if not active.any():
+            break
+        idx = rows[active]
+        if t < episode_length:
+            action = torch.argmax(dqn(state[idx]) * mask[idx], dim=1)
+        else:  # no guess within the episode: forced guess
+            action = torch.full_like(idx, n)
+        actions[idx, t] = action
+        steps[idx] = t + 1
+
+        ask = action < n
+        q_rows, q = idx[ask], action[ask]
+        state[q_rows, q] = X[q_rows, q]
+        state[q_rows, q + n] += 1.
+        mask[q_rows, q] = 0
+
+        g_rows = idx[~ask]
+        if len(g_rows):
+            probs = guesser(state[g_rows, :n])
+            prob[g_rows], guess[g_rows] = torch.max(probs, dim=1)
+            active[g_rows] = False
+    return actions.cpu().numpy(), guess.cpu().numpy(), prob.cpu().numpy(), steps.cpu().numpy()
+
+
+def score_chunks(chunks, guesser, dqn, feature_names, episode_length: int, device='cpu'):
+    """ Yields the output rows of each chunk of `read_chunks` """
+    n = len(feature_names)
+    for ids, X in chunks:
+        actions, guess, prob, steps = score_batch(guesser, dqn, X, episode_length, device)
+        yield [[patient, ';'.join(feature_names[a] for a in row if 0 <= a < n), g, '{:.6f}'.format(p), s]
+               for patient, row, g, p, s in zip(ids, actions, guess, prob, steps)]
+
+
+def write_rows(path: str, chunks) -> int:
+    """ Appends the rows of each chunk to a CSV as it arrives, returns the number of rows """
+    count = 0
+    with open(path + '~', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['patient', 'questions', 'prediction', 'probability', 'steps'])
+        for rows in chunks:
+            writer.writerows(rows)
+            count += len(rows)
+    os.replace(path + '~', path)
+    return count
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--model", type=str, default=DEFAULT_PATH, help="Model artifact (see model_artifact.py)")
+    parser.add_argument("--input", type=str, required=True, help="Patient file, .csv or .parquet")
+    parser.add_argument("--out", type=str, default='scores.csv', help="Output CSV")
+    parser.add_argument("--id_column", type=str, default=None, help="Patient id column, default: row number")
+    parser.add_argument("--chunk_size", type=int, default=65536, help="Patients per chunk")
+    parser.add_argument("--episode_length", type=int, default=5, help="Episode length (as main_al --episode_length)")
+    flags = parser.parse_args(args)
+
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    guesser, dqn, header = load_model_artifact(flags.model, device=device)
+    feature_names = header['feature_names'][:guesser.features_size]
+
+    start = time.perf_counter()
+    chunks = read_chunks(flags.input, feature_names, flags.chunk_size, flags.id_column)
+    count = write_rows(flags.out, score_chunks(chunks, guesser, dqn, feature_names, flags.episode_length, device))
+    print('Scored {} patients in {:.1f} s, saved to {}'.format(count, time.perf_counter() - start, flags.out))
+
+
+if __name__ == '__main__':
+    main()
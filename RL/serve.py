@@ -0,0 +1,280 @@
+"""Asyncio questionnaire service with micro-batched inference
+
+Hosts many concurrent questionnaire sessions in one process. The "next question" (dqn) and
+"final guess" (guesser) requests of all sessions are queued and coalesced into micro-batches:
+a batch is run when it is full (--max_batch) or when its oldest request has waited --max_wait_ms,
+so one forward pass serves many sessions. Sessions are rows of a SessionStore (session_store.py):
+idle ones are evicted after --ttl_s and the open ones can be snapshotted to --snapshot, so a
+restart resumes them. The protocol is JSON lines over TCP:
+
+    python -m RL.serve --model ddqn_models/best_model.rlm --port 8765
+
+    {"op": "start", "answers": {"age": 54}}      -> {"session": "...", "question": "bmi", "step": 1}
+    {"op": "answer", "session": "...", "value": 31.2}
+                                                 -> {"session": "...", "question": ..., "step": 2}
+                                                 or {"session": "...", "done": true, "prediction": 1,
+                                                     "probability": 0.81, "steps": 4, "questions": [...]}
+    {"op": "stats"}                              -> latency percentiles (ms) and mean batch sizes
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+
+from RL.eval_cache import weights_hash
+from RL.model_artifact import load_model_artifact, DEFAULT_PATH
+from RL.session_store import SessionStore
+from RL.utils import encode_answer
+
+
+class LatencyStats(object):
+    def __init__(self, window: int = 10000) -> None:
+        """ Latencies of the last `window` requests per operation """
+        self.window = window
+        self.samples = {}
+
+    def add(self, op: str, seconds: float) -> None:
+        self.samples.setdefault(op, deque(maxlen=self.window)).append(seconds)
+
+    def percentiles(self, q=(50, 90, 99)) -> dict:
+        """ {op: {'count', 'p50_ms', ...}} """
+        return {op: dict({'count': len(s)},
+                         **{'p{}_ms'.format(p): float(v) for p, v in zip(q, 1e3 * np.percentile(s, q))})
+                for op, s in self.samples.items() if s}
+
+
+class MicroBatcher(object):
+    def __init__(self, fn, max_batch: int = 64, max_wait_ms: float = 2., executor=None) -> None:
+        """Coalesces concurrent `submit` calls into calls of `fn` on lists of items
+        A batch runs when it has `max_batch` items or `max_wait_ms` after its first item arrived.
+        `fn` runs in `executor` (a single thread by default), so the event loop keeps accepting
+        requests while a batch is computed.
+        Args:
+            fn: function of a list of items returning the list of their results
+            max_batch (int): largest batch
+            max_wait_ms (float): longest wait of a request for its batch to fill
+        """
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1e3
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.items = []
+        self.futures = []
+        self.timer = None
+        self.batches = 0
+        self.batched = 0
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.items.append(item)
+        self.futures.append(future)
+        if len(self.items) >= self.max_batch:
+            self._flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.items:
+            return
+        items, futures = self.items, self.futures
+        self.items, self.futures = [], []
+        self.batches += 1
+        self.batched += len(items)
+        task = asyncio.get_running_loop().run_in_executor(self.executor, self.fn, items)
+        task.add_done_callback(lambda t: self._resolve(t, futures))
+
+    @staticmethod
+    def _resolve(task, futures):
+        # a request may have been cancelled (its client went away) while the batch ran
+        error = task.exception()
+        results = task.result() if error is None else [None] * len(futures)
+        for f, result in zip(futures, results):
+            if f.done():
+                continue
+            if error is not None:
+                f.set_exception(error)
+            else:
+                f.set_result(result)
+
+    def mean_batch(self) -> float:
+        return self.batched / max(self.batches, 1)
+
+
+class QuestionnaireServer(object):
+    def __init__(self, guesser, dqn, feature_names, episode_length: int = 5,
+                 max_batch: int = 64, max_wait_ms: float = 2., ttl_s: float = 1800.) -> None:
+        """Questionnaire sessions over a trained guesser / dqn pair, see the module docstring
+        Args:
+            guesser (Guesser): trained guesser (eval mode, cpu)
+            dqn (DQN): trained dqn
+            feature_names: names of the features, the questions
+            episode_length (int): questions before a forced guess
+            max_batch (int): largest micro-batch
+            max_wait_ms (float): longest wait of a request for its micro-batch
+            ttl_s (float): idle time after which a session is evicted
+        """
+        self.guesser = guesser
+        self.dqn = dqn
+        self.feature_names = list(feature_names)
+        self.n = len(self.feature_names)
+        self.index = {name: i for i, name in enumerate(self.feature_names)}
+        self.episode_length = episode_length
+        # sessions started with other weights are refused, their questions came from another policy
+        self.model_version = weights_hash({'guesser': guesser, 'dqn': dqn})[:12]
+        self.store = SessionStore(self.n, episode_length, self.model_version, ttl_s=ttl_s)
+        self.latency = LatencyStats()
+        # both networks share one inference thread
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.dqn_batcher = MicroBatcher(self._next_actions, max_batch, max_wait_ms, executor)
+        self.guess_batcher = MicroBatcher(self._guesses, max_batch, max_wait_ms, executor)
+
+    @torch.no_grad()
+    def _next_actions(self, items):
+        states = torch.from_numpy(np.stack([s for s, _ in items]))
+        masks = torch.from_numpy(np.stack([m for _, m in items]))
+        return torch.argmax(self.dqn(states) * masks, dim=1).tolist()
+
+    @torch.no_grad()
+    def _guesses(self, items):
+        probs = self.guesser(torch.from_numpy(np.stack(items)))
+        prob, guess = torch.max(probs, dim=1)
+        return list(zip(guess.tolist(), prob.tolist()))
+
+    async def start(self, answers: dict = None) -> dict:
+        """ Opens a session, with optional answers known upfront ({feature name: value}), and returns its first step """
+        # resolved before the session is created, so bad input does not leave a row behind
+        known = [(self.index[name], encode_answer(name, value)) for name, value in (answers or {}).items()]
+        session_id = self.store.create()
+        slot = self.store.slots[session_id]
+        for question, value in known:
+            self.store.answer(slot, question, value, counted=False)
+        return await self._advance(session_id, slot)
+
+    async def answer(self, session_id: str, value: float) -> dict:
+        """ Records the answer to the pending question of a session and returns its next step """
+        slot = self.store.slot(session_id)
+        if self.store.pending[slot] < 0:
+            raise ValueError('session {} has no pending question'.format(session_id))
+        question = int(self.store.pending[slot])
+        self.store.answer(slot, question, encode_answer(self.feature_names[question], value))
+        self.store.pending[slot] = -1
+        return await self._advance(session_id, slot)
+
+    async def _advance(self, session_id: str, slot: int) -> dict:
+        start = time.perf_counter()
+        store = self.store
+        action = self.n
+        if store.steps[slot] < self.episode_length:
+            action = await self.dqn_batcher.submit((store.state(slot), store.mask(slot)))
+            # the session may have expired while its batch ran, and its row been reused
+            if store.slots.get(session_id) != slot:
+                raise KeyError(session_id)
+        if action < self.n:
+            store.ask(slot, action)
+            self.latency.add('next_question', time.perf_counter() - start)
+            return {'session': session_id, 'question': self.feature_names[action], 'step': int(store.steps[slot])}
+
+        store.steps[slot] += 1
+        steps, questions = int(store.steps[slot]), [self.feature_names[q] for q in store.questions(slot)]
+        state = store.state(slot)[:self.n]
+        store.end(session_id)
+        guess, prob = await self.guess_batcher.submit(state)
+        self.latency.add('guess', time.perf_counter() - start)
+        return {'session': session_id, 'done': True, 'prediction': guess, 'probability': prob,
+                'steps': steps, 'questions': questions}
+
+    def stats(self) -> dict:
+        return {'sessions': len(self.store), 'model_version': self.model_version,
+                'latency': self.latency.percentiles(),
+                'mean_batch': {'dqn': self.dqn_batcher.mean_batch(), 'guesser': self.guess_batcher.mean_batch()}}
+
+    async def handle(self, request: dict) -> dict:
+        op = request.get('op')
+        if op == 'start':
+            return await self.start(request.get('answers'))
+        if op == 'answer':
+            return await self.answer(request['session'], request['value'])
+        if op == 'stats':
+            return self.stats()
+        raise ValueError('Unknown op: {}'.format(op))
+
+    async def serve_connection(self, reader, writer) -> None:
+        """ One JSON request per line, one JSON response per line; requests of a connection may interleave sessions """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await self.handle(json.loads(line))
+                except (KeyError, ValueError, TypeError) as e:
+                    response = {'error': '{}: {}'.format(type(e).__name__, e)}
+                writer.write((json.dumps(response) + '\n').encode())
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+async def maintain(server: QuestionnaireServer, snapshot: str = None, interval_s: float = 60.) -> None:
+    """ Evicts the expired sessions, and snapshots the open ones, every `interval_s` """
+    while True:
+        await asyncio.sleep(interval_s)
+        server.store.evict_expired()
+        if snapshot:
+            server.store.snapshot(snapshot)
+
+
+async def serve(server: QuestionnaireServer, host: str, port: int, snapshot: str = None,
+                interval_s: float = 60.) -> None:
+    """Serves until cancelled
+    Args:
+        snapshot (str): .npz of the open sessions: restored at start, written every `interval_s` and at shutdown
+        interval_s (float): period of eviction and snapshots
+    """
+    if snapshot and os.path.exists(snapshot):
+        print('Restored {} sessions from {}'.format(server.store.restore(snapshot), snapshot))
+    tcp = await asyncio.start_server(server.serve_connection, host, port)
+    maintenance = asyncio.ensure_future(maintain(server, snapshot, interval_s))
+    print('Serving questionnaires on {}:{}'.format(host, port))
+    try:
+        async with tcp:
+            await tcp.serve_forever()
+    finally:
+        maintenance.cancel()
+        if snapshot:
+            server.store.snapshot(snapshot)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--model", type=str, default=DEFAULT_PATH, help="Model artifact (see model_artifact.py)")
+    parser.add_argument("--host", type=str, default='127.0.0.1', help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port")
+    parser.add_argument("--episode_length", type=int, default=5, help="Questions before a forced guess")
+    parser.add_argument("--max_batch", type=int, default=64, help="Largest micro-batch")
+    parser.add_argument("--max_wait_ms", type=float, default=2., help="Longest wait of a request for its micro-batch")
+    parser.add_argument("--threads", type=int, default=1, help="torch threads of the inference thread")
+    parser.add_argument("--ttl_s", type=float, default=1800., help="Idle time after which a session is evicted")
+    parser.add_argument("--snapshot", type=str, default=None, help="Sessions snapshot (.npz), restored at start")
+    parser.add_argument("--snapshot_interval_s", type=float, default=60., help="Period of eviction and snapshots")
+    flags = parser.parse_args(args)
+
+    torch.set_num_threads(flags.threads)
+    guesser, dqn, header = load_model_artifact(flags.model, device='cpu')
+    server = QuestionnaireServer(guesser, dqn, header['feature_names'][:guesser.features_size],
+                                 flags.episode_length, flags.max_batch, flags.max_wait_ms, flags.ttl_s)
+    asyncio.run(serve(server, flags.host, flags.port, flags.snapshot, flags.snapshot_interval_s))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import os
+import time
+import uuid
+import numpy as np
+
+
+class SessionStore(object):
+    def __init__(self, n_features: int, max_steps: int, model_version: str,
+                 capacity: int = 1024, ttl_s: float = 1800.) -> None:
+        """Questionnaire sessions as rows of preallocated arrays instead of one env object per user
+        A session is a row: observed values (float32), the acquisition bitmask (packed bits, the
+        guess action included), the order of the questions asked, the pending question, the step
+        count, the model version and the last access time. Rows of ended or expired sessions are
+        reused; the arrays double when every row is taken.
+        Args:
+            n_features (int): number of questions
+            max_steps (int): most questions a session can be asked (episode length)
+            model_version (str): version of the networks serving new sessions
+            capacity (int): initial number of rows
+            ttl_s (float): idle time after which `evict_expired` drops a session
+        """
+        self.n = n_features
+        self.max_steps = max_steps
+        self.ttl_s = ttl_s
+        self.versions = [model_version]
+        self.version = 0
+        self.slots = {}
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int) -> None:
+        def grow(name, shape, dtype, fill=0):
+            new = np.full((capacity,) + shape, fill, dtype=dtype)
+            old = getattr(self, name, None)
+            if old is not None:
+                new[:len(old)] = old
+            setattr(self, name, new)
+
+        first = len(getattr(self, 'steps', ()))
+        grow('values', (self.n,), np.float32)
+        grow('asked', ((self.n + 1 + 7) // 8,), np.uint8)
+        grow('order', (self.max_steps,), np.int32, -1)
+        grow('pending', (), np.int32, -1)
+        grow('steps', (), np.int16)
+        grow('model_version', (), np.int16)
+        grow('last_access', (), np.float64)
+        self.free = list(range(capacity - 1, first - 1, -1)) + getattr(self, 'free', [])
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self.slots
+
+    def create(self, session_id: str = None) -> str:
+        """ Opens a session (of the current model version) and returns its id """
+        if not self.free:
+            self.evict_expired()
+        if not self.free:
+            self._allocate(2 * len(self.steps))
+        slot = self.free.pop()
+        session_id = session_id or uuid.uuid4().hex
+        self.values[slot] = 0
+        self.asked[slot] = 0
+        self.order[slot] = -1
+        self.pending[slot] = -1
+        self.steps[slot] = 0
+        self.model_version[slot] = self.version
+        self.last_access[slot] = time.time()
+        self.slots[session_id] = slot
+        return session_id
+
+    def slot(self, session_id: str) -> int:
+        """Row of a session, refreshing its access time
+        Raises:
+            KeyError: unknown (ended or expired) session
+            ValueError: session started under another model version
+        """
+        slot = self.slots[session_id]
+        if self.model_version[slot] != self.version:
+            raise ValueError('session {} belongs to model version {}'.format(
+                session_id, self.versions[self.model_version[slot]]))
+        self.last_access[slot] = time.time()
+        return slot
+
+    def mask(self, slot: int) -> np.ndarray:
+        """ 1 for the actions still allowed (unasked questions and the guess), as env.reset_mask """
+        asked = np.unpackbits(self.asked[slot], count=self.n + 1)
+        return (1 - asked).astype(np.float32)
+
+    def state(self, slot: int) -> np.ndarray:
+        """ The env state: observed values, then 1 for every question answered """
+        asked = np.unpackbits(self.asked[slot], count=self.n)
+        return np.concatenate([self.values[slot], asked.astype(np.float32)])
+
+    def answer(self, slot: int, question: int, value: float, counted: bool = True) -> None:
+        """ Records an answer; `counted` answers (not the ones known upfront) take a step in the order """
+        self.values[slot, question] = value
+        self.asked[slot, question // 8] |= np.uint8(0x80 >> (question % 8))
+        if counted and self.steps[slot] <= self.max_steps:
+            self.order[slot, self.steps[slot] - 1] = question
+
+    def ask(self, slot: int, question: int) -> None:
+        """ Takes a step, asking `question` """
+        self.steps[slot] += 1
+        self.pending[slot] = question
+
+    def questions(self, slot: int) -> list:
+        return [int(q) for q in self.order[slot] if q >= 0]
+
+    def end(self, session_id: str) -> None:
+        self.free.append(self.slots.pop(session_id))
+
+    def evict_expired(self, now: float = None) -> int:
+        """ Ends the sessions idle for longer than ttl_s, returns how many """
+        now = time.time() if now is None else now
+        expired = [sid for sid, slot in self.slots.items() if now - self.last_access[slot] > self.ttl_s]
+        for session_id in expired:
+            self.end(session_id)
+        return len(expired)
+
+    def set_model_version(self, model_version: str) -> None:
+        """ New sessions are served by `model_version`; open sessions of other versions are refused by `slot` """
+        if model_version not in self.versions:
+            self.versions.append(model_version)
+        self.version = self.versions.index(model_version)
+
+    def snapshot(self, path: str) -> None:
+        """ Writes the open sessions to an .npz (through a temporary file, so a crash keeps the previous snapshot) """
+        ids = list(self.slots)
+        rows = np.array([self.slots[sid] for sid in ids], dtype=np.int64)
+        with open(path + '~', 'wb') as f:
+            np.savez(f, ids=np.array(ids), versions=np.array(self.versions),
+                     n=self.n, max_steps=self.max_steps,
+                     **{name: getattr(self, name)[rows] for name in self._COLUMNS})
+        os.replace(path + '~', path)
+
+    def restore(self, path: str) -> int:
+        """ Adds the sessions of a snapshot (keeping their model versions), returns how many """
+        with np.load(path) as stored:
+            if int(stored['n']) != self.n or int(stored['max_steps']) != self.max_steps:
+                raise ValueError('snapshot {} is of another questionnaire'.format(path))
+            versions = [str(v) for v in stored['versions']]
+            for version in versions:
+                if version not in self.versions:
+                    self.versions.append(version)
+            version_ids = np.array([self.versions.index(v) for v in versions], dtype=np.int16)
+            columns = {name: stored[name] for name in self._COLUMNS}
+            for k, session_id in enumerate(stored['ids']):
+                slot = self.slots[self.create(str(session_id))]
+                for name, column in columns.items():
+                    getattr(self, name)[slot] = column[k]
+                self.model_version[slot] = version_ids[columns['model_version'][k]]
+            return len(stored['ids'])
+
+    _COLUMNS = ('values', 'asked', 'order', 'pending', 'steps', 'model_version', 'last_access')
@@ -0,0 +1,22 @@
+from multiprocessing import shared_memory
+import numpy as np
+
+
+def share_array(a: np.ndarray):
+    """Copies `a` into a new shared memory block
+    Returns:
+        SharedMemory: the block (the caller closes and unlinks it)
+        tuple: (name, shape, dtype) to attach to it with `attach_array`
+    """
+    block = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+    np.ndarray(a.shape, dtype=a.dtype, buffer=block.buf)[...] = a
+    return block, (block.name, a.shape, a.dtype.str)
+
+
+def attach_array(spec):
+    """ Maps a block made by `share_array`, read-only. Returns the block (keep it alive) and the array """
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    a = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    a.flags.writeable = False
+    return block, a
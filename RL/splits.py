@@ -0,0 +1,87 @@
+import os
+import numpy as np
+from RL.feature_scores import dataset_hash
+
+SPLITS_DIR = 'data_splits'
+
+
+class SplitView(object):
+    """Rows of a dataset selected by an index array
+    Indexing goes through the index array to the full dataset, so no part of it is copied
+    until it is explicitly converted with `np.asarray`.
+    """
+
+    def __init__(self, data: np.ndarray, idx: np.ndarray) -> None:
+        self.data = data
+        self.idx = idx
+
+    @property
+    def shape(self):
+        return (len(self.idx),) + self.data.shape[1:]
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def __len__(self) -> int:
+        return len(self.idx)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self.data[(self.idx[key[0]],) + key[1:]]
+        return self.data[self.idx[key]]
+
+    def __array__(self, dtype=None, copy=None):
+        a = self.data[self.idx]
+        return a if dtype is None else a.astype(dtype)
+
+
+class Splits(object):
+    def __init__(self,
+                 X: np.ndarray,
+                 y: np.ndarray,
+                 test_size: float = 0.3,
+                 val_size: float = 0.05,
+                 random_state: int = 42,
+                 cache_dir: str = SPLITS_DIR) -> None:
+        """Stratified train / val / test split of a dataset, stored as index arrays
+        The indices are computed once per dataset and stored in `cache_dir`, keyed by
+        the dataset hash and the split parameters, so every run and every process
+        (RL training, guesser pretraining, evaluation) sees the same patients.
+        Args:
+            X (np.ndarray): 2-D array of shape (n, n_features)
+            y (np.ndarray): 1-D array of labels
+            test_size (float): fraction of the data in the test set
+            val_size (float): fraction of the remaining (non test) data in the validation set
+            random_state (int): seed of the split
+            cache_dir (str): directory of the stored indices
+        """
+        self.X = X
+        self.y = y
+        self.key = '{}_{}_{}_{}'.format(dataset_hash(X, y)[:16], test_size, val_size, random_state)
+        path = os.path.join(cache_dir, 'split_{}.npz'.format(self.key))
+
+        if os.path.exists(path):
+            stored = np.load(path)
+            self.indices = {part: stored[part] for part in ('train', 'val', 'test')}
+        else:
+            from sklearn.model_selection import train_test_split
+            idx = np.arange(len(y))
+            train_idx, test_idx = train_test_split(idx, test_size=test_size,
+                                                   stratify=y, random_state=random_state)
+            train_idx, val_idx = train_test_split(train_idx, test_size=val_size,
+                                                  stratify=y[train_idx], random_state=random_state)
+            self.indices = {'train': train_idx, 'val': val_idx, 'test': test_idx}
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            with open(path + '~', 'wb') as f:
+                np.savez(f, **self.indices)
+            os.replace(path + '~', path)
+
+    def view(self, part: str) -> SplitView:
+        """ Zero-copy view of the rows of X in `part` (train / val / test) """
+        return SplitView(self.X, self.indices[part])
+
+    def labels(self, part: str) -> np.ndarray:
+        """ Labels of the patients in `part` (train / val / test) """
+        return self.y[self.indices[part]]
@@ -0,0 +1,243 @@
+"""Parallel hyperparameter sweep of the main_al training loop
+
+Trials run in a process pool. The dataset is loaded once by the parent and put in shared
+memory, the workers map it read-only instead of each holding a copy, and the stratified split
+is computed once and read from its cache. Every trial gets its own config, a copy of the
+main_al defaults with the trial's values, and the results are collected into one CSV table:
+
+    python -m RL.sweep --spec sweep.json --dataset diabetes --n_workers 4 --n_episodes 3000
+
+The spec is a JSON file (or string) with a grid and / or a random search space, plus fixed values:
+
+    {"grid": {"lr": [1e-4, 1e-3], "hidden_dim": [64, 128]},
+     "random": {"gamma": {"uniform": [0.8, 0.99]}, "capacity": [5000, 10000]},
+     "n_random": 4,
+     "fixed": {"episode_length": 6}}
+
+A random entry is a list of choices or one of {"uniform": [a, b]}, {"loguniform": [a, b]},
+{"int": [a, b]} (b included). Grid and random trials are combined as a product.
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+
+import RL.benchmarks  # noqa: F401 (puts RL/ on sys.path for main_al's bare imports)
+import main_al
+import agent as agent_module
+from main_al import myEnv, Agent, get_env_dim
+from RL.splits import Splits
+from RL.shared_arrays import share_array, attach_array
+
+# dataset of a worker process, set by _init_worker: (X, y, question_names) and the mapped blocks
+_DATA = None
+_BLOCKS = []
+
+
+def make_config(overrides: dict = None) -> argparse.Namespace:
+    """Returns the main_al defaults (a fresh Namespace, as FLAGS) with `overrides` applied
+    Raises:
+        ValueError: if an override is not a main_al flag
+    """
+    config = main_al.parser.parse_args(args=[])
+    for k, v in (overrides or {}).items():
+        if not hasattr(config, k):
+            raise ValueError('Unknown flag in sweep spec: {}'.format(k))
+        setattr(config, k, v)
+    return config
+
+
+def apply_config(config: argparse.Namespace, save_dir: str) -> None:
+    """Makes `config` the FLAGS of main_al and agent in this (worker) process, with the outputs
+    in `save_dir` and no resume / profiling / metrics files
+    """
+    config.save_dir = save_dir
+    config.resume_path = os.path.join(save_dir, 'training_state.pth')
+    config.resume = 0
+    config.profile = 0
+    config.trace_episodes = ''
+    config.metrics_file = ''
+    config.eval_cache = ''
+    vars(main_al.FLAGS).update(vars(config))
+    for k in vars(agent_module.FLAGS):
+        if hasattr(config, k):
+            setattr(agent_module.FLAGS, k, getattr(config, k))
+
+
+def grid_trials(grid: dict) -> list:
+    """ Every combination of the values in `grid` ({flag: [values]}) """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[k] for k in names))]
+
+
+def _sample(rng: random.Random, dist):
+    if isinstance(dist, list):
+        return rng.choice(dist)
+    (kind, (low, high)), = dist.items()
+    if kind == 'uniform':
+        return rng.uniform(low, high)
+    if kind == 'loguniform':
+        return float(np.exp(rng.uniform(np.log(low), np.log(high))))
+    if kind == 'int':
+        return rng.randint(low, high)
+    raise ValueError('Unknown distribution: {}'.format(kind))
+
+
+def random_trials(space: dict, n: int, seed: int = 0) -> list:
+    """ `n` random draws of `space` ({flag: choices or {distribution: [low, high]}}) """
+    rng = random.Random(seed)
+    return [{k: _sample(rng, dist) for k, dist in space.items()} for _ in range(n)]
+
+
+def trials_from_spec(spec: dict, seed: int = 0) -> list:
+    """ Trial overrides of a sweep spec: grid x random draws, each with the fixed values """
+    grid = grid_trials(spec.get('grid', {}))
+    draws = random_trials(spec['random'], spec.get('n_random', 1), seed) if spec.get('random') else [{}]
+    fixed = spec.get('fixed', {})
+    return [{**fixed, **g, **r} for g, r in itertools.product(grid, draws)]
+
+
+def _init_worker(x_spec, y_spec, question_names, threads):
+    global _DATA, _BLOCKS
+    x_block, X = attach_array(x_spec)
+    y_block, y = attach_array(y_spec)
+    _BLOCKS = [x_block, y_block]
+    _DATA = (X, y, question_names)
+    torch.set_num_threads(threads)
+    # every trial tests its own networks once: cache entries would only pile up in the caller's directory
+    main_al.EVAL_CACHE.configure(None)
+
+
+def run_trial(trial: int, overrides: dict, n_episodes: int, out_dir: str, seed: int = 0,
+              load_pretrained_guesser: bool = True) -> dict:
+    """Trains and tests one configuration on the worker's shared dataset
+    main_al / agent read their module FLAGS, so the trial config is copied into them; a worker
+    runs one trial at a time. As in main_al.main, the dqn is trained against the pretrained
+    guesser (model_guesser/best_guesser.pth), which train() keeps fixed.
+    Returns:
+        dict: trial, the overrides, episodes, best_val_acc, test_acc (final networks), train_s
+    """
+    config = make_config(overrides)
+    apply_config(config, os.path.join(out_dir, 'trial_{}'.format(trial)))
+
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    env = myEnv(flags=main_al.FLAGS, device=torch.device('cpu'), load_pretrained_guesser=load_pretrained_guesser,
+                data=_DATA)
+    input_dim, output_dim = get_env_dim(env)
+    agent = Agent(input_dim, output_dim, config.hidden_dim, config.lr, config.weight_decay)
+
+    start = time.perf_counter()
+    stats = main_al.train(env, agent, checkpoints=None, n_episodes=n_episodes)
+    train_s = time.perf_counter() - start
+    test_acc = main_al.test(env, agent, input_dim, output_dim, load_best=False)
+    return dict(trial=trial, **overrides,
+                episodes=stats['episodes'],
+                best_val_acc=float(stats['best_val_acc']),
+                test_acc=float(test_acc),
+                train_s=train_s)
+
+
+def run_sweep(trials: list, data, n_workers: int = None, n_episodes: int = 0,
+              out_dir: str = 'sweep', seed: int = 0, threads_per_worker: int = 1,
+              load_pretrained_guesser: bool = True) -> list:
+    """Runs the trials in a process pool over one shared copy of the dataset
+    Args:
+        trials (list): overrides of each trial, e.g. from `trials_from_spec`
+        data (tuple): (X, y, question_names)
+        n_workers (int): number of processes, defaults to the cpu count
+        n_episodes (int): episodes per trial, 0 for the early stopping of main_al
+        out_dir (str): directory of the trial checkpoints and of sweep_results.csv
+        seed (int): seed of every trial
+        threads_per_worker (int): torch threads of each worker
+        load_pretrained_guesser (bool): whether trials load model_guesser/best_guesser.pth
+    Returns:
+        list: result rows, best validation accuracy first
+    """
+    X, y, question_names = data
+    # the split is computed (and cached) once here, the workers read it
+    Splits(X, y)
+    x_block, x_spec = share_array(np.ascontiguousarray(X))
+    y_block, y_spec = share_array(np.ascontiguousarray(y))
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(x_spec, y_spec, question_names, threads_per_worker)) as pool:
+            futures = [pool.submit(run_trial, k, overrides, n_episodes, out_dir, seed, load_pretrained_guesser)
+                       for k, overrides in enumerate(trials)]
+            results = [f.result() for f in futures]
+    finally:
+        for block in (x_block, y_block):
+            block.close()
+            block.unlink()
+
+    results.sort(key=lambda r: r['best_val_acc'], reverse=True)
+    write_table(results, os.path.join(out_dir, 'sweep_results.csv'))
+    return results
+
+
+def write_table(results: list, path: str) -> None:
+    fields = []
+    for r in results:
+        fields += [k for k in r if k not in fields]
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path + '~', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(results)
+    os.replace(path + '~', path)
+
+
+def load_dataset(name: str, n_samples: int = 5000):
+    """ 'diabetes' / 'covid' (the real tables) or 'synthetic:<size>' (see benchmarks.synthetic) """
+    if name.startswith('synthetic:'):
+        from RL.benchmarks.synthetic import DATASETS, make_dataset
+        return make_dataset(DATASETS[name.split(':', 1)[1]], n_samples=n_samples)
+    import RL.utils as utils
+    loaders = {'diabetes': utils.load_diabetes, 'covid': utils.load_covid}
+    X, y, question_names, _ = loaders[name]()
+    return X, y, question_names
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--spec", type=str, required=True, help="Sweep spec: JSON file or JSON string")
+    parser.add_argument("--dataset", type=str, default='diabetes', help="diabetes | covid | synthetic:<size>")
+    parser.add_argument("--n_samples", type=int, default=5000, help="Patients of a synthetic dataset")
+    parser.add_argument("--n_workers", type=int, default=None, help="Worker processes, defaults to the cpu count")
+    parser.add_argument("--threads_per_worker", type=int, default=1, help="torch threads of each worker")
+    parser.add_argument("--n_episodes", type=int, default=0, help="Episodes per trial, 0 to stop early")
+    parser.add_argument("--out_dir", type=str, default='sweep', help="Directory of the trials and of the table")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random draws and of the trials")
+    parser.add_argument("--pretrained_guesser", type=int, default=1, help="Whether to load model_guesser/best_guesser.pth")
+    flags = parser.parse_args(args)
+
+    if os.path.exists(flags.spec):
+        with open(flags.spec) as f:
+            spec = json.load(f)
+    else:
+        spec = json.loads(flags.spec)
+    trials = trials_from_spec(spec, flags.seed)
+    for overrides in trials:
+        make_config(overrides)  # fail on unknown flags before starting the pool
+    print('Running {} trials'.format(len(trials)))
+
+    results = run_sweep(trials, load_dataset(flags.dataset, flags.n_samples), flags.n_workers,
+                        flags.n_episodes, flags.out_dir, flags.seed, flags.threads_per_worker,
+                        bool(flags.pretrained_guesser))
+    for r in results:
+        print(', '.join('{}={}'.format(k, round(v, 4) if isinstance(v, float) else v) for k, v in r.items()))
+    print('Saved results to {}'.format(os.path.join(flags.out_dir, 'sweep_results.csv')))
+    return results
+
+
+if __name__ == '__main__':
+    main()
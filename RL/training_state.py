@@ -0,0 +1,58 @@
+import os
+import random
+import numpy as np
+import torch
+
+
+def save_training_state(path: str, env, agent, replay_memory, counters: dict) -> None:
+    """Saves everything needed to continue a training run exactly where it stopped
+    Args:
+        path (str): file of the training state
+        env (myEnv): environment, its guesser weights and optimizer are saved
+        agent (Agent): dqn, target dqn, optimizer and lr scheduler are saved
+        replay_memory (ReplayMemory): replay contents
+        counters (dict): loop counters, e.g. episode, best_val_acc, val_trials_without_improvement, val_list
+    """
+    state = {
+        'dqn': agent.dqn.state_dict(),
+        'target_dqn': agent.target_dqn.state_dict(),
+        'optim': agent.optim.state_dict(),
+        'scheduler': agent.scheduler.state_dict(),
+        'guesser': env.guesser.state_dict(),
+        'guesser_optim': env.guesser.optimizer.state_dict(),
+        'replay': replay_memory.state_dict(),
+        'counters': counters,
+        'rng': {
+            'python': random.getstate(),
+            'numpy': np.random.get_state(),
+            'torch': torch.get_rng_state(),
+            'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+        },
+    }
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    torch.save(state, path + '~')
+    os.replace(path + '~', path)
+
+
+def load_training_state(path: str, env, agent, replay_memory) -> dict:
+    """Restores a state saved by `save_training_state` into existing objects
+    Returns:
+        dict: the saved loop counters
+    """
+    state = torch.load(path, map_location='cpu', weights_only=False)
+    agent.dqn.load_state_dict(state['dqn'])
+    agent.target_dqn.load_state_dict(state['target_dqn'])
+    agent.optim.load_state_dict(state['optim'])
+    agent.scheduler.load_state_dict(state['scheduler'])
+    env.guesser.load_state_dict(state['guesser'])
+    env.guesser.optimizer.load_state_dict(state['guesser_optim'])
+    replay_memory.load_state_dict(state['replay'])
+
+    random.setstate(state['rng']['python'])
+    np.random.set_state(state['rng']['numpy'])
+    torch.set_rng_state(state['rng']['torch'])
+    if state['rng']['cuda'] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['rng']['cuda'])
+    return state['counters']
@@ -9,16 +9,15 @@ import numpy as np
 import gzip
 import struct
 import os
-from sklearn.preprocessing import StandardScaler, MinMaxScaler
-from sklearn.model_selection import train_test_split
-from sklearn.tree import DecisionTreeClassifier
 import csv
-import pandas as pd
 import torch
-from sklearn.utils import resample
+import RL.feature_scores as feature_scores
+from RL.report import REPORT
 
 
 def load_data_labels():
+    import pandas as pd
+    from sklearn.preprocessing import StandardScaler
     # filter_preprocess_X()
     outcomes = pd.read_pickle(r'C:\Users\kashann\PycharmProjects\choiceMira\codeChoice\data_rl\outcomes.pkl')
     n_outcomes = outcomes.shape[1]
@@ -42,6 +41,8 @@ def load_data_labels():
     return X, Y, X_pd.columns.tolist(), len(X_pd.columns)
 
 def load_data_labels_cut():
+    import pandas as pd
+    from sklearn.preprocessing import StandardScaler
     # filter_preprocess_X()
     outcomes = pd.read_pickle(r'C:\Users\kashann\PycharmProjects\choiceMira\codeChoice\data_rl\outcomes.pkl')
     n_outcomes = outcomes.shape[1]
@@ -89,6 +90,7 @@ def load_data_labels_cut():
     balanced_labels = Y[balanced_indices]
     return balanced_data, balanced_labels, X_pd.columns.tolist(), len(X_pd.columns)
 def filter_preprocess_X():
+    import pandas as pd
     df = pd.read_pickle(r'C:\Users\kashann\PycharmProjects\choiceMira\codeChoice\data_rl\preprocessed_X.pkl')
     # i want to group 3 clumns together by or sign
     df['aspirin'] = df['Medications anticoagulants: ASPIRIN'] | df['Medications anticoagulants: CARTIA'] | df[
@@ -111,6 +113,7 @@ def filter_preprocess_X():
 
 
 def load_data(case):
+    from sklearn.preprocessing import MinMaxScaler
     if case == 122:  # 50 questions
         data_file = "./Data/small_data50.npy"
         X = np.load(data_file)
@@ -118,7 +121,7 @@ def load_data(case):
         y = np.load('./Data/labels.npy')
         # standardize features
         scaler = MinMaxScaler()
-        X = scaler.fit_transform(X) * 2 - 1
+        X = (scaler.fit_transform(X) * 2 - 1).astype(np.float32)
         question_names = np.load('./Data/names_small50.npy')
         class_names = ['no', 'yes']
         print('loaded data,  {} rows, {} columns'.format(n, d))
@@ -130,7 +133,7 @@ def load_data(case):
         y = np.load('./Data/labels.npy')
         # standardize features
         scaler = MinMaxScaler()
-        X = scaler.fit_transform(X) * 2 - 1
+        X = (scaler.fit_transform(X) * 2 - 1).astype(np.float32)
         question_names = np.load('./Data/names_small100.npy')
         class_names = ['no', 'yes']
         print('loaded data,  {} rows, {} columns'.format(n, d))
@@ -138,7 +141,7 @@ def load_data(case):
     return X, y, question_names, class_names, scaler
 
 
-def load_heart():
+def load_heart(dtype=np.float32):
     data = []
     labels = []
     file_path = './heart.csv'
@@ -164,7 +167,7 @@ def load_heart():
     # convet to float each element
 
     # Convert zero_list to a NumPy array
-    X = np.array(data)
+    X = np.array(data, dtype=dtype)
     y = np.array(labels)
 
     n, d = X.shape
@@ -173,7 +176,7 @@ def load_heart():
     return X, y, question_names, len(columns_without_label)
 
 
-def load_chron():
+def load_chron(dtype=np.float32):
     data = []
     labels = []
     file_path = '/chron/chron.csv'
@@ -199,111 +202,99 @@ def load_chron():
     # convet to float each element
 
     # Convert zero_list to a NumPy array
-    X = np.array(data)
+    X = np.array(data, dtype=dtype)
     y = np.array(labels)
     n, d = X.shape
     print('loaded data,  {} rows, {} columns'.format(n, d))
     return X, y, question_names, len(columns_without_label)
 
 
-def load_covid():
-    data = []
-    labels = []
+def _subsample_rows(values: np.ndarray, value, frac, random_state=0) -> np.ndarray:
+    """Row indices that keep every row, except a random `frac` of the rows where `values == value`
+    (frac=None keeps all rows). Rows are selected by index, no subsampled copy is written to disk.
+    """
+    rows = np.arange(len(values))
+    if frac is None:
+        return rows
+    rng = np.random.RandomState(random_state)
+    majority = rows[values == value]
+    keep = rng.choice(majority, int(round(frac * len(majority))), replace=False)
+    return np.sort(np.concatenate([rows[values != value], keep]))
+
+
+def load_covid(majority_frac=0.079, dtype=np.float32):
+    """Loads the covid table
+    Args:
+        majority_frac (float): fraction of the surviving patients to keep, None keeps the full
+            table (balance training with `ClassWeightedSampler` instead)
+        dtype: feature dtype, float32 (the dtype of the states and networks) or float16 for storage
+    """
+    import pandas as pd
     file_path = './/extra//covid//covid.csv'
     df = pd.read_csv(file_path)
     df_clean = df.drop(columns=df.columns[(df == 97).any() | (df == 99).any()])
-    df_clean['DATE_DIED'] = df_clean['DATE_DIED'].apply(lambda x: 1 if x == '9999-99-99' else 0)
-    df_clean_1 = df_clean[df_clean['DATE_DIED'] == 1].sample(frac=0.079)
-    df_clean_0 = df_clean[df_clean['DATE_DIED'] == 0]
-    df_clean_all = pd.concat([df_clean_0, df_clean_1])
-    # change the DATE_DIED column to be the last column in the dataframe
-    # save df clean to csv
-    file_path_clean = './/extra//covid//covid_clean.csv'
-    df_clean_all.to_csv(file_path_clean, index=False)
-
-    # Open the CSV file
-    with open(file_path_clean, newline='') as csvfile:
-        # Create a CSV reader
-        csv_reader = csv.reader(csvfile)
-        for line in csv_reader:
-            # if it the first line (header) skip it
-            if line[0] == 'USMER':
-                # save the header in npy array for later use
-                question_names = np.array(line)
-                continue
-            # columns = [column.split(',') for column in line]
-            columns = line
-            columns_without_label = columns[0:-1]
-            for i in range(len(columns_without_label)):
-                columns_without_label[i] = float(columns_without_label[i])
-            data.append(columns_without_label)
-            labels.append(int(columns[-1]))
+    df_clean['DATE_DIED'] = (df_clean['DATE_DIED'] == '9999-99-99').astype(int)
+    rows = _subsample_rows(df_clean['DATE_DIED'].to_numpy(), 1, majority_frac)
+    df_clean = df_clean.iloc[rows]
 
-    X = np.array(data)
-    y = np.array(labels)
+    question_names = np.array(df_clean.columns)
+    X = df_clean.iloc[:, :-1].to_numpy(dtype=dtype)
+    y = df_clean.iloc[:, -1].to_numpy().astype(int)
     n, d = X.shape
     print('loaded data,  {} rows, {} columns'.format(n, d))
-    return X, y, question_names, len(columns_without_label)
-
-
-def load_diabetes():
-    data = []
-    labels = []
+    return X, y, question_names, d
+
+
+SMOKING_HISTORY = {"never": 0, "former": 1, "current": 2, "No Info": 3, "not current": 4, "ever": 5}
+
+
+def encode_categoricals(features):
+    """Numeric codes of the categorical diabetes columns (gender, smoking_history), as the networks
+    are trained on them; used by load_diabetes and by the scorers of raw patient files
+    Args:
+        features (pd.DataFrame): feature columns, encoded in place when still strings
+    Returns:
+        pd.DataFrame: the same frame
+    """
+    if 'gender' in features and features['gender'].dtype == object:
+        features['gender'] = (features['gender'] != 'Female').astype(int)
+    if 'smoking_history' in features and features['smoking_history'].dtype == object:
+        features['smoking_history'] = features['smoking_history'].map(SMOKING_HISTORY)
+    return features
+
+
+def encode_answer(name: str, value) -> float:
+    """ One answer as the networks see it: `encode_categoricals` for a single value """
+    if name == 'gender' and isinstance(value, str):
+        return float(value != 'Female')
+    if name == 'smoking_history' and isinstance(value, str):
+        return float(SMOKING_HISTORY[value])
+    return float(value)
+
+
+def load_diabetes(majority_frac=0.092, dtype=np.float32):
+    """Loads the diabetes table
+    Args:
+        majority_frac (float): fraction of the non-diabetic patients to keep, None keeps the full
+            table (balance training with `ClassWeightedSampler` instead)
+        dtype: feature dtype, float32 (the dtype of the states and networks) or float16 for storage
+    """
+    import pandas as pd
     file_path = './/extra//diabetes//diabetes_prediction_dataset.csv'
     df = pd.read_csv(file_path)
-    df_1 = df[df['diabetes'] == 1]
-    df_0 = df[df['diabetes'] == 0].sample(frac=0.092)
-    df_all = pd.concat([df_0, df_1])
+    rows = _subsample_rows(df['diabetes'].to_numpy(), 0, majority_frac)
+    df = df.iloc[rows]
 
-    # save df clean to csv
-    file_path_clean = './/extra//diabetes//diabetes_clean.csv'
-    df_all.to_csv(file_path_clean, index=False)
-    # Open the CSV file
-    with open(file_path_clean, newline='') as csvfile:
-        # Create a CSV reader
-        csv_reader = csv.reader(csvfile)
-        for line in csv_reader:
-            # if it the first line (header) skip it
-            if line[0] == 'gender':
-                # save the header in npy array for later use
-                question_names = np.array(line)
-                continue
-            # columns = [column.split(',') for column in line]
-            columns = line
-            columns_without_label = columns[0:-1]
-            if columns_without_label[0] == "Female":
-                columns_without_label[0] = 0
-            else:
-                columns_without_label[0] = 1
-            if columns_without_label[4] == "never":
-                columns_without_label[4] = 0
-            if columns_without_label[4] == "former":
-                columns_without_label[4] = 1
-            if columns_without_label[4] == "current":
-                columns_without_label[4] = 2
-            if columns_without_label[4] == "No Info":
-                columns_without_label[4] = 3
-            if columns_without_label[4] == "not current":
-                columns_without_label[4] = 4
-            if columns_without_label[4] == "ever":
-                columns_without_label[4] = 5
-            for i in range(len(columns_without_label)):
-                columns_without_label[i] = float(columns_without_label[i])
-
-            data.append(columns_without_label)
-
-            labels.append(int(columns[-1]))
-
-    # Convert zero_list to a NumPy array
-    X = np.array(data)
-    y = np.array(labels)
+    question_names = np.array(df.columns)
+    features = encode_categoricals(df.iloc[:, :-1].copy())
+    X = features.to_numpy(dtype=dtype)
+    y = df.iloc[:, -1].to_numpy().astype(int)
     n, d = X.shape
     # standardize features
     # scaler = MinMaxScaler()
     # X = scaler.fit_transform(X) * 2 - 1
-    class_names = [0, 1]
     print('loaded data,  {} rows, {} columns'.format(n, d))
-    return X, y, question_names, len(columns_without_label)
+    return X, y, question_names, d
 
 
 def diabetes_prob_actions():
@@ -353,103 +344,133 @@ def load_mnist(case=1):
         y_train = y_train[train_inds]
         y_test = y_test[test_inds]
 
-    return X_train / 127.5 - 1., X_test / 127.5 - 1, y_train, y_test
-
-
-def process_images_to_npy():
-    if os.path.isfile('./processed_data.npy'):
-        # load data from file
-        data = np.load('./processed_data.npy')
-        if os.path.isfile('processed_labels.npy'):
-            # load labels from file
-            labels = np.load('processed_labels.npy')
-            for i in range(len(labels)):
-                if labels[i] == "AbdomenCT":
-                    labels[i] = 0
-                elif labels[i] == "Hand":
-                    labels[i] = 1
-                else:
-                    labels[i] = 2
-    else:
-
-        files_path = []
-        files_labels = []
-        PATH = 'input/medical-mnist'
-
-        for root, dirs, files in os.walk(PATH):
-            p = pathlib.Path(root)
-            for file in files:
-                files_path.append(root + '/' + file)
-                files_labels.append(p.parts[-1])
-
-        data = []
-
-        for path in files_path:
-            img = Image.open(path)
-            img.load()
-            img_X = np.asarray(img, dtype=np.int16)
-            data.append(img_X)
-
-        data = np.array(data)
-        labels = np.array(files_labels)
-        for i in range(len(labels)):
-            if labels[i] == "AbdomenCT":
-                labels[i] = 0
-            elif labels[i] == "Hand":
-                labels[i] = 1
-            else:
-                labels[i] = 2
-
-        # Save data and labels to .npy files
-        np.save('processed_data.npy', data)
-        np.save('processed_labels.npy', labels)
-
-    return data, labels
+    return X_train.astype(np.float32) / 127.5 - 1., X_test.astype(np.float32) / 127.5 - 1, y_train, y_test
+
+
+MEDICAL_LABELS = {"AbdomenCT": 0, "Hand": 1}  # every other folder is class 2
+
+
+def _medical_labels(names) -> np.ndarray:
+    """ Maps medical-mnist folder names to int8 class labels """
+    names = np.asarray(names)
+    labels = np.full(len(names), 2, dtype=np.int8)
+    for name, label in MEDICAL_LABELS.items():
+        labels[names == name] = label
+    return labels
+
+
+def _decode_images(paths) -> np.ndarray:
+    """ Decodes a chunk of image files into a uint8 array (runs in a worker process) """
+    from PIL import Image
+    return np.stack([np.asarray(Image.open(path), dtype=np.uint8) for path in paths])
+
+
+def _save_progress(progress_file, done):
+    with open(progress_file + '~', 'wb') as f:
+        np.save(f, done)
+    os.replace(progress_file + '~', progress_file)
+
+
+def process_images_to_npy(path='input/medical-mnist',
+                          data_file='processed_data.npy',
+                          labels_file='processed_labels.npy',
+                          n_workers=None,
+                          chunk_size=512):
+    """Decodes the medical-mnist images into a uint8 .npy file and int8 labels
+    Images are decoded by a process pool straight into a preallocated memmap
+    (`data_file` + '~'). Finished chunks are recorded in a progress file, so an
+    interrupted run continues where it stopped. The memmap is renamed to
+    `data_file` once every chunk is written.
+    Args:
+        path (str): root of the medical-mnist folders (one folder per class)
+        data_file (str): output file of the images, shape (n, 64, 64)
+        labels_file (str): output file of the labels
+        n_workers (int): number of decoding processes, defaults to the cpu count
+        chunk_size (int): number of images decoded per task
+    Returns:
+        np.ndarray: read-only memmap of the images
+        np.ndarray: int8 labels
+    """
+    if os.path.isfile(data_file) and os.path.isfile(labels_file):
+        data = np.load(data_file, mmap_mode='r')
+        labels = np.load(labels_file)
+        if labels.dtype.kind in 'US':  # labels stored as folder names by older versions
+            labels = _medical_labels(labels)
+        return data, labels
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    files_path = []
+    files_labels = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()  # fixed order, so a resumed run sees the same file list
+        for file in sorted(files):
+            files_path.append(os.path.join(root, file))
+            files_labels.append(os.path.basename(root))
+    labels = _medical_labels(files_labels)
+
+    n = len(files_path)
+    if n == 0:
+        raise FileNotFoundError('No images found under {}'.format(path))
+    shape = (n,) + _decode_images(files_path[:1]).shape[1:]
+    chunks = [(start, min(start + chunk_size, n)) for start in range(0, n, chunk_size)]
+
+    partial_file = data_file + '~'
+    progress_file = data_file + '.progress.npy'
+    data, done = None, None
+    if os.path.isfile(partial_file) and os.path.isfile(progress_file):
+        data = np.load(partial_file, mmap_mode='r+')
+        done = np.load(progress_file)
+        if data.shape != shape or len(done) != len(chunks):
+            data, done = None, None
+        else:
+            print('Resuming image decoding, {}/{} chunks done'.format(done.sum(), len(chunks)))
+    if data is None:
+        data = np.lib.format.open_memmap(partial_file, mode='w+', dtype=np.uint8, shape=shape)
+        done = np.zeros(len(chunks), dtype=bool)
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = {pool.submit(_decode_images, files_path[start:end]): i
+                   for i, (start, end) in enumerate(chunks) if not done[i]}
+        for k, future in enumerate(as_completed(futures)):
+            i = futures[future]
+            start, end = chunks[i]
+            data[start:end] = future.result()
+            done[i] = True
+            if k % 16 == 15:
+                data.flush()
+                _save_progress(progress_file, done)
+
+    data.flush()
+    del data
+    os.replace(partial_file, data_file)
+    np.save(labels_file, labels)
+    if os.path.isfile(progress_file):
+        os.remove(progress_file)
+    print('processed {} images of shape {}'.format(n, shape[1:]))
+
+    return np.load(data_file, mmap_mode='r'), labels
 
 
 def load_medical_scores():
-    '''
-    if os.path.exists('./mnist/mi.npy'):
-        print('Loading stored mutual information scores')
-        return np.load('./mnist/mi.npy')
-    else:
-        return None
-    '''
+    """ Decision tree importance of each medical-mnist pixel, cached by dataset hash """
+    from sklearn.model_selection import train_test_split
     data, labels = process_images_to_npy()
     data = data.reshape(-1, 64 * 64)
 
-    X_train, X_test, y_train, y_test = train_test_split(data, labels, test_size=0.2)
+    X_train, X_test, y_train, y_test = train_test_split(data, labels, test_size=0.2, random_state=42)
 
     X_train, X_val, y_train, y_val = train_test_split(X_train,
                                                       y_train,
-                                                      test_size=0.33)
-    max_depth = 5
-
-    # define a decision tree classifier
-    clf = DecisionTreeClassifier(max_depth=max_depth)
-
-    # fit model
-    clf = clf.fit(X_train, y_train)
-    return clf.feature_importances_
+                                                      test_size=0.33,
+                                                      random_state=24)
+    return feature_scores.feature_scores(X_train, y_train, method='importance')
 
 
-def load_mi_scores():
-    '''
-    if os.path.exists('./mnist/mi.npy'):
-        print('Loading stored mutual information scores')
-        return np.load('./mnist/mi.npy')
-    else:
-        return None
-    '''
+def load_mi_scores(method='importance'):
+    """ Importance ('importance') or mutual information ('mi') of each mnist pixel, cached by dataset hash """
     X_train, X_test, y_train, y_test = load_mnist(case=2)
-    max_depth = 5
-
-    # define a decision tree classifier
-    clf = DecisionTreeClassifier(max_depth=max_depth)
-
-    # fit model
-    clf = clf.fit(X_train, y_train)
-    return clf.feature_importances_
+    return feature_scores.feature_scores(X_train, y_train, method=method)
 
 
 def read_idx(filename):
@@ -459,6 +480,20 @@ def read_idx(filename):
         return np.fromstring(f.read(), dtype=np.uint8).reshape(shape)
 
 
+def _queue_digit(digit, side, guess, true_label, num_steps, save, fig_num, save_dir, actions):
+    """ Queues the image with the order of the asked pixels on the report writer (rendered off-thread) """
+    labels = []
+    if actions is not None:
+        for i, a in enumerate(actions):
+            if a != side * side:
+                labels.append((a % side, int(a / side) - 2, str(i + 1)))
+    filename = 'im_' + str(fig_num) + '.png'
+    REPORT.image(save_dir + '/' + filename if save else filename,
+                 digit.reshape(side, side),
+                 title='true label: {}, guess: {}, num steps: {}'.format(true_label, guess, num_steps),
+                 labels=labels)
+
+
 def plot_mnist_digit(digit,
                      guess,
                      true_label,
@@ -467,22 +502,7 @@ def plot_mnist_digit(digit,
                      fig_num=0,
                      save_dir='.',
                      actions=None):
-    import matplotlib.pyplot as plt
-    digit = digit.reshape(28, 28)
-    fig, ax = plt.subplots()
-    ax.set_title('true label: {}, guess: {}, num steps: {}'.format(true_label, guess, num_steps), fontsize=18)
-    ax.get_yaxis().set_visible(False)
-    ax.get_xaxis().set_visible(False)
-    im = ax.imshow(digit, cmap='gray')
-    if actions is not None:
-        for i, a in enumerate(actions):
-            if a != 784:
-                row = a % 28
-                col = int(a / 28)
-                text = ax.text(row, col - 2, i + 1, ha="center", va="center", color="b", size=15)
-    plt.show()
-    if save:
-        fig.savefig(save_dir + '/im_' + str(fig_num) + '.png')
+    _queue_digit(digit, 28, guess, true_label, num_steps, save, fig_num, save_dir, actions)
 
 
 def plot_medical(digit,
@@ -493,22 +513,7 @@ def plot_medical(digit,
                  fig_num=0,
                  save_dir='.',
                  actions=None):
-    import matplotlib.pyplot as plt
-    digit = digit.reshape(64, 64)
-    fig, ax = plt.subplots()
-    ax.set_title('true label: {}, guess: {}, num steps: {}'.format(true_label, guess, num_steps), fontsize=18)
-    ax.get_yaxis().set_visible(False)
-    ax.get_xaxis().set_visible(False)
-    im = ax.imshow(digit, cmap='gray')
-    if actions is not None:
-        for i, a in enumerate(actions):
-            if a != 64 * 64:
-                row = a % 64
-                col = int(a / 64)
-                text = ax.text(row, col - 2, i + 1, ha="center", va="center", color="b", size=15)
-    plt.show()
-    if save:
-        fig.savefig(save_dir + '/im_' + str(fig_num) + '.png')
+    _queue_digit(digit, 64, guess, true_label, num_steps, save, fig_num, save_dir, actions)
 
 
 def scale_individual_value(val, ind, scaler):
@@ -11,17 +11,11 @@ and then a meta model on the outputs of the previous two
 
 import argparse
 import numpy as np
-from sklearn.metrics import roc_auc_score
-import shap
-import pandas as pd
-from sklearn.preprocessing import StandardScaler
 from datetime import date
 import os
 import shutil
 from itertools import count
-import nltk
 import pickle
-import matplotlib.pyplot as plt
 
 import torch
 import torch.nn as nn
@@ -122,13 +116,18 @@ device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
 N_TRIALS = 5
 
-if os.path.exists(FLAGS.save_dir_shap):
-    shutil.rmtree(FLAGS.save_dir_shap)
-os.makedirs(FLAGS.save_dir_shap)
+def reset_output_dirs():
+    """ Recreates empty output directories (called by main(), not at import) """
+
+    if os.path.exists(FLAGS.save_dir_shap):
+        shutil.rmtree(FLAGS.save_dir_shap)
+    os.makedirs(FLAGS.save_dir_shap)
+
+    if os.path.exists(FLAGS.save_dir_models):
+        shutil.rmtree(FLAGS.save_dir_models)
+    os.makedirs(FLAGS.save_dir_models)
+
 
-if os.path.exists(FLAGS.save_dir_models):
-    shutil.rmtree(FLAGS.save_dir_models)
-os.makedirs(FLAGS.save_dir_models)
 
 
 ''' ------- Helper functions for text ------- ''' 
@@ -179,6 +178,7 @@ def create_text_objects(tokenized_corpus):
 def tokenize_sentence(sentence):
     """ Removes punctuation and splits to words """
     
+    import nltk
     if type(sentence) == str:
         words = nltk.wordpunct_tokenize(sentence)
         sentence_tokens = [word for word in words if word.isalnum()]
@@ -230,107 +230,120 @@ def pad_corpus(idxs_corpus, seq_length=FLAGS.seq_length):
 
 ''' ------- Load data -------'''
 
-outcomes = pd.read_pickle(r'C:\Users\kashann\PycharmProjects\choiceMira\codeChoice\data_rl\outcomes.pkl')
-n_outcomes = outcomes.shape[1]
-outcome_names = outcomes.columns
-Y = outcomes.to_numpy()
-if FLAGS.outcomes == 'dtd':
-    dtd_indices = [0]#[i for i, name in enumerate(outcome_names) if 'dtd' in name]
-    Y = Y[:, dtd_indices]
-    n_outcomes = len(dtd_indices)
-    outcome_names = outcome_names[dtd_indices]
-elif FLAGS.outcomes == 'readmission':
-    readmission_indices = [4]#[i for i, name in enumerate(outcome_names) if 'readmission' in name]
-    Y = Y[:, readmission_indices]
-    n_outcomes = len(readmission_indices)
-    outcome_names = outcome_names[readmission_indices]
-elif FLAGS.outcomes == 'both':
-    n_outcomes = 2
-    outcome_names = outcome_names[[0, 4]]
-    Y = Y[:, [0, 4]]
-elif FLAGS.outcomes == 'all':
-    pass
-else:
-    print ('FLAGS.outcomes not recognized')
-X_pd = pd.read_pickle(r'C:\Users\kashann\PycharmProjects\choiceMira\codeChoice\data_rl\preprocessed_X.pkl')
-X = X_pd.to_numpy()
-scaler = StandardScaler()
-#X = scaler.fit_transform(X) #Do not scale if using shap
-Data = pd.read_csv(r'C:\Users\kashann\PycharmProjects\choiceMira\codeChoice\data_rl\new_data_apr22.csv')
-admission_date = pd.to_datetime(Data['Reference Event-Visit Start Date']) 
-
-X = X.astype('float32')
-Y = Y.astype('int')
-
-Text = pd.read_pickle(r'C:\Users\kashann\PycharmProjects\choiceMira\codeChoice\data_rl\text.pkl')['Free-text-all-exam-res']#['ct_general']
-tokenized_corpus = tokenize_corpus(Text)
-
-if FLAGS.load_pretrained_embeddings:
-    word2idx, idx2word, vocab, embedding_weights = load_text_objects()
-else:
-    word2idx, idx2word, vocab = create_text_objects(tokenized_corpus)
-    
-vocab_size = len(vocab)    
-
-# Converting corpus to indices
-idxs_corpus = [get_sentence_idxs(tokenized_sentence) for tokenized_sentence in tokenized_corpus]
-
-# Arrange idxs_corpus in a multihot way
-multihot_corpus = np.zeros([len(idxs_corpus), vocab_size]).astype('float32')
-for i in range(len(idxs_corpus)):
-    for j in range(len(idxs_corpus[i])):
-       multihot_corpus[i, idxs_corpus[i][j]] += 1. 
-   
-''' ------- Divide data to train and test ------- '''    
-n = len(X)
-perm = np.random.permutation(n)
-test_inds = perm[-int(n * .2):]
-val_inds = perm[-int(n * .325) : -int(n * .2)]
-train_inds = perm[: -int(n * .325)]
-n_train = len(train_inds)
-n_val = len(val_inds)
-n_test = len(test_inds)
-
-X_train = X[train_inds]
-T_train = multihot_corpus[train_inds]
-Y_train = Y[train_inds]
-X_val   = X[val_inds]
-T_val   = multihot_corpus[val_inds]
-Y_val   = Y[val_inds]
-X_test  = X[test_inds]
-T_test  = multihot_corpus[test_inds]
-Y_test  = Y[test_inds]       
-       
+def load_data():
+    """ Loads outcomes, features and text, splits them and builds the loaders (sets the module globals) """
+    global outcomes, n_outcomes, outcome_names, Y, dtd_indices, readmission_indices, X_pd, X
+    global Text, tokenized_corpus, word2idx, idx2word, vocab, embedding_weights, vocab_size, idxs_corpus
+    global multihot_corpus, test_inds, val_inds, train_inds, n_train, n_val, n_test, X_train
+    global T_train, Y_train, X_val, T_val, Y_val, X_test, T_test, Y_test, x_train_data, t_train_data
+    global x_val_data, t_val_data, x_test_data, t_test_data, x_train_loader, t_train_loader, x_val_loader
+    global t_val_loader, x_test_loader, t_test_loader, class_weights
+    import pandas as pd
+    from sklearn.preprocessing import StandardScaler
+
+    outcomes = pd.read_pickle(r'C:\Users\kashann\PycharmProjects\choiceMira\codeChoice\data_rl\outcomes.pkl')
+    n_outcomes = outcomes.shape[1]
+    outcome_names = outcomes.columns
+    Y = outcomes.to_numpy()
+    if FLAGS.outcomes == 'dtd':
+        dtd_indices = [0]#[i for i, name in enumerate(outcome_names) if 'dtd' in name]
+        Y = Y[:, dtd_indices]
+        n_outcomes = len(dtd_indices)
+        outcome_names = outcome_names[dtd_indices]
+    elif FLAGS.outcomes == 'readmission':
+        readmission_indices = [4]#[i for i, name in enumerate(outcome_names) if 'readmission' in name]
+        Y = Y[:, readmission_indices]
+        n_outcomes = len(readmission_indices)
+        outcome_names = outcome_names[readmission_indices]
+    elif FLAGS.outcomes == 'both':
+        n_outcomes = 2
+        outcome_names = outcome_names[[0, 4]]
+        Y = Y[:, [0, 4]]
+    elif FLAGS.outcomes == 'all':
+        pass
+    else:
+        print ('FLAGS.outcomes not recognized')
+    X_pd = pd.read_pickle(r'C:\Users\kashann\PycharmProjects\choiceMira\codeChoice\data_rl\preprocessed_X.pkl')
+    X = X_pd.to_numpy()
+    scaler = StandardScaler()
+    #X = scaler.fit_transform(X) #Do not scale if using shap
+    Data = pd.read_csv(r'C:\Users\kashann\PycharmProjects\choiceMira\codeChoice\data_rl\new_data_apr22.csv')
+    admission_date = pd.to_datetime(Data['Reference Event-Visit Start Date']) 
+
+    X = X.astype('float32')
+    Y = Y.astype('int')
+
+    Text = pd.read_pickle(r'C:\Users\kashann\PycharmProjects\choiceMira\codeChoice\data_rl\text.pkl')['Free-text-all-exam-res']#['ct_general']
+    tokenized_corpus = tokenize_corpus(Text)
+
+    if FLAGS.load_pretrained_embeddings:
+        word2idx, idx2word, vocab, embedding_weights = load_text_objects()
+    else:
+        word2idx, idx2word, vocab = create_text_objects(tokenized_corpus)
+
+    vocab_size = len(vocab)    
+
+    # Converting corpus to indices
+    idxs_corpus = [get_sentence_idxs(tokenized_sentence) for tokenized_sentence in tokenized_corpus]
+
+    # Arrange idxs_corpus in a multihot way
+    multihot_corpus = np.zeros([len(idxs_corpus), vocab_size]).astype('float32')
+    for i in range(len(idxs_corpus)):
+        for j in range(len(idxs_corpus[i])):
+           multihot_corpus[i, idxs_corpus[i][j]] += 1. 
+
+    # ------- Divide data to train and test -------
+    n = len(X)
+    perm = np.random.permutation(n)
+    test_inds = perm[-int(n * .2):]
+    val_inds = perm[-int(n * .325) : -int(n * .2)]
+    train_inds = perm[: -int(n * .325)]
+    n_train = len(train_inds)
+    n_val = len(val_inds)
+    n_test = len(test_inds)
+
+    X_train = X[train_inds]
+    T_train = multihot_corpus[train_inds]
+    Y_train = Y[train_inds]
+    X_val   = X[val_inds]
+    T_val   = multihot_corpus[val_inds]
+    Y_val   = Y[val_inds]
+    X_test  = X[test_inds]
+    T_test  = multihot_corpus[test_inds]
+    Y_test  = Y[test_inds]       
+
+
+    x_train_data = TensorDataset(torch.from_numpy(X_train), torch.from_numpy(Y_train))       
+    t_train_data = TensorDataset(torch.from_numpy(T_train), torch.from_numpy(Y_train))
+    x_val_data = TensorDataset(torch.from_numpy(X_val), torch.from_numpy(Y_val))
+    t_val_data = TensorDataset(torch.from_numpy(T_val), torch.from_numpy(Y_val))
+    x_test_data = TensorDataset(torch.from_numpy(X_test), torch.from_numpy(Y_test))
+    t_test_data = TensorDataset(torch.from_numpy(T_test), torch.from_numpy(Y_test))
+
+
+    x_train_loader = DataLoader(x_train_data, shuffle=True, batch_size=FLAGS.batch_size)
+    t_train_loader = DataLoader(t_train_data, shuffle=True, batch_size=FLAGS.batch_size)
+    x_val_loader = DataLoader(x_val_data, shuffle=False, batch_size=FLAGS.batch_size)
+    t_val_loader = DataLoader(t_val_data, shuffle=False, batch_size=FLAGS.batch_size)
+    x_test_loader = DataLoader(x_test_data, shuffle=False, batch_size=FLAGS.batch_size)        
+    t_test_loader = DataLoader(t_test_data, shuffle=False, batch_size=FLAGS.batch_size)        
+
+
+    # ------- Compute class weights -------
+
+    class_weights = []
+    for i in range(n_outcomes):
+        y_train = Y_train[:, i]
+
+        class_1_prop = np.sum(y_train) / len(y_train)
+        class_0_prop = 1 - class_1_prop
+        outcome_class_weights = [1 / class_0_prop, 1 / class_1_prop]
+        outcome_class_weights /= np.sum(outcome_class_weights)
+        outcome_class_weights = torch.Tensor(outcome_class_weights)
+        class_weights.append(outcome_class_weights)
 
-x_train_data = TensorDataset(torch.from_numpy(X_train), torch.from_numpy(Y_train))       
-t_train_data = TensorDataset(torch.from_numpy(T_train), torch.from_numpy(Y_train))
-x_val_data = TensorDataset(torch.from_numpy(X_val), torch.from_numpy(Y_val))
-t_val_data = TensorDataset(torch.from_numpy(T_val), torch.from_numpy(Y_val))
-x_test_data = TensorDataset(torch.from_numpy(X_test), torch.from_numpy(Y_test))
-t_test_data = TensorDataset(torch.from_numpy(T_test), torch.from_numpy(Y_test))
-        
 
-x_train_loader = DataLoader(x_train_data, shuffle=True, batch_size=FLAGS.batch_size)
-t_train_loader = DataLoader(t_train_data, shuffle=True, batch_size=FLAGS.batch_size)
-x_val_loader = DataLoader(x_val_data, shuffle=False, batch_size=FLAGS.batch_size)
-t_val_loader = DataLoader(t_val_data, shuffle=False, batch_size=FLAGS.batch_size)
-x_test_loader = DataLoader(x_test_data, shuffle=False, batch_size=FLAGS.batch_size)        
-t_test_loader = DataLoader(t_test_data, shuffle=False, batch_size=FLAGS.batch_size)        
-  
 
-''' ------- Compute class weights ------- '''
-   
-class_weights = []
-for i in range(n_outcomes):
-    y_train = Y_train[:, i]
-
-    class_1_prop = np.sum(y_train) / len(y_train)
-    class_0_prop = 1 - class_1_prop
-    outcome_class_weights = [1 / class_0_prop, 1 / class_1_prop]
-    outcome_class_weights /= np.sum(outcome_class_weights)
-    outcome_class_weights = torch.Tensor(outcome_class_weights)
-    class_weights.append(outcome_class_weights)
-   
 ''' ------- Models ------- '''
 
 class x_MLP(nn.Module):
@@ -503,122 +516,131 @@ class meta_MLP(nn.Module):
         
         return x
     
-x_model = x_MLP(input_dim=X.shape[1],
-                hidden_dim=FLAGS.hidden_dim, 
-                output_dim=n_outcomes,
-                drop_prob=FLAGS.dropout_prob).to(device=device)
 
-t_model = t_MLP(hidden_dim=FLAGS.hidden_dim, 
-                output_dim=n_outcomes,
-                drop_prob=FLAGS.dropout_prob).to(device=device)
+def build_models():
+    """ Builds the models, optimizers, lr schedulers and criterions (sets the module globals) """
+    global x_model, t_model, meta_model, lambda_rule, x_update_lr, t_update_lr, m_update_lr, x_optim
+    global x_scheduler, t_optim, t_scheduler, m_optim, m_scheduler, x_criterions
+    global t_criterions, m_criterions
 
-meta_model = meta_MLP(hidden_dim=FLAGS.hidden_dim, 
-                      output_dim=n_outcomes,
-                      drop_prob=FLAGS.dropout_prob).to(device=device)
+    x_model = x_MLP(input_dim=X.shape[1],
+                    hidden_dim=FLAGS.hidden_dim, 
+                    output_dim=n_outcomes,
+                    drop_prob=FLAGS.dropout_prob).to(device=device)
 
+    t_model = t_MLP(hidden_dim=FLAGS.hidden_dim, 
+                    output_dim=n_outcomes,
+                    drop_prob=FLAGS.dropout_prob).to(device=device)
 
-''' ------- LR and optimizer ------- '''
+    meta_model = meta_MLP(hidden_dim=FLAGS.hidden_dim, 
+                          output_dim=n_outcomes,
+                          drop_prob=FLAGS.dropout_prob).to(device=device)
 
-if FLAGS.cyclic_lr == 1:
-    
-    x_optim = torch.optim.RMSprop(x_model.parameters(), 
-                                  lr=FLAGS.lr, 
-                                  weight_decay=FLAGS.weight_decay)   
-    
-    x_scheduler = lr_scheduler.CyclicLR(x_optim, 
-                                        base_lr = FLAGS.min_lr,
-                                        max_lr = FLAGS.lr,
-                                        step_size_up=100)
-    
-    t_optim = torch.optim.RMSprop(t_model.parameters(), 
-                                  lr=FLAGS.lr, 
-                                  weight_decay=FLAGS.weight_decay)   
-    
-    t_scheduler = lr_scheduler.CyclicLR(t_optim, 
-                                        base_lr = FLAGS.min_lr,
-                                        max_lr = FLAGS.lr,
-                                        step_size_up=100)
-    
-    m_optim = torch.optim.RMSprop(meta_model.parameters(), 
-                                  lr=FLAGS.lr, 
-                                  weight_decay=FLAGS.weight_decay)   
-    
-    m_scheduler = lr_scheduler.CyclicLR(m_optim, 
-                                        base_lr = FLAGS.min_lr,
-                                        max_lr = FLAGS.lr,
-                                        step_size_up=100)
-        
-else:
-    x_optim = torch.optim.Adam(x_model.parameters(), 
-                               lr=FLAGS.lr, 
-                               weight_decay=FLAGS.weight_decay)  
-    
-    t_optim = torch.optim.Adam(t_model.parameters(), 
-                               lr=FLAGS.lr, 
-                               weight_decay=FLAGS.weight_decay)  
-    
-    m_optim = torch.optim.Adam(meta_model.parameters(), 
-                               lr=FLAGS.lr, 
-                               weight_decay=FLAGS.weight_decay)  
- 
-    def lambda_rule(i_episode) -> float:
-        """ stepwise learning rate calculator """
-        exponent = int(np.floor((i_episode + 1) / FLAGS.decay_step_size))
-        return np.power(FLAGS.lr_decay_factor, exponent)
-    
-    x_scheduler = lr_scheduler.LambdaLR(x_optim, 
-                                        lr_lambda=lambda_rule) 
-    
-    t_scheduler = lr_scheduler.LambdaLR(t_optim, 
-                                        lr_lambda=lambda_rule) 
-    
-    m_scheduler = lr_scheduler.LambdaLR(m_optim, 
-                                        lr_lambda=lambda_rule) 
-    
-    def x_update_lr():
-        """ Learning rate updater """
-        
-        x_scheduler.step()
-        lr = x_optim.param_groups[0]['lr']
-        if lr < FLAGS.min_lr:
-            x_optim.param_groups[0]['lr'] = FLAGS.min_lr
+
+    # ------- LR and optimizer -------
+
+    if FLAGS.cyclic_lr == 1:
+
+        x_optim = torch.optim.RMSprop(x_model.parameters(), 
+                                      lr=FLAGS.lr, 
+                                      weight_decay=FLAGS.weight_decay)   
+
+        x_scheduler = lr_scheduler.CyclicLR(x_optim, 
+                                            base_lr = FLAGS.min_lr,
+                                            max_lr = FLAGS.lr,
+                                            step_size_up=100)
+
+        t_optim = torch.optim.RMSprop(t_model.parameters(), 
+                                      lr=FLAGS.lr, 
+                                      weight_decay=FLAGS.weight_decay)   
+
+        t_scheduler = lr_scheduler.CyclicLR(t_optim, 
+                                            base_lr = FLAGS.min_lr,
+                                            max_lr = FLAGS.lr,
+                                            step_size_up=100)
+
+        m_optim = torch.optim.RMSprop(meta_model.parameters(), 
+                                      lr=FLAGS.lr, 
+                                      weight_decay=FLAGS.weight_decay)   
+
+        m_scheduler = lr_scheduler.CyclicLR(m_optim, 
+                                            base_lr = FLAGS.min_lr,
+                                            max_lr = FLAGS.lr,
+                                            step_size_up=100)
+
+    else:
+        x_optim = torch.optim.Adam(x_model.parameters(), 
+                                   lr=FLAGS.lr, 
+                                   weight_decay=FLAGS.weight_decay)  
+
+        t_optim = torch.optim.Adam(t_model.parameters(), 
+                                   lr=FLAGS.lr, 
+                                   weight_decay=FLAGS.weight_decay)  
+
+        m_optim = torch.optim.Adam(meta_model.parameters(), 
+                                   lr=FLAGS.lr, 
+                                   weight_decay=FLAGS.weight_decay)  
+
+        def lambda_rule(i_episode) -> float:
+            """ stepwise learning rate calculator """
+            exponent = int(np.floor((i_episode + 1) / FLAGS.decay_step_size))
+            return np.power(FLAGS.lr_decay_factor, exponent)
+
+        x_scheduler = lr_scheduler.LambdaLR(x_optim, 
+                                            lr_lambda=lambda_rule) 
+
+        t_scheduler = lr_scheduler.LambdaLR(t_optim, 
+                                            lr_lambda=lambda_rule) 
+
+        m_scheduler = lr_scheduler.LambdaLR(m_optim, 
+                                            lr_lambda=lambda_rule) 
+
+        def x_update_lr():
+            """ Learning rate updater """
+
+            x_scheduler.step()
             lr = x_optim.param_groups[0]['lr']
-        print('Learning rate = %.7f' % lr) 
-            
-    def t_update_lr():
-        """ Learning rate updater """
-        
-        t_scheduler.step()
-        lr = t_optim.param_groups[0]['lr']
-        if lr < FLAGS.min_lr:
-            t_optim.param_groups[0]['lr'] = FLAGS.min_lr
+            if lr < FLAGS.min_lr:
+                x_optim.param_groups[0]['lr'] = FLAGS.min_lr
+                lr = x_optim.param_groups[0]['lr']
+            print('Learning rate = %.7f' % lr) 
+
+        def t_update_lr():
+            """ Learning rate updater """
+
+            t_scheduler.step()
             lr = t_optim.param_groups[0]['lr']
-        print('Learning rate = %.7f' % lr) 
-        
-    def m_update_lr():
-        """ Learning rate updater """
-        
-        m_scheduler.step()
-        lr = m_optim.param_groups[0]['lr']
-        if lr < FLAGS.min_lr:
-            m_optim.param_groups[0]['lr'] = FLAGS.min_lr
+            if lr < FLAGS.min_lr:
+                t_optim.param_groups[0]['lr'] = FLAGS.min_lr
+                lr = t_optim.param_groups[0]['lr']
+            print('Learning rate = %.7f' % lr) 
+
+        def m_update_lr():
+            """ Learning rate updater """
+
+            m_scheduler.step()
             lr = m_optim.param_groups[0]['lr']
-        print('Learning rate = %.7f' % lr) 
-            
-''' ------- Loss criterions ------- '''            
-  
-x_criterions = []
-for i in range(n_outcomes):
-    x_criterions.append(nn.BCELoss())    
-    
-t_criterions = []
-for i in range(n_outcomes):
-    t_criterions.append(nn.BCELoss())  
-    
-m_criterions = []
-for i in range(n_outcomes):
-    m_criterions.append(nn.BCELoss()) 
-    
+            if lr < FLAGS.min_lr:
+                m_optim.param_groups[0]['lr'] = FLAGS.min_lr
+                lr = m_optim.param_groups[0]['lr']
+            print('Learning rate = %.7f' % lr) 
+
+    # ------- Loss criterions -------
+
+    x_criterions = []
+    for i in range(n_outcomes):
+        x_criterions.append(nn.BCELoss())    
+
+    t_criterions = []
+    for i in range(n_outcomes):
+        t_criterions.append(nn.BCELoss())  
+
+    m_criterions = []
+    for i in range(n_outcomes):
+        m_criterions.append(nn.BCELoss()) 
+
+
+
 ''' ------- Train, val and test procedures ------- '''            
 
 def x_train_step(batch_x, batch_y):
@@ -682,7 +704,8 @@ def meta_train_step(batch_x, batch_y):
     return batch_output, loss.item()
 
 def x_run_validation():
-        
+    from sklearn.metrics import roc_auc_score
+
     x_model.train(False)
     
     print('Running validation')
@@ -716,7 +739,8 @@ def x_run_validation():
     return np.mean(losses), avg_auc, probs
 
 def t_run_validation():
-        
+    from sklearn.metrics import roc_auc_score
+
     t_model.train(False)
     
     print('Running validation')
@@ -884,7 +908,8 @@ def train_meta(x_probs, t_probs):
     save_model(epoch='best', modality='meta')
 
 def x_run_inference():
-        
+    from sklearn.metrics import roc_auc_score
+
     print('Running inference')
     
     # load best performing models
@@ -912,7 +937,8 @@ def x_run_inference():
     return probs, aucs, avg_auc
 
 def t_run_inference():
-        
+    from sklearn.metrics import roc_auc_score
+
     print('Running inference')
     
     # load best performing models
@@ -940,7 +966,8 @@ def t_run_inference():
     return probs, aucs, avg_auc
 
 def meta_run_inference(x_probs, t_probs):
-        
+    from sklearn.metrics import roc_auc_score
+
     print('Running inference')
     
     # load best performing models
@@ -1040,7 +1067,10 @@ def load_model(epoch: int,
 ''' ------- Model interpretation ------- '''         
     
 def interpret_x_model():
-    
+    import shap
+    import pandas as pd
+    import matplotlib.pyplot as plt
+
     train_sample_inds = np.random.randint(n_train, size=100)
     test_sample_inds = np.random.randint(n_test, size=100)
     print('Computing Shap values')
@@ -1080,7 +1110,10 @@ def interpret_x_model():
 
 
 def interpret_t_model():
-    
+    import shap
+    import pandas as pd
+    import matplotlib.pyplot as plt
+
     train_sample_inds = np.random.randint(n_train, size=100)
     test_sample_inds = np.random.randint(n_test, size=100)
     print('Computing Shap values')
@@ -1152,6 +1185,9 @@ def display_results(test_aucs_x, test_aucs_t, test_aucs_meta):
 
 def main():
     
+    reset_output_dirs()
+    load_data()
+    build_models()
     x_train()
     x_test_probs, x_test_aucs, _ = x_run_inference()
     t_train()